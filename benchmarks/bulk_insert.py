@@ -0,0 +1,100 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Bulk insert benchmark. Loads ROWS rows (1000000 by default) into
+SQLite stand-in database with Database library's bulk_insert(),
+executemany() and upsert() (every row conflicts, so all of them are
+updated), and SINGLE rows (20000 by default) by adding and committing
+ORM objects one by one, for comparison. Rows are generated on the fly,
+peak RSS is printed after every step.
+
+    python benchmarks/bulk_insert.py [--rows N] [--single N]
+        [--chunk-size N]
+
+copy_rows() falls back to bulk_insert() on SQLite, so it isn't
+measured here.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy.orm import Session, registry
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+import helpers
+
+metadata = MetaData()
+
+def get_table(name):
+    return Table(name, metadata, Column("id", Integer, primary_key = True), Column("name", String), Column("email", String), Column("score", Integer))
+
+bulk = get_table("bulk")
+many = get_table("many")
+single = get_table("single")
+
+class Row:
+    """
+    ORM class for rows inserted one by one.
+    """
+
+registry().map_imperatively(Row, single)
+
+def generate(count, suffix = ""):
+    for index in range(count):
+        yield {"id": index, "name": "user{0}{1}".format(index, suffix), "email": "user{0}@example.com".format(index), "score": index % 100}
+
+def measure(name, load, count):
+    started = time.perf_counter()
+    load()
+    duration = time.perf_counter() - started
+    print("{0:<16} {1:8} rows {2:8.2f} s {3:10.0f} rows/s, peak RSS {4:.0f} MB".format(name, count, duration, count / duration, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def insert_single(database, count):
+    with Session(database.get_database_connection()) as session:
+        for values in generate(count):
+            session.add(Row(**values))
+            session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Bulk insert benchmark.")
+    parser.add_argument("--rows", type = int, default = 1000000)
+    parser.add_argument("--single", type = int, default = 20000)
+    parser.add_argument("--chunk-size", type = int, default = 1000)
+    args = parser.parse_args()
+
+    database = helpers.Loader(helpers.get_config({"database": {"bulk_chunk_size": args.chunk_size}})).request_library("common_libs", "database")
+    path = database.create_standin_connection("main", replicas = 0)
+    try:
+        metadata.create_all(database.get_database_connection())
+
+        measure("bulk_insert()", lambda: database.bulk_insert(bulk, generate(args.rows)), args.rows)
+        measure("executemany()", lambda: database.executemany("INSERT INTO many (id, name, email, score) VALUES (:id, :name, :email, :score)", generate(args.rows)), args.rows)
+        measure("upsert()", lambda: database.upsert(bulk, generate(args.rows, "-updated")), args.rows)
+        measure("ORM, one by one", lambda: insert_single(database, args.single), args.single)
+    finally:
+        database.get_database_connection().dispose()
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Framing throughput benchmark. Feeds stream of frames into
+LineProtocol, LengthPrefixedProtocol and FixedSizeProtocol the way
+selector transport does it (get_buffer(-1), then buffer_updated()
+with as much data as fits, up to READ_SIZE bytes), without sockets,
+and reports MB/s, frames/s and number of reads of framing alone. For
+comparison same line stream is split by concatenating read buffer,
+as protocols did before BufferedProtocol.
+
+    python benchmarks/framing.py [--megabytes N] [--frame-size N]
+        [--read-size N]
+"""
+
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.common_libs.protocol import FixedSizeProtocol, LengthPrefixedProtocol, LineProtocol
+
+class Transport(asyncio.Transport):
+    """
+    Transport which is never closed and discards writes.
+    """
+
+    def is_closing(self):
+        return False
+
+    def writelines(self, data):
+        pass
+
+def counting(base):
+    """
+    Returns protocol class which only counts frames.
+    """
+    class Counting(base):
+        frames = 0
+
+        def frame_received(self, frame):
+            self.frames += 1
+
+    return Counting
+
+class Concatenating:
+    """
+    Line splitter with bytes read buffer, which is extended by every
+    read and trimmed by consumed frames.
+    """
+
+    frames = 0
+
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def data_received(self, data):
+        self.__buffer += data
+        position = 0
+        while True:
+            index = self.__buffer.find(b"\n", position)
+            if index < 0:
+                break
+            self.frame_received(bytes(self.__buffer[position:index]))
+            position = index + 1
+        del self.__buffer[:position]
+
+    def frame_received(self, frame):
+        self.frames += 1
+
+def feed_buffered(protocol, stream, read_size):
+    protocol.connection_made(Transport())
+    position = 0
+    reads = 0
+    while position < len(stream):
+        buffer = protocol.get_buffer(-1)
+        count = min(len(buffer), read_size, len(stream) - position)
+        buffer[:count] = stream[position:position + count]
+        protocol.buffer_updated(count)
+        position += count
+        reads += 1
+
+    return reads
+
+def feed_concatenating(protocol, stream, read_size):
+    for position in range(0, len(stream), read_size):
+        protocol.data_received(stream[position:position + read_size])
+
+    return len(range(0, len(stream), read_size))
+
+def measure(name, protocol, feed, stream, read_size):
+    started = time.perf_counter()
+    reads = feed(protocol, stream, read_size)
+    duration = time.perf_counter() - started
+    print("{0:<24} {1:8.1f} MB/s {2:12.0f} frames/s {3:8} reads".format(name, len(stream) / duration / 2 ** 20, protocol.frames / duration, reads))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Framing throughput benchmark.")
+    parser.add_argument("--megabytes", type = int, default = 64)
+    parser.add_argument("--frame-size", type = int, default = 64)
+    parser.add_argument("--read-size", type = int, default = 262144)
+    args = parser.parse_args()
+
+    count = args.megabytes * 2 ** 20 // args.frame_size
+    payload = b"x" * (args.frame_size - 1)
+    lines = (payload + b"\n") * count
+    prefixed = (struct.pack("!I", len(payload)) + payload) * count
+    fixed = (payload + b"\n") * count
+
+    fixed_size = counting(FixedSizeProtocol)
+    fixed_size.frame_size = args.frame_size
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    print("{0} frames of {1} bytes, reads of up to {2} bytes".format(count, args.frame_size, args.read_size))
+    measure("LineProtocol", counting(LineProtocol)(), feed_buffered, lines, args.read_size)
+    measure("LengthPrefixedProtocol", counting(LengthPrefixedProtocol)(), feed_buffered, prefixed, args.read_size)
+    measure("FixedSizeProtocol", fixed_size(), feed_buffered, fixed, args.read_size)
+    measure("concatenating lines", Concatenating(), feed_concatenating, lines, args.read_size)
+
+if __name__ == "__main__":
+    main()
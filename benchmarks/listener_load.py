@@ -0,0 +1,151 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Listener load generator. Starts Listener with echo line protocol in
+separate process and measures, from this process:
+
+    * connections/s - every connection is opened, sends one request,
+      reads response and is closed;
+    * requests/s - connections are kept open and are sending requests
+      one after another, waiting for every response.
+
+Both are measured with CONCURRENCY simultaneous clients.
+
+    python benchmarks/listener_load.py [--connections N] [--requests N]
+        [--concurrency N] [--mode single|prefork] [--workers N]
+        [--dispatch inline|thread|process]
+
+Client and server are sharing the machine, so results are relative.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+import helpers
+from lib.common_libs.protocol import LineProtocol
+
+class Echo(LineProtocol):
+    """
+    Responds with request.
+    """
+
+    @staticmethod
+    def process_request(request):
+        return bytes(request)
+
+helpers.register_protocol("echo", Echo)
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def run_listener(values):
+    helpers.Loader(helpers.get_config(values)).request_library("common_libs", "listener").start_listening()
+
+def wait_for_port(port, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+async def run_clients(concurrency, count, client):
+    """
+    Runs count client() calls, concurrency at a time. Returns number of
+    calls per second.
+    """
+    remaining = [count]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            await client()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for index in range(concurrency)])
+    return count / (time.perf_counter() - started)
+
+async def benchmark_connections(port, count, concurrency):
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"ping\n")
+        await reader.readline()
+        writer.close()
+        await writer.wait_closed()
+
+    return await run_clients(concurrency, count, client)
+
+async def benchmark_requests(port, count, concurrency):
+    connections = [await asyncio.open_connection("127.0.0.1", port) for index in range(concurrency)]
+    free = asyncio.Queue()
+    for connection in connections:
+        free.put_nowait(connection)
+
+    async def client():
+        reader, writer = await free.get()
+        writer.write(b"ping\n")
+        await reader.readline()
+        free.put_nowait((reader, writer))
+
+    result = await run_clients(concurrency, count, client)
+    for reader, writer in connections:
+        writer.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Listener load generator.")
+    parser.add_argument("--connections", type = int, default = 10000)
+    parser.add_argument("--requests", type = int, default = 100000)
+    parser.add_argument("--concurrency", type = int, default = 50)
+    parser.add_argument("--mode", default = "single")
+    parser.add_argument("--workers", type = int, default = 2)
+    parser.add_argument("--dispatch", default = "inline")
+    args = parser.parse_args()
+
+    port = get_free_port()
+    values = {
+        "eventloop": {"lag_interval": 0},
+        "listener": {"protocol": "echo", "address": "127.0.0.1", "port": port, "mode": args.mode, "workers": args.workers, "dispatch": args.dispatch, "backlog": 1024}
+    }
+    server = multiprocessing.get_context("fork").Process(target = run_listener, args = (values, ))
+    server.start()
+    try:
+        wait_for_port(port)
+        print("{0} mode, {1} dispatch, {2} concurrent clients".format(args.mode, args.dispatch, args.concurrency))
+        print("connections/s: {0:.0f}".format(asyncio.run(benchmark_connections(port, args.connections, args.concurrency))))
+        print("requests/s: {0:.0f}".format(asyncio.run(benchmark_requests(port, args.requests, args.concurrency))))
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(30)
+
+if __name__ == "__main__":
+    main()
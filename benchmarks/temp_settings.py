@@ -0,0 +1,139 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Temporary settings reads benchmark. Measures reads per second from
+Config library's temporary settings with get_temp_value(), through
+get_temp_snapshot() and through namespace view, and with previous
+get_temp_value() implementation (caller frame inspection and debug
+logging on every read) for comparison. Then measures total reads per
+second of THREADS reader threads while another thread keeps changing
+settings with set_temp_value().
+
+    python benchmarks/temp_settings.py [--reads N] [--threads N]
+        [--duration SECONDS]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+import helpers
+from lib.common_libs.config import Config
+
+class FrameInspecting:
+    """
+    Temporary settings reads as they were done before copy-on-write
+    dictionary.
+    """
+
+    def __init__(self, settings):
+        self.log = helpers.log
+        self.__temp_settings = settings
+
+    def get_temp_value(self, key):
+        if key in self.__temp_settings:
+            caller_class = sys._getframe(1).f_locals["self"].__class__.__name__
+            self.log(2, "Returning value for temporary variable to '{CYAN}{caller}{RESET}': '{key}' = '{value}'", {"caller": caller_class, "key": key, "value": self.__temp_settings[key]})
+            return self.__temp_settings[key]
+
+class Reader:
+    """
+    Reads temporary setting in loop. Readers are methods, as previous
+    get_temp_value() looked for caller's "self".
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def read_value(self, count):
+        get_temp_value = self.config.get_temp_value
+        for index in range(count):
+            get_temp_value("database/initialized")
+
+    def read_snapshot(self, count):
+        for index in range(count):
+            self.config.get_temp_snapshot()["database/initialized"]
+
+    def read_view(self, count):
+        view = self.config.get_temp_view("database")
+        for index in range(count):
+            view.get("initialized")
+
+    def read_until(self, stop, counter):
+        get_temp_value = self.config.get_temp_value
+        reads = 0
+        while not stop.is_set():
+            for index in range(1000):
+                get_temp_value("database/initialized")
+            reads += 1000
+        counter.append(reads)
+
+def measure(name, read, count):
+    started = time.perf_counter()
+    read(count)
+    print("{0:<28} {1:12.0f} reads/s".format(name, count / (time.perf_counter() - started)))
+
+def measure_threads(config, threads, duration):
+    stop = threading.Event()
+    counter = []
+    writes = [0]
+
+    def write():
+        while not stop.is_set():
+            config.set_temp_value("core/tick", writes[0])
+            writes[0] += 1
+
+    workers = [threading.Thread(target = Reader(config).read_until, args = (stop, counter)) for index in range(threads)]
+    workers.append(threading.Thread(target = write))
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    print("{0} readers and writer: {1:.0f} reads/s, {2:.0f} writes/s".format(threads, sum(counter) / elapsed, writes[0] / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Temporary settings reads benchmark.")
+    parser.add_argument("--reads", type = int, default = 1000000)
+    parser.add_argument("--threads", type = int, default = 4)
+    parser.add_argument("--duration", type = float, default = 2)
+    args = parser.parse_args()
+
+    config = Config()
+    config.log = helpers.log
+    for index in range(100):
+        config.set_temp_value("database/setting{0}".format(index), index)
+    config.set_temp_value("database/initialized", True)
+
+    measure("get_temp_value()", Reader(config).read_value, args.reads)
+    measure("get_temp_snapshot()[key]", Reader(config).read_snapshot, args.reads)
+    measure("get_temp_view().get()", Reader(config).read_view, args.reads)
+    measure("previous get_temp_value()", Reader(FrameInspecting(dict(config.get_temp_snapshot()))).read_value, args.reads)
+    measure_threads(config, args.threads, args.duration)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Timer benchmark: adds, fires and removes COUNT one-shot timers (100000
+by default) with Timer library, which keeps them in timing wheel, and
+with CallLaterTimer, copy of Timer before timing wheel, which keeps
+loop.call_later() handle per timer, and with bare loop.call_later()
+handles.
+
+    python benchmarks/timer_wheel.py [COUNT]
+
+Timers are spread over one second, starting in one second. Firing is
+measured in CPU time, as wall time is mostly waiting for timers.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+import helpers
+
+class Counter:
+    """
+    Counts calls of fire().
+    """
+    def __init__(self):
+        self.fired = [0]
+
+    def fire(self):
+        self.fired[0] += 1
+
+class CallLaterTimer:
+    """
+    Timer as it was before timing wheel: loop.call_later() handle per timer.
+    """
+    def __init__(self, loop, log):
+        self.log = log
+        self.timer_loop = loop
+        self.__tasks = {}
+
+    def add_timer(self, name, description, callback, timeout, repeatable):
+        if not name in self.__tasks:
+            self.log(1, "Adding timer: {name} | {description} | {class}.{callback} | {timeout}", {"name": name, "description": description, "class": callback.__self__.__class__.__name__, "callback": callback.__name__, "timeout": timeout})
+            task = self.timer_loop.call_later(timeout, self.timer_exec, {"callback": callback, "name": name})
+            self.__tasks[name] = {
+                "name"              : name,
+                "description"       : description,
+                "callback"          : callback,
+                "timeout"           : timeout,
+                "repeatable"        : repeatable,
+                "handle"            : task
+            }
+        else:
+            self.log(1, "Task '{BLUE}{name}{RESET}' already exists, will not add it until it will be removed.", {"name": name})
+
+    def timer_exec(self, args):
+        self.log(1, "Timer action! Callback: {0}".format(args["callback"]))
+        args["callback"]()
+        if args["name"] in self.__tasks:
+            data = self.__tasks[args["name"]]
+            self.remove_timer(data["name"])
+            if data["repeatable"]:
+                self.add_timer(data["name"], data["description"], data["callback"], data["timeout"], data["repeatable"])
+
+    def remove_timer(self, name):
+        if name in self.__tasks:
+            self.log(1, "Removing timer '{BLUE}{name}{RESET}'", {"name": name})
+            self.__tasks[name]["handle"].cancel()
+            del self.__tasks[name]
+        else:
+            self.log(1, "Task '{BLUE}{name}{RESET}' not found", {"name": name})
+
+def wait_for(loop, counter, count):
+    """
+    Runs loop until counter reaches count, returns CPU time spent.
+    """
+    async def wait():
+        while counter[0] < count:
+            await asyncio.sleep(0.05)
+
+    started = time.process_time()
+    loop.run_until_complete(wait())
+    return time.process_time() - started
+
+def benchmark_call_later(loop, count):
+    fired = [0]
+    def callback():
+        fired[0] += 1
+
+    started = time.perf_counter()
+    handles = [loop.call_later(1 + index / count, callback) for index in range(count)]
+    add = time.perf_counter() - started
+
+    fire = wait_for(loop, fired, count)
+
+    handles = [loop.call_later(3600, callback) for index in range(count)]
+    started = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    remove = time.perf_counter() - started
+    # Cancelled handles are removed from loop's heap on next iterations.
+    loop.run_until_complete(asyncio.sleep(0))
+
+    return add, fire, remove
+
+def benchmark_timer(timer, count):
+    counter = Counter()
+    fired = counter.fired
+    callback = counter.fire
+
+    started = time.perf_counter()
+    for index in range(count):
+        timer.add_timer("timer{0}".format(index), "Benchmark timer", callback, 1 + index / count, False)
+    add = time.perf_counter() - started
+
+    fire = wait_for(timer.timer_loop, fired, count)
+
+    for index in range(count):
+        timer.add_timer("timer{0}".format(index), "Benchmark timer", callback, 3600, False)
+    started = time.perf_counter()
+    for index in range(count):
+        timer.remove_timer("timer{0}".format(index))
+    remove = time.perf_counter() - started
+
+    # Cancelled handles of call_later() timer are removed from loop's
+    # heap on next iterations.
+    timer.timer_loop.run_until_complete(asyncio.sleep(0))
+
+    return add, fire, remove
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    schedule_file = os.path.join(tempfile.mkdtemp(prefix = "regius-"), "timers.json")
+    timer = helpers.Loader(helpers.get_config({"eventloop": {"lag_interval": 0}, "timer": {"schedule_file": schedule_file}})).request_library("common_libs", "timer")
+
+    print("{0} timers".format(count))
+    print("{0:<12} {1:>12} {2:>12} {3:>12}".format("", "add, s", "fire, cpu s", "remove, s"))
+    benchmarks = (
+        ("call_later", lambda: benchmark_call_later(timer.timer_loop, count)),
+        ("old timer", lambda: benchmark_timer(CallLaterTimer(timer.timer_loop, timer.log), count)),
+        ("wheel", lambda: benchmark_timer(timer, count)),
+    )
+    for name, benchmark in benchmarks:
+        result = benchmark()
+        print("{0:<12} {1:>12.3f} {2:>12.3f} {3:>12.3f}".format(name, *result))
+
+if __name__ == "__main__":
+    main()
@@ -18,14 +18,19 @@
 # Configuration library.
 
 import os
-import sys
+import threading
+import time
+import types
 
 from lib.common_libs import common
+from lib.common_libs.exception import RegiusException
 from lib.common_libs.library import Library
 
 # Configuration classes.
+from lib.common_libs.config_types.cache import Cache
 from lib.common_libs.config_types.ini import INI
 from lib.common_libs.config_types.json import JSON
+from lib.common_libs.config_types.watcher import Watcher
 
 class Config(Library):
     """
@@ -35,8 +40,58 @@ class Config(Library):
     Also, this class is responsible for temporary configuration things,
     so any temporary variables should be set like:
     self.config.set_temp_value(k, v).
+
+    Temporary settings are copy-on-write: every change creates new
+    dictionary which replaces current one, so get_temp_value() and
+    get_temp_snapshot() are reading without locks and never see
+    half-applied changes. Temporary settings names are usually
+    namespaced, like "core/initialized" - get_temp_view() returns view
+    for one namespace. Libraries might subscribe_temp_value() for
+    changes.
+
+    Values from all backends are merged into one snapshot dictionary,
+    (group, key) => value, so get_value("all", ...) is a single
+    dictionary lookup. Snapshot is rebuilt on first lookup after
+    configuration was loaded or changed with set_value().
+
+    Libraries and plugins should describe their configuration with
+    register_schema(): type, default value and optional validator for
+    every key. Values of described keys are parsed and validated once,
+    when snapshot is built, so get_value() returns ready to use values
+    (or defaults, if key isn't configured). Invalid configuration is a
+    critical error, application will not start with it.
+
+    If "config/watch" is enabled, watch_configuration() starts watching
+    configuration directories (see
+    lib.common_libs.config_types.watcher.Watcher), and changed INI and
+    JSON files are re-read without restart. Libraries which want to
+    apply new values should subscribe() for changes. Invalid values
+    found on re-reading are logged and ignored, previous values are
+    kept.
+
+    Parsed INI and JSON files are cached between runs (see
+    lib.common_libs.config_types.cache.Cache), so only changed files
+    are parsed on startup. Cache can be disabled with "config_cache"
+    preseed parameter.
+
+    Only changed backends are saved by save_configuration(). JSON
+    configuration changed with set_value() is also saved in background
+    "config/save_delay" seconds (1 by default, 0 disables it) after last
+    change, so bursts of changes are producing one write. Qt-related
+    configuration is saved by save_configuration() only, as QSettings
+    should not be used from other threads.
     """
 
+    # Environment variables which are available as "env" temporary
+    # value.
+    ENV_VARIABLES = ("DEBUG",)
+
+    # Strings which are considered as boolean values.
+    BOOLEAN_VALUES = {
+        "1": True, "true": True, "yes": True, "on": True,
+        "0": False, "false": False, "no": False, "off": False
+    }
+
     _info = {
         "name"          : "Configuration library",
         "shortname"     : "config",
@@ -46,11 +101,40 @@ class Config(Library):
     def __init__(self):
         Library.__init__(self)
 
-        # Temporary configuration settings
+        # Temporary configuration settings. This dictionary is never
+        # changed, it is replaced on every change.
         self.__temp_settings = {}
+        self.__temp_lock = threading.Lock()
+        # Temporary settings subscribers, list of (callback, namespace).
+        self.__temp_subscribers = []
         # Persistent configuration.
         # Can be obtained from files, or database.
         self.__config = {}
+        # Merged configuration from all backends, (group, key) => value.
+        # None if it should be rebuilt.
+        self.__snapshot = None
+        # Configuration schema, (group, key) => {type, default, validator}.
+        self.__schema = {}
+        # Invalid values ignored on reloading, (group, key) => (invalid
+        # value, last valid value). Last valid value is used until
+        # value is changed again, also when snapshot is rebuilt after
+        # set_value().
+        self.__rejected = {}
+        # Configuration changes subscribers, list of (callback, group).
+        self.__subscribers = []
+        self.__watcher = None
+        self.__cache = None
+        # Background saving thread, time (monotonic) when pending JSON
+        # changes should be saved (None if nothing is pending) and
+        # condition which protects this time.
+        self.__save_thread = None
+        self.__save_deadline = None
+        self.__save_condition = threading.Condition()
+        # Lock which protects JSON configuration while it is changed,
+        # re-read or saved.
+        self.__save_lock = threading.RLock()
+        # Configuration values from environment, (group, key) => value.
+        self.__env = {}
 
     def get_available_backends(self):
         """
@@ -85,21 +169,40 @@ class Config(Library):
 
             return keys
 
+    def get_temp_snapshot(self):
+        """
+        Returns read-only snapshot of all temporary settings. It will
+        not be changed by subsequent set_temp_value() calls.
+        """
+        return types.MappingProxyType(self.__temp_settings)
+
     def get_temp_value(self, key):
         """
         Returns item from temporary configuration if it exists.
         Otherwise return None.
         """
-        if key in self.__temp_settings:
-            caller_class = sys._getframe(1).f_locals["self"].__class__.__name__
-            self.log(2, "Returning value for temporary variable to '{CYAN}{caller}{RESET}': '{key}' = '{value}'", {"caller": caller_class, "key": key, "value": self.__temp_settings[key]})
-            return self.__temp_settings[key]
+        return self.__temp_settings.get(key)
+
+    def get_temp_view(self, namespace):
+        """
+        Returns view for temporary settings namespace.
+
+        @param namespace Namespace name, like "core" or "database".
+        @retval view TempSettingsView instance.
+        """
+        return TempSettingsView(self, namespace)
 
     def get_value(self, type, group, key):
         """
         Returns a value for 'key' in 'group' from configuration
         storage 'type'.
         """
+        if type == "all":
+            snapshot = self.__snapshot
+            if snapshot is None:
+                snapshot = self.__build_snapshot()
+            return snapshot.get((group, key))
+
         return_data = None
         if type == "qsettings":
             if self.__qconfig:
@@ -108,23 +211,6 @@ class Config(Library):
             return_data = self.__json.get_value(group, key)
         elif type == "ini":
             return_data = self.__ini.get_value(group, key)
-        elif type == "all":
-            ini = self.__ini.get_value(group, key)
-            json = self.__json.get_value(group, key)
-            if self.__qconfig:
-                qsettings = self.__qconfig.get_value(group, key)
-
-            # Our preference - QConfig, then JSON, then INI. Only latter
-            # will be returned.
-            if ini:
-                return_data = ini
-
-            if json:
-                return_data = json
-
-            if self.__qconfig:
-                if qsettings:
-                    return_data = qsettings
 
         # We do not want passwords to appear in logs, aren't we?
         value_for_log = return_data
@@ -159,11 +245,18 @@ class Config(Library):
         self.__ini = INI(self.log, self.loader)
 
         # Update self.__temp_settings with values from common.TEMP_SETTINGS.
-        self.__temp_settings.update(common.TEMP_SETTINGS)
+        self.__update_temp_values(common.TEMP_SETTINGS)
 
         # Someday it will be dynamic.
         self.__available_backends = ["JSON", "INI", "QConfig"]
 
+        self.register_schema("config", {
+            "watch"             : {"type": bool, "default": False},
+            "watch_interval"    : {"type": float, "default": 2, "validator": lambda value: value > 0},
+            "save_delay"        : {"type": float, "default": 1, "validator": lambda value: value >= 0},
+            "env_prefix"        : {"type": str, "default": "REGIUS_"}
+        })
+
     def load_configuration_from_files(self, preseed):
         """
         Load configuration from preseed file.
@@ -188,54 +281,485 @@ class Config(Library):
 
         self.log(0, "Configuration path: {cfg_path}", {"cfg_path": cfg_path})
 
-        self.__ini.load_configuration(preseed["preseed"]["app_name"], cfg_path)
-        self.__json.load_configuration(preseed["preseed"]["app_name"], cfg_path)
-        self.__temp_settings.update(preseed)
+        if preseed["preseed"].get("config_cache", True):
+            self.__cache = Cache(self.log, os.path.expanduser(os.path.join("~/", ".config/", "regius", preseed["preseed"]["app_name"], "config.cache")))
+            self.__cache.load()
+
+        self.__ini.load_configuration(preseed["preseed"]["app_name"], cfg_path, self.__cache)
+        self.__json.load_configuration(preseed["preseed"]["app_name"], cfg_path, self.__cache)
+        self.__update_temp_values(preseed)
+        if self.__cache:
+            self.__cache.save()
+
+        # Build snapshot right away, so invalid configuration will be
+        # found on startup.
+        self.__build_snapshot()
+
+    def on_shutdown(self):
+        """
+        Stops configuration watcher and saves pending changes.
+        """
+        if self.__watcher:
+            self.__watcher.stop()
+            self.__watcher = None
+
+        if self.__cancel_save():
+            self.__save_json()
 
     def parse_env(self):
         """
         This method parses environment variables.
+
+        Variables named like {prefix}{GROUP}__{KEY}, where prefix is
+        "config/env_prefix" ("REGIUS_" by default), are overriding
+        configuration values, e.g. REGIUS_DATABASE__MAIN_HOST overrides
+        "main_host" in "database" group. Values are parsed as described
+        in schema, or converted to integers if they are numeric.
+
+        Variables from ENV_VARIABLES are available as "env" temporary
+        value. Other environment isn't copied.
+        """
+        env = {}
+        for env_key in self.ENV_VARIABLES:
+            if env_key in os.environ:
+                env[env_key] = os.environ[env_key]
+        self.__update_temp_values({"env": env})
+
+        prefix = self.get_value("all", "config", "env_prefix")
+        self.__env = {}
+        for env_key, value in os.environ.items():
+            if not env_key.startswith(prefix) or not "__" in env_key:
+                continue
+
+            group, key = env_key[len(prefix):].lower().split("__", 1)
+            if group and key:
+                self.__env[(group, key)] = value
+
+        if self.__env:
+            self.log(1, "Configuration values from environment: {keys}", {"keys": ", ".join(sorted(["{0}/{1}".format(group, key) for group, key in self.__env]))})
+
+        self.__build_snapshot()
+
+    def register_schema(self, group, schema):
+        """
+        Registers configuration schema for group. Configured values are
+        parsed and validated right away.
+
+        @param group Configuration group.
+        @param schema Dictionary key => description, where description
+        is a dictionary with "type" (str, int, float, bool or any
+        callable which converts string to value), "default" (returned
+        if key isn't configured, None by default) and "validator"
+        (optional callable which receives parsed value and returns
+        False if it is invalid).
+        """
+        for key, description in schema.items():
+            self.__schema[(group, key)] = {
+                "type"          : description.get("type", str),
+                "default"       : description.get("default"),
+                "validator"     : description.get("validator")
+            }
+
+        self.__build_snapshot()
+
+    def reload_configuration(self):
+        """
+        Re-reads changed configuration files and notifies subscribers
+        about changed values.
+
+        @retval changes Dictionary (group, key) => (old value, new value).
         """
-        if not "env" in self.__temp_settings:
-            self.__temp_settings["env"] = {}
+        snapshot = self.__snapshot
+        if snapshot is None:
+            snapshot = self.__build_snapshot()
+
+        # JSON configuration must not be changed or saved while it is
+        # merged with re-read file.
+        with self.__save_lock:
+            changed = False
+            for backend in (self.__ini, self.__json):
+                if backend.reload():
+                    changed = True
+
+            if not changed:
+                return {}
+
+            if self.__cache:
+                self.__cache.save()
+
+            new_snapshot = self.__build_snapshot(reloading = True)
+
+        changes = {}
+        for item in snapshot.keys() | new_snapshot.keys():
+            if snapshot.get(item) != new_snapshot.get(item):
+                changes[item] = (snapshot.get(item), new_snapshot.get(item))
+
+        self.log(0, "Configuration reloaded, {count} values changed", {"count": len(changes)})
+        if changes:
+            self.log(1, "Changed values: {keys}", {"keys": ", ".join(sorted(["{0}/{1}".format(group, key) for group, key in changes]))})
+
+        for callback, group in list(self.__subscribers):
+            if group:
+                group_changes = {item: value for item, value in changes.items() if item[0] == group}
+            else:
+                group_changes = changes
+
+            if not group_changes:
+                continue
 
-        for env_key in os.environ.keys():
-            self.__temp_settings["env"][env_key] = os.environ[env_key]
+            try:
+                callback(group_changes)
+            except Exception as e:
+                self.log(0, "{RED}ERROR:{RESET} configuration changes subscriber failed: {error}", {"error": repr(e)})
+
+        return changes
 
     def save_configuration(self):
         """
-        Force configuration to be saved.
+        Force configuration to be saved. Only changed backends are
+        saved, except Qt-related configuration, which also contains
+        main window's size and position.
         """
         self.log(0, "Saving configuration...")
+        self.__cancel_save()
+
         if self.__qconfig:
             result = self.__qconfig.save_configuration()
 
             if result:
                 self.log(0, "{RED}ERROR:{RESET} failed to save Qt-related configuration!")
 
-        result = self.__json.save_configuration()
-        if result:
-            self.log(0, "{RED}ERROR:{RESET} failed to save JSON configuration!")
+        self.__save_json()
 
-        result = self.__ini.save_configuration()
-        if result:
-            self.log(0, "{RED}ERROR:{RESET} failed to save INI configuration!")
+        if self.__ini.is_dirty():
+            result = self.__ini.save_configuration()
+            if result:
+                self.log(0, "{RED}ERROR:{RESET} failed to save INI configuration!")
 
     def set_temp_value(self, key, value):
         """
         Sets (or overwrites) temporary variable.
         """
         self.log(1, "Setting temporary variable: '{key}' => '{value}'", {"key": key, "value": value})
-        self.__temp_settings[key] = value
+        self.__update_temp_values({key: value})
 
     def set_value(self, type, group, key, value):
         """
         Sets 'value' for 'key' in 'group' from configuration storage
-        'type'.
+        'type'. Values for keys described in schema are validated.
         """
+        if (group, key) in self.__schema:
+            try:
+                self.__parse_value(self.__schema[(group, key)], value)
+            except ValueError as e:
+                self.log(0, "{RED}ERROR{RESET}: refusing to set invalid value for '{CYAN}{key}{RESET}': {error}", {"key": "{0}/{1}".format(group, key), "error": e})
+                return
+
         if type == "qsettings":
             self.__qconfig.set_value(group, key, value)
         elif type == "json":
-            self.__json.set_value(group, key, value)
+            with self.__save_lock:
+                self.__json.set_value(group, key, value)
+            self.__schedule_save()
         else:
             self.log(0, "{RED}ERROR{RESET}: unsupported configuration storage: '{CYAN}{type}{RESET}'", {"type": type})
+            return
+
+        self.__snapshot = None
+
+    def subscribe(self, callback, group = None):
+        """
+        Subscribes callback for configuration changes made by
+        reload_configuration(). Callback is executed with dictionary
+        (group, key) => (old value, new value).
+
+        @param callback Callable.
+        @param group Notify only about changes in this group. All
+        changes by default.
+        """
+        self.__subscribers.append((callback, group))
+
+    def subscribe_temp_value(self, callback, namespace = None):
+        """
+        Subscribes callback for temporary settings changes. Callback is
+        executed with key, old value and new value.
+
+        @param callback Callable.
+        @param namespace Notify only about changes in this namespace.
+        All changes by default.
+        """
+        self.__temp_subscribers.append((callback, namespace))
+
+    def unsubscribe(self, callback):
+        """
+        Removes callback from configuration changes subscribers.
+        """
+        self.__subscribers = [item for item in self.__subscribers if item[0] != callback]
+
+    def unsubscribe_temp_value(self, callback):
+        """
+        Removes callback from temporary settings subscribers.
+        """
+        self.__temp_subscribers = [item for item in self.__temp_subscribers if item[0] != callback]
+
+    def watch_configuration(self):
+        """
+        Starts watching configuration files for changes, if
+        "config/watch" is enabled. Uses shared event loop.
+        """
+        if self.__watcher or not self.get_value("all", "config", "watch"):
+            return
+
+        directories = []
+        for directory in self.__ini.get_directories() + self.__json.get_directories():
+            if not directory in directories:
+                directories.append(directory)
+
+        eventloop = self.loader.request_library("common_libs", "eventloop")
+        # Forked processes (like Listener workers) have own loops.
+        eventloop.add_loop_callback(self.__on_loop_recreated)
+
+        self.__watcher = Watcher(self.log, eventloop.get_loop(), directories, self.reload_configuration, self.get_value("all", "config", "watch_interval"))
+        self.__watcher.start()
+
+    def __build_snapshot(self, reloading = False):
+        """
+        Merges configuration from all backends into snapshot.
+
+        Our preference - environment, then QConfig, then JSON, then
+        INI. Empty values are not overriding values from less preferred
+        backends.
+
+        @param reloading If True - invalid values are logged and
+        previous values are used, instead of raising exception. Values
+        ignored this way stay ignored on later builds.
+        @retval snapshot Snapshot dictionary.
+        """
+        self.log(2, "Building configuration snapshot...")
+        backends = [self.__ini, self.__json]
+        if self.__qconfig:
+            backends.append(self.__qconfig)
+
+        snapshot = {}
+        # Values for keys described in schema. Values like 0 or False
+        # are meaningful for them.
+        configured = {}
+        for backend in backends:
+            for group, values in backend.get_configuration().items():
+                if not isinstance(values, dict):
+                    continue
+                for key, value in values.items():
+                    if value:
+                        snapshot[(group, key)] = value
+                    if (group, key) in self.__schema and value is not None and value != "":
+                        configured[(group, key)] = value
+
+        for (group, key), value in self.__env.items():
+            if (group, key) in self.__schema:
+                if value != "":
+                    configured[(group, key)] = value
+            elif value:
+                try:
+                    snapshot[(group, key)] = int(value)
+                except ValueError:
+                    snapshot[(group, key)] = value
+
+        for (group, key), description in self.__schema.items():
+            if not (group, key) in configured:
+                snapshot[(group, key)] = description["default"]
+                continue
+
+            value = configured[(group, key)]
+            try:
+                snapshot[(group, key)] = self.__parse_value(description, value)
+            except ValueError as e:
+                rejected = self.__rejected.get((group, key))
+                if rejected and rejected[0] == value:
+                    snapshot[(group, key)] = rejected[1]
+                    continue
+
+                if not reloading:
+                    raise ConfigurationException(group, key, value, e)
+
+                self.log(0, "{RED}ERROR:{RESET} invalid configuration value for '{CYAN}{key}{RESET}' ignored: {error}", {"key": "{0}/{1}".format(group, key), "error": e})
+                snapshot[(group, key)] = self.__snapshot.get((group, key), description["default"])
+                self.__rejected[(group, key)] = (value, snapshot[(group, key)])
+            else:
+                self.__rejected.pop((group, key), None)
+
+        self.__snapshot = snapshot
+        return snapshot
+
+    def __cancel_save(self):
+        """
+        Cancels pending background saving.
+
+        @retval pending True if saving was pending.
+        """
+        with self.__save_condition:
+            pending = self.__save_deadline is not None
+            self.__save_deadline = None
+            return pending
+
+    def __on_loop_recreated(self, loop):
+        """
+        Re-creates configuration watcher on new event loop.
+        """
+        if not self.__watcher:
+            return
+
+        directories = self.__watcher.get_directories()
+        self.__watcher.stop()
+        self.__watcher = Watcher(self.log, loop, directories, self.reload_configuration, self.get_value("all", "config", "watch_interval"))
+        self.__watcher.start()
+
+    def __parse_value(self, description, value):
+        """
+        Converts value to type from schema and validates it.
+
+        @raises ValueError If value can't be converted or is invalid.
+        @retval value Parsed value.
+        """
+        converter = description["type"]
+        if converter is bool:
+            if not isinstance(value, bool):
+                if not str(value).lower() in self.BOOLEAN_VALUES:
+                    raise ValueError("'{0}' is not a boolean value".format(value))
+                value = self.BOOLEAN_VALUES[str(value).lower()]
+        elif not (isinstance(converter, type) and isinstance(value, converter)):
+            try:
+                value = converter(value)
+            except (TypeError, ValueError) as e:
+                raise ValueError("'{0}' can't be converted: {1}".format(value, e))
+
+        if description["validator"] and not description["validator"](value):
+            raise ValueError("'{0}' is not valid".format(value))
+
+        return value
+
+    def __save_json(self):
+        """
+        Saves JSON configuration if it was changed.
+        """
+        with self.__save_lock:
+            if not self.__json.is_dirty():
+                return
+
+            result = self.__json.save_configuration()
+
+        if result:
+            self.log(0, "{RED}ERROR:{RESET} failed to save JSON configuration!")
+
+    def __saver(self):
+        """
+        Background saving thread. Saves JSON configuration when pending
+        changes deadline passes.
+        """
+        while True:
+            with self.__save_condition:
+                while self.__save_deadline is None or self.__save_deadline > time.monotonic():
+                    timeout = None
+                    if self.__save_deadline is not None:
+                        timeout = self.__save_deadline - time.monotonic()
+                    self.__save_condition.wait(timeout)
+                self.__save_deadline = None
+
+            self.__save_json()
+
+    def __schedule_save(self):
+        """
+        Moves background saving deadline, starting saving thread if it
+        isn't running yet.
+        """
+        delay = self.get_value("all", "config", "save_delay")
+        if not delay:
+            return
+
+        with self.__save_condition:
+            self.__save_deadline = time.monotonic() + delay
+            # Thread is checked for being alive, as it doesn't survive
+            # fork.
+            if not self.__save_thread or not self.__save_thread.is_alive():
+                self.__save_thread = threading.Thread(target = self.__saver, name = "config-saver", daemon = True)
+                self.__save_thread.start()
+            self.__save_condition.notify()
+
+    def __update_temp_values(self, values):
+        """
+        Replaces temporary settings with updated copy and notifies
+        subscribers.
+        """
+        with self.__temp_lock:
+            old_settings = self.__temp_settings
+            new_settings = dict(old_settings)
+            new_settings.update(values)
+            self.__temp_settings = new_settings
+
+        if not self.__temp_subscribers:
+            return
+
+        for key, value in values.items():
+            old_value = old_settings.get(key)
+            if old_value is value:
+                continue
+
+            for callback, namespace in list(self.__temp_subscribers):
+                if namespace and not str(key).startswith(namespace + "/"):
+                    continue
+
+                try:
+                    callback(key, old_value, value)
+                except Exception as e:
+                    self.log(0, "{RED}ERROR:{RESET} temporary settings subscriber failed: {error}", {"error": repr(e)})
+
+class TempSettingsView:
+    """
+    View for one namespace of temporary settings. Keys are passed
+    without namespace, so view.get("initialized") for "core" namespace
+    returns "core/initialized" temporary setting.
+    """
+    def __init__(self, config, namespace):
+        """
+        @param config Config library instance.
+        @param namespace Namespace name.
+        """
+        self.__config = config
+        self.__prefix = namespace + "/"
+
+    def get(self, key):
+        """
+        Returns temporary setting value, or None.
+        """
+        return self.__config.get_temp_value(self.__prefix + key)
+
+    def items(self):
+        """
+        Returns a dictionary with all namespace's temporary settings,
+        key without namespace => value.
+        """
+        length = len(self.__prefix)
+        return {key[length:]: value for key, value in self.__config.get_temp_snapshot().items() if isinstance(key, str) and key.startswith(self.__prefix)}
+
+    def set(self, key, value):
+        """
+        Sets temporary setting value.
+        """
+        self.__config.set_temp_value(self.__prefix + key, value)
+
+class ConfigurationException(RegiusException):
+    """
+    This exception appears on invalid configuration value.
+    """
+    def __init__(self, group, key, value, error):
+        """
+        @param group Configuration group.
+        @param key Configuration key.
+        @param value Invalid value.
+        @param error Error description.
+        """
+        RegiusException.__init__(self)
+
+        self.start_exception()
+        self.log(0, "Invalid configuration value for '{CYAN}{key}{RESET}': {error}", {"key": "{0}/{1}".format(group, key), "error": error})
+        self.set_critical()
+        self.end_exception()
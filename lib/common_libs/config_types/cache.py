@@ -0,0 +1,119 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import pickle
+
+class Cache:
+    """
+    Cache of parsed configuration files, kept between application
+    runs.
+
+    Parsed files contents are stored with file's stamp (modification
+    time and size), so configuration backends are parsing only files
+    which were changed since previous run. Cache is stored in one
+    pickle file. Files which weren't requested since cache was loaded
+    are removed from cache on saving.
+    """
+
+    # Cache format version. Cache in other format will be ignored.
+    VERSION = 1
+
+    def __init__(self, logger, path):
+        self.log = logger
+        self.__path = path
+
+        # File path => (stamp, parsed data).
+        self.__fragments = {}
+        # Paths requested since cache was loaded.
+        self.__used = set()
+        self.__changed = False
+
+    def get(self, path, stamp):
+        """
+        Returns parsed data for file if it is cached with same stamp.
+        Otherwise returns None.
+
+        @param path File path.
+        @param stamp File stamp, (modification time, size).
+        """
+        self.__used.add(path)
+        if path in self.__fragments and self.__fragments[path][0] == stamp:
+            return self.__fragments[path][1]
+
+    def load(self):
+        """
+        Loads cache from disk. Broken or outdated cache is ignored.
+        """
+        if not os.path.exists(self.__path):
+            return
+
+        try:
+            with open(self.__path, "rb") as cache:
+                data = pickle.load(cache)
+        except Exception as e:
+            self.log(0, "{YELLOW}Warning{RESET}: configuration cache is unusable: {error}", {"error": repr(e)})
+            return
+
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            self.log(1, "Configuration cache is outdated, ignoring it")
+            return
+
+        self.__fragments = data["fragments"]
+        self.log(2, "Loaded {count} parsed configuration files from cache", {"count": len(self.__fragments)})
+
+    def save(self):
+        """
+        Saves cache to disk, if it was changed. Cache is written to
+        temporary file which then replaces old cache, so it is never
+        left half-written.
+        """
+        unused = self.__fragments.keys() - self.__used
+        if not self.__changed and not unused:
+            return
+
+        for path in unused:
+            del self.__fragments[path]
+
+        data = {
+            "version"       : self.VERSION,
+            "fragments"     : self.__fragments
+        }
+
+        temp_path = self.__path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.__path), exist_ok = True)
+            with open(temp_path, "wb") as cache:
+                pickle.dump(data, cache, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.__path)
+        except OSError as e:
+            self.log(0, "{YELLOW}Warning{RESET}: failed to save configuration cache: {error}", {"error": e})
+            return
+
+        self.__changed = False
+
+    def set(self, path, stamp, data):
+        """
+        Puts parsed file data into cache.
+
+        @param path File path.
+        @param stamp File stamp, (modification time, size).
+        @param data Parsed data.
+        """
+        self.__used.add(path)
+        self.__fragments[path] = (stamp, data)
+        self.__changed = True
@@ -31,6 +31,34 @@ class INI:
         self.loader = loader
         self.log = logger
         self.__config = {}
+        # Parsed files, path => {stamp, config}.
+        self.__files = {}
+        # Parsed files cache, lib.common_libs.config_types.cache.Cache.
+        self.__cache = None
+
+    def get_configuration(self):
+        """
+        Returns whole configuration as 2-level dictionary, without
+        internal keys. Numeric values are converted to integers.
+        """
+        config = {}
+        for group in self.__config:
+            config[group] = {}
+            for key, value in self.__config[group].items():
+                if key.startswith("__"):
+                    continue
+                try:
+                    config[group][key] = int(value)
+                except ValueError:
+                    config[group][key] = value
+
+        return config
+
+    def get_directories(self):
+        """
+        Returns a list of directories with configuration files.
+        """
+        return [self.__cfg_dir]
 
     def get_keys_for_group(self, group):
         """
@@ -67,9 +95,16 @@ class INI:
         except:
             return self.__config[group][key]
 
-    def load_configuration(self, app_name, config_path = None):
+    def is_dirty(self):
         """
-        Reads configuration from JSON file into dict.
+        Returns True if configuration was changed since last saving.
+        INI configuration is read-only for now.
+        """
+        return False
+
+    def load_configuration(self, app_name, config_path = None, cache = None):
+        """
+        Reads configuration from INI files into dict.
         """
         self.__app_name = app_name
         if not config_path:
@@ -79,23 +114,72 @@ class INI:
         self.__main_cfg = os.path.join(self.__cfg_dir, "config.ini")
 
         self.log(0, "Reading INI configuration...")
+        self.log(1, "Loading configuration from '{MAGENTA}{cfg_dir}{RESET}'...", {"cfg_dir": self.__cfg_dir})
+        self.__cache = cache
+        self.__files = {}
+        self.reload()
 
-        config = configparser.ConfigParser()
-        cfg = config.read(self.__main_cfg)
+    def reload(self):
+        """
+        Re-reads configuration files which were changed since last
+        reading, and rebuilds configuration dictionary if something
+        was changed. Unchanged files are not parsed again.
+
+        @retval changed True if configuration was changed.
+        """
+        # config.ini first, then all files from configuration directory
+        # in sorted order.
+        paths = [self.__main_cfg]
+        if os.path.exists(self.__cfg_dir):
+            for name in sorted(os.listdir(self.__cfg_dir)):
+                if name.endswith("ini"):
+                    paths.append(os.path.join(self.__cfg_dir, name))
+
+        changed = False
+        files = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if path in self.__files and self.__files[path]["stamp"] == stamp:
+                files[path] = self.__files[path]
+                continue
 
-        self.log(2, "Loading config.ini...")
-        for section in config.keys():
-            if not section in self.__config:
-                self.__config[section] = {
-                    "__file_path": self.__main_cfg
+            changed = True
+            config = None
+            if self.__cache:
+                config = self.__cache.get(path, stamp)
+            if config is not None:
+                files[path] = {
+                    "stamp"     : stamp,
+                    "config"    : config
                 }
+                continue
 
-            for item in config[section]:
-                self.__config[section][item] = config[section][item]
+            self.log(2, "Loading configuration file '{CYAN}{cfg_file}{RESET}'", {"cfg_file": path})
+            try:
+                files[path] = {
+                    "stamp"     : stamp,
+                    "config"    : self.__parse_file(path)
+                }
+                if self.__cache:
+                    self.__cache.set(path, stamp, files[path]["config"])
+            except configparser.Error as e:
+                self.log(0, "{RED}ERROR:{RESET} failed to parse '{CYAN}{cfg_file}{RESET}': {error}", {"cfg_file": path, "error": e})
+                if path in self.__files:
+                    files[path] = self.__files[path]
 
-        self.log(2, "Loading configuration from sorted list of files...")
-        self.log(1, "Loading configuration from '{MAGENTA}{cfg_dir}{RESET}'...", {"cfg_dir": self.__cfg_dir})
-        self.__load_from_directory(self.__cfg_dir)
+        if files.keys() != self.__files.keys():
+            changed = True
+
+        self.__files = files
+        if changed:
+            self.__merge(paths)
+
+        return changed
 
     def save_configuration(self):
         """
@@ -109,27 +193,36 @@ class INI:
         """
         self.log(0, "INI.set_value() not implemented!")
 
-    def __load_from_directory(self, directory):
-        """
-        Loads files from passed directory.
-        """
-        if os.path.exists(directory):
-            cfglist = os.listdir(directory)
-            cfglist = sorted(cfglist)
-            for config in cfglist:
-                cfgpath = os.path.join(directory, config)
-                if config.endswith("ini"):
-                    self.log(2, "Loading configuration file '{CYAN}{cfg_file}{RESET}'", {"cfg_file": cfgpath})
-                    config = configparser.ConfigParser()
-                    cfg = config.read(cfgpath)
-
-                    for section in config.keys():
-                        if not section in self.__config:
-                            self.__config[section] = {
-                                "__file_path": cfgpath
-                            }
-                        else:
-                            self.__config[section]["__file_path"] = cfgpath
-
-                        for item in config[section]:
-                            self.__config[section][item] = config[section][item]
+    def __merge(self, paths):
+        """
+        Builds configuration dictionary from parsed files. Values from
+        latter files are overriding values from former ones.
+        """
+        config = {}
+        for index, path in enumerate(paths):
+            if not path in self.__files:
+                continue
+
+            for section, items in self.__files[path]["config"].items():
+                if not section in config:
+                    config[section] = {
+                        "__file_path": path
+                    }
+                # config.ini does not override file path.
+                elif index:
+                    config[section]["__file_path"] = path
+
+                config[section].update(items)
+
+        self.__config = config
+
+    def __parse_file(self, path):
+        """
+        Parses INI file.
+
+        @retval config 2-level dictionary with file contents.
+        """
+        config = configparser.ConfigParser()
+        config.read(path)
+
+        return {section: dict(config[section]) for section in config.keys()}
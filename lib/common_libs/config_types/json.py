@@ -31,6 +31,33 @@ class JSON:
         self.loader = loader
         self.log = logger
         self.__config = {}
+        # Parsed files, path => {stamp, config}.
+        self.__files = {}
+        # Parsed files cache, lib.common_libs.config_types.cache.Cache.
+        self.__cache = None
+        # Values set with set_value() which weren't saved yet.
+        self.__values = {}
+        # Configuration was changed since last saving.
+        self.__dirty = False
+
+    def get_configuration(self):
+        """
+        Returns whole configuration as 2-level dictionary.
+        """
+        return self.__config
+
+    def get_directories(self):
+        """
+        Returns a list of directories with configuration files: user's
+        configuration directory and application's "config" directory.
+        Preseed configuration in SCRIPT_PATH isn't included, as it is
+        shipped with application, and watching whole application
+        directory would reload configuration on every file change there.
+        """
+        directories = [self.__cfg_dir]
+        if self.__app_cfg_dir:
+            directories.append(self.__app_cfg_dir)
+        return directories
 
     def get_keys_for_group(self, group):
         """
@@ -53,9 +80,9 @@ class JSON:
 
         return self.__config[group][key]
 
-    def load_configuration(self, app_name, config_path = None):
+    def load_configuration(self, app_name, config_path = None, cache = None):
         """
-        Reads configuration from JSON file into dict.
+        Reads configuration from JSON files into dict.
         """
         self.__app_name = app_name
         if not config_path:
@@ -64,49 +91,123 @@ class JSON:
             self.__cfg_dir = os.path.expanduser(os.path.join(config_path))
         self.__main_cfg = os.path.join(self.__cfg_dir, "config.json")
 
-        self.log(0, "Reading JSON configuration...")
-        # Read main config.
-        if os.path.exists(self.__main_cfg):
-            self.log(2, "Main configuration file found, loading it...")
-            try:
-                self.__config = json.loads(open(self.__main_cfg, "r").read())
-            except json.decoder.JSONDecodeError:
-                self.log(0, "{YELLOW}Warning{RESET}: config.json is unusable.")
-
-        # Read preseed file
-        preseed_cfg = os.path.join(common.TEMP_SETTINGS["SCRIPT_PATH"], "config.json")
-        if os.path.exists(preseed_cfg):
-            self.log(2, "Preseed configuration file found, loading it...")
-            self.__config.update(json.loads(open(preseed_cfg, "r").read()))
-
         # Check if application added its path to sys.path. If so - also
         # load application-specific configuration.
+        self.__app_cfg_dir = None
         if sys.path[0] != common.TEMP_SETTINGS["SCRIPT_PATH"]:
-            app_config = os.path.join(sys.path[0], "config")
-            if os.path.exists(app_config):
-                for cfg_file in os.listdir(app_config):
-                    if cfg_file.endswith(".json") and cfg_file != "config.json":
-                        cfg_file_path = os.path.join(app_config, cfg_file)
-                        self.__config.update(json.loads(open(cfg_file_path, "r").read()))
+            self.__app_cfg_dir = os.path.join(sys.path[0], "config")
+
+        self.log(0, "Reading JSON configuration...")
+        self.__cache = cache
+        self.__files = {}
+        self.reload()
+
+    def reload(self):
+        """
+        Re-reads configuration files which were changed since last
+        reading, and rebuilds configuration dictionary if something
+        was changed. Unchanged files are not parsed again.
+
+        @retval changed True if configuration was changed.
+        """
+        # Main config, then preseed file, then application-specific
+        # configuration.
+        paths = [self.__main_cfg, os.path.join(common.TEMP_SETTINGS["SCRIPT_PATH"], "config.json")]
+        if self.__app_cfg_dir and os.path.exists(self.__app_cfg_dir):
+            for cfg_file in sorted(os.listdir(self.__app_cfg_dir)):
+                if cfg_file.endswith(".json") and cfg_file != "config.json":
+                    paths.append(os.path.join(self.__app_cfg_dir, cfg_file))
+
+        changed = False
+        files = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if path in self.__files and self.__files[path]["stamp"] == stamp:
+                files[path] = self.__files[path]
+                continue
+
+            changed = True
+            config = None
+            if self.__cache:
+                config = self.__cache.get(path, stamp)
+            if config is not None:
+                files[path] = {
+                    "stamp"     : stamp,
+                    "config"    : config
+                }
+                continue
+
+            self.log(2, "Loading configuration file '{CYAN}{cfg_file}{RESET}'", {"cfg_file": path})
+            try:
+                with open(path, "r") as cfg:
+                    files[path] = {
+                        "stamp"     : stamp,
+                        "config"    : json.loads(cfg.read())
+                    }
+                if self.__cache:
+                    self.__cache.set(path, stamp, files[path]["config"])
+            except (OSError, ValueError):
+                self.log(0, "{YELLOW}Warning{RESET}: {cfg_file} is unusable.", {"cfg_file": path})
+                if path in self.__files:
+                    files[path] = self.__files[path]
+
+        if files.keys() != self.__files.keys():
+            changed = True
+
+        self.__files = files
+        if changed:
+            self.__merge(paths)
+
+        return changed
+
+    def is_dirty(self):
+        """
+        Returns True if configuration was changed since last saving.
+        """
+        return self.__dirty
 
     def save_configuration(self):
         """
-        Saves configuration to QSettings instance.
+        Saves configuration to config.json, if it was changed.
+
+        Configuration is written to temporary file which then replaces
+        config.json, so it is never left half-written.
+
+        @retval error 1 if saving failed.
         """
+        if not self.__dirty:
+            return
+
         self.log(0, "Saving JSON configuration...")
 
         # Do not save preseed data if present, it is unchangeable.
-        if "preseed" in self.__config:
-            del self.__config["preseed"]
-
-        # Create configuration directory, if it not exist.
-        if not os.path.exists(self.__cfg_dir):
-            os.makedirs(self.__cfg_dir)
-
-        config_data = json.dumps(self.__config, indent = 4)
-        with open(self.__main_cfg, "w") as cfg:
-            cfg.write(config_data)
-            cfg.flush()
+        config = {group: values for group, values in self.__config.items() if group != "preseed"}
+        config_data = json.dumps(config, indent = 4)
+
+        temp_cfg = self.__main_cfg + ".tmp"
+        try:
+            # Create configuration directory, if it not exist.
+            if not os.path.exists(self.__cfg_dir):
+                os.makedirs(self.__cfg_dir)
+
+            with open(temp_cfg, "w") as cfg:
+                cfg.write(config_data)
+                cfg.flush()
+                os.fsync(cfg.fileno())
+            os.replace(temp_cfg, self.__main_cfg)
+        except OSError as e:
+            self.log(0, "{RED}ERROR:{RESET} failed to write '{CYAN}{cfg_file}{RESET}': {error}", {"cfg_file": self.__main_cfg, "error": e})
+            return 1
+
+        self.__dirty = False
+        # Saved values are in config.json now, so later changes of file
+        # are not overridden by them.
+        self.__values = {}
 
     def set_value(self, group, key, value):
         """
@@ -116,3 +217,31 @@ class JSON:
             self.__config[group] = {}
 
         self.__config[group][key] = value
+
+        self.__dirty = True
+
+        # Keep value when configuration will be re-read.
+        if not group in self.__values:
+            self.__values[group] = {}
+        self.__values[group][key] = value
+
+    def __merge(self, paths):
+        """
+        Builds configuration dictionary from parsed files. Groups from
+        latter files are replacing groups from former ones. Values set
+        with set_value() and not saved yet are applied on top.
+        """
+        config = {}
+        for path in paths:
+            if path in self.__files:
+                for group, values in self.__files[path]["config"].items():
+                    if isinstance(values, dict):
+                        values = dict(values)
+                    config[group] = values
+
+        for group, values in self.__values.items():
+            if not isinstance(config.get(group), dict):
+                config[group] = {}
+            config[group].update(values)
+
+        self.__config = config
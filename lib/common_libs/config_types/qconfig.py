@@ -39,6 +39,14 @@ class QConfig:
         self.loader = loader
         self.log = logger
         self.__config = {}
+        # Values changed since last saving, set of (group, key).
+        self.__changed = set()
+
+    def get_configuration(self):
+        """
+        Returns whole configuration as 2-level dictionary.
+        """
+        return self.__config
 
     def get_keys_for_group(self, group):
         """
@@ -61,6 +69,12 @@ class QConfig:
 
         return self.__config[group][key]
 
+    def is_dirty(self):
+        """
+        Returns True if configuration was changed since last saving.
+        """
+        return bool(self.__changed)
+
     def load_configuration(self, app_name, config_path = None):
         """
         Reads configuration from QSettings file into 2-level dict.
@@ -88,17 +102,17 @@ class QConfig:
 
     def save_configuration(self):
         """
-        Saves configuration to QSettings instance.
+        Saves changed values and main window's size and position to
+        QSettings instance.
         """
         self.log(0, "Saving Qt configuration...")
 
-        for section in self.__config:
-            if len(self.__config[section]) > 0:
-                self.qsettings.beginGroup(section)
-                for item in self.__config[section]:
-                    self.qsettings.setValue(item, self.__config[section][item])
-
-                self.qsettings.endGroup()
+        # Only changed values are written.
+        for section, item in sorted(self.__changed):
+            self.qsettings.beginGroup(section)
+            self.qsettings.setValue(item, self.__config[section][item])
+            self.qsettings.endGroup()
+        self.__changed = set()
 
         # Save main window's size and position.
         self.log(2, "Saving main window's size and position...")
@@ -117,5 +131,6 @@ class QConfig:
             self.__config[group] = {}
 
         self.__config[group][key] = value
+        self.__changed.add((group, key))
 
 
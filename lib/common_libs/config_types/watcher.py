@@ -0,0 +1,164 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import ctypes
+import ctypes.util
+import os
+
+class Watcher:
+    """
+    Watches configuration directories and calls back when files in
+    them are changed.
+
+    On Linux inotify is used (thru libc, no additional modules are
+    required), so changes are noticed almost immediately. If inotify
+    isn't available - directories are polled every 'interval' seconds.
+
+    Watcher does not know what exactly was changed, it just executes
+    callback, which should check configuration files by itself. Bursts
+    of events (editors are writing files in several steps) are producing
+    one callback execution.
+    """
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+    # IN_MOVED_TO | IN_CREATE | IN_DELETE.
+    INOTIFY_MASK = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+    # Delay between first event and callback execution, in seconds.
+    DEBOUNCE = 0.2
+
+    def __init__(self, logger, loop, directories, callback, interval):
+        self.log = logger
+        self.__loop = loop
+        self.__directories = directories
+        self.__callback = callback
+        self.__interval = interval
+
+        self.__method = None
+        self.__inotify_fd = None
+        self.__handle = None
+        # Process which started watcher. Forked processes must not
+        # touch parent's loop.
+        self.__pid = None
+
+    def get_directories(self):
+        """
+        Returns a list of watched directories.
+        """
+        return self.__directories
+
+    def get_method(self):
+        """
+        Returns watching method: "inotify", "polling" or None if watcher
+        isn't started.
+        """
+        return self.__method
+
+    def start(self):
+        """
+        Starts watching.
+        """
+        self.__pid = os.getpid()
+        if self.__init_inotify():
+            self.__method = "inotify"
+            self.__loop.add_reader(self.__inotify_fd, self.__on_inotify)
+        else:
+            self.__method = "polling"
+            self.__handle = self.__loop.call_later(self.__interval, self.__poll)
+
+        self.log(1, "Watching configuration directories using {method}", {"method": self.__method})
+
+    def stop(self):
+        """
+        Stops watching.
+        """
+        if self.__handle:
+            if self.__pid == os.getpid():
+                self.__handle.cancel()
+            self.__handle = None
+
+        if self.__inotify_fd is not None:
+            if self.__pid == os.getpid() and not self.__loop.is_closed():
+                self.__loop.remove_reader(self.__inotify_fd)
+            os.close(self.__inotify_fd)
+            self.__inotify_fd = None
+
+        self.__method = None
+
+    def __init_inotify(self):
+        """
+        Initializes inotify and adds watches for directories.
+
+        @retval success False if inotify isn't available.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            return False
+
+        fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            self.log(0, "{YELLOW}Warning{RESET}: failed to initialize inotify: {error}", {"error": os.strerror(ctypes.get_errno())})
+            return False
+
+        watches = 0
+        for directory in self.__directories:
+            if not os.path.isdir(directory):
+                continue
+
+            if inotify_add_watch(fd, os.fsencode(directory), self.INOTIFY_MASK) < 0:
+                self.log(0, "{YELLOW}Warning{RESET}: failed to watch '{CYAN}{directory}{RESET}': {error}", {"directory": directory, "error": os.strerror(ctypes.get_errno())})
+            else:
+                watches += 1
+
+        if not watches:
+            os.close(fd)
+            return False
+
+        self.__inotify_fd = fd
+        return True
+
+    def __on_inotify(self):
+        """
+        Reads inotify events and schedules callback execution.
+        """
+        try:
+            while os.read(self.__inotify_fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+        if not self.__handle:
+            self.__handle = self.__loop.call_later(self.DEBOUNCE, self.__run_callback)
+
+    def __poll(self):
+        """
+        Executes callback and schedules next poll.
+        """
+        self.__run_callback()
+        self.__handle = self.__loop.call_later(self.__interval, self.__poll)
+
+    def __run_callback(self):
+        """
+        Executes callback.
+        """
+        self.__handle = None
+        try:
+            self.__callback()
+        except Exception as e:
+            self.log(0, "{RED}ERROR:{RESET} configuration reloading failed: {error}", {"error": repr(e)})
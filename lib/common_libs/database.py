@@ -15,17 +15,34 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import asyncio
+import contextlib
+import io
+import itertools
+import json
 import os
-from sqlalchemy import create_engine
+import re
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import exc
 from sqlalchemy import pool
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
 import sys
+import tempfile
+import threading
+import time
+import weakref
 
 from lib.common_libs import common
 from lib.common_libs.exception import RegiusException
 from lib.common_libs.library import Library
+from lib.common_libs.database_types.cache import ResultCache
+from lib.common_libs.database_types.instrumentation import QueryInstrumentation
+from lib.common_libs.database_types.pool import StatisticsAsyncQueuePool, StatisticsQueuePool
+from lib.common_libs.database_types.routing import RoutingSession
+from lib.common_libs.database_types.scope import ThreadScope
 
 from lib.database_tools.migrator import Migrator
 
@@ -55,10 +72,87 @@ class Database(Library):
 
     For batch execution issue:
 
-        database.executemany(list_of_queries)
+        database.executemany(query, list_of_parameters)
 
+    For loading lots of rows there are bulk_insert(), upsert() and
+    copy_rows() (COPY for PostgreSQL). All of them are taking rows in
+    chunks of "bulk_chunk_size" rows (1000 by default, "database"
+    configuration group) and are executing each chunk as one batch.
+
+    Big results might be read with stream_query(), which fetches rows
+    in portions of "stream_fetch_size" rows (1000 by default) using
+    server-side cursors where database supports them:
+
+        for row in database.stream_query(query):
+            ...
+
+    Results of often repeated read queries might be cached with
+    cached_query(). Cache size and results lifetime are controlled by
+    "result_cache_size" (1000 results by default) and "result_cache_ttl"
+    (60 seconds by default) options. Writes made thru this library are
+    invalidating cached results of written tables.
+
+    Executed queries are timed and accounted (see
+    get_query_statistics()), and queries which took longer than
+    "slow_query_threshold" seconds (1 by default, 0 disables logging)
+    are logged. Accounting might be disabled with "query_statistics"
+    option.
+
+    Connections are pooled. Pool parameters are taken from "database"
+    configuration group, per connection:
+
+        * {name}_pool_size - number of connections kept in pool (5 by
+          default).
+        * {name}_max_overflow - number of connections which might be
+          opened above pool size (10 by default).
+        * {name}_pool_timeout - seconds to wait for free connection
+          (30 by default).
+        * {name}_pool_recycle - re-open connections older than this
+          number of seconds (-1, never, by default).
+        * {name}_pool_pre_ping - check connections before using them
+          (disabled by default).
+
+    SQLite in-memory databases are using one shared connection instead.
+    See get_pool_statistics() for pool monitoring.
+
+    Several named connections might be created, every one is available
+    by its name (see get_database_connection() and get_session()). Last
+    created connection is the default one. Connection might have read
+    replicas, which are listed (comma-separated connection names) in
+    {name}_replicas option. Sessions of such connection are sending
+    reads to replicas and writes to connection itself. For tests, real
+    connection and its replicas might be replaced with SQLite database
+    using create_standin_connection().
+
+    Sessions might be obtained with get_session(), which returns new
+    session every time, or with session_scope() context manager, which
+    gives one session per thread (or asyncio task) and closes it when
+    block ends:
+
+        with database.session_scope() as session:
+            session.add(item)
+
+    For asyncio code, connection might be created in asynchronous mode
+    with create_async_connection(). Same configuration options are used,
+    but with asynchronous driver (aiosqlite, asyncpg or aiomysql, which
+    should be installed), and asynchronous sessions are used:
+
+        async with database.async_session_scope() as session:
+            result = await session.execute(query)
     """
 
+    # Asynchronous drivers for database types.
+    ASYNC_DRIVERS = {
+        "mysql"         : "mysql+aiomysql",
+        "postgresql"    : "postgresql+asyncpg",
+        "sqlite"        : "sqlite+aiosqlite"
+    }
+    # Tables which query reads from.
+    QUERY_TABLES = re.compile(r"\b(?:from|join)\s+(?:[`\"\[]?\w+[`\"\]]?\.)?[`\"\[]?(\w+)", re.IGNORECASE)
+    # Table which query writes to. COPY ... TO is a read, so it
+    # doesn't match.
+    WRITE_QUERY = re.compile(r"\s*(?:insert\s+(?:or\s+\w+\s+)?(?:ignore\s+)?into|replace\s+into|update(?:\s+or\s+\w+)?|delete\s+from|truncate(?:\s+table)?|drop\s+table(?:\s+if\s+exists)?|alter\s+table|copy)\s+(?:[`\"\[]?\w+[`\"\]]?\.)?[`\"\[]?(\w+)\b(?![`\"\]]?\s*(?:\([^()]*\)\s*)?to\b)", re.IGNORECASE)
+
     _info = {
         "name"          : "Database library",
         "shortname"     : "database",
@@ -68,15 +162,814 @@ class Database(Library):
     def __init__(self):
         Library.__init__(self)
 
+        # Default connection name, which is used when connection name
+        # isn't passed.
+        self.__default_connection = None
+        # Connection name => engine.
+        self.__engines = {}
+        # Connection name => list of replica connection names.
+        self.__replicas = {}
+        # Names of connections which options schemas are registered.
+        self.__connection_schemas = set()
+        # Connection name => session factory.
+        self.__session_factories = {}
+        # Connection name => scoped session registry.
+        self.__scoped_sessions = {}
+        self.__sessions_lock = threading.Lock()
+        # Scopes of scoped sessions, see __get_scope().
+        self.__thread_scope = threading.local()
+        self.__task_scopes = weakref.WeakSet()
+        # Asynchronous connections, see create_async_connection().
+        self.__default_async_connection = None
+        self.__async_engines = {}
+        self.__async_session_factories = {}
+        # Query results cache, see cached_query(), and statements
+        # compiled for its keys: query object => {connection name:
+        # (statement, bound values)}.
+        self.__result_cache = None
+        self.__compiled_queries = weakref.WeakKeyDictionary()
+        # Queries statistics, see get_query_statistics().
+        self.__instrumentation = None
+
+    @contextlib.asynccontextmanager
+    async def async_session_scope(self, connection_name = None):
+        """
+        Asynchronous context manager which gives new asynchronous
+        session and ends its lifetime on exit: commits it if block
+        succeeded, rolls back otherwise, and closes it.
+
+            async with database.async_session_scope() as session:
+                result = await session.execute(query)
+
+        @param connection_name Asynchronous connection name. Default
+        one is used if not passed.
+        """
+        session = self.get_async_session(connection_name)
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+    def bulk_insert(self, table, rows, connection_name = None, chunk_size = None):
+        """
+        Inserts rows in batches, in one transaction.
+
+        @param table Table or mapped class.
+        @param rows Iterable of dictionaries (column => value), all with
+        same keys. Might be a generator.
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @param chunk_size Number of rows in batch. "bulk_chunk_size"
+        option is used if not passed.
+        @retval count Number of inserted rows.
+        """
+        return self.__execute_chunks(insert(self.__get_table(table)), rows, connection_name, chunk_size)
+
+    def cached_query(self, query, parameters = None, connection_name = None, ttl = None):
+        """
+        Executes read query and caches its result. Next calls with same
+        query and parameters are returning cached result until it
+        expires, is evicted or is invalidated by write to one of the
+        tables it was read from.
+
+        Only writes made thru this library are invalidating results.
+        Query is executed with plain connection, so ORM select() is
+        returning rows of columns, not ORM objects.
+
+        @param query SQL string, SQLAlchemy statement or ORM select().
+        @param parameters Dictionary with query parameters.
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @param ttl Result lifetime in seconds. "result_cache_ttl" option
+        is used if not passed.
+        @retval rows Tuple of result rows. Must not be modified.
+        """
+        connection_name = connection_name or self.__default_connection
+        engine = self.__engines[connection_name]
+
+        # Key is built from compiled statement and its bound values, so
+        # queries which differ only in literal values aren't colliding.
+        # Compiled statements are remembered for query objects, as
+        # compiling isn't cheap and same object is often reused.
+        if isinstance(query, str):
+            statement, values = query, {}
+            query = text(query)
+        else:
+            compiled = self.__compiled_queries.setdefault(query, {})
+            if connection_name not in compiled:
+                compiled_query = query.compile(dialect = engine.dialect)
+                compiled[connection_name] = (str(compiled_query), compiled_query.params)
+            statement, values = compiled[connection_name]
+        if parameters:
+            values = dict(values, **parameters)
+
+        key = (connection_name, statement, tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in values.items())))
+        try:
+            hash(key)
+        except TypeError:
+            key = repr(key)
+
+        rows = self.__result_cache.get(key)
+        if rows is not None:
+            return rows
+
+        tables = {table.lower() for table in self.QUERY_TABLES.findall(statement)}
+        versions = self.__result_cache.get_versions(tables)
+        with engine.connect() as connection:
+            rows = tuple(connection.execute(query, parameters).all())
+        self.__result_cache.set(key, rows, tables, ttl, versions)
+
+        return rows
+
+    async def close_async_connections(self):
+        """
+        Closes all asynchronous connections.
+        """
+        for connection_name in list(self.__async_engines):
+            engine = self.__async_engines.pop(connection_name)
+            await engine.dispose()
+
+        self.__async_session_factories = {}
+        self.__default_async_connection = None
+
+    async def create_async_connection(self, connection_name):
+        """
+        Creates asynchronous connection to database and its read
+        replicas, if they are configured. Connection parameters are
+        taken from same configuration options as for create_connection(),
+        but asynchronous driver is used (aiosqlite, asyncpg or aiomysql,
+        can be redefined with {name}_async_type option). Last created
+        asynchronous connection becomes default one.
+
+        @param connection_name Connection name from "database"
+        configuration group.
+        """
+        self.__async_engines[connection_name] = await self.__create_async_engine(connection_name)
+        self.__default_async_connection = connection_name
+        self.__async_session_factories.pop(connection_name, None)
+
+        replicas = self.__get_replicas(connection_name)
+        for replica in replicas:
+            if replica not in self.__async_engines:
+                self.__async_engines[replica] = await self.__create_async_engine(replica)
+        self.__replicas[connection_name] = replicas
+
+        return 1
+
+    def copy_rows(self, table, rows, columns = None, connection_name = None, chunk_size = None):
+        """
+        Loads rows using PostgreSQL's COPY, chunk by chunk, in one
+        transaction. For other databases (or drivers without COPY
+        support) falls back to bulk_insert().
+
+        @param table Table or mapped class.
+        @param rows Iterable of dictionaries (column => value), all with
+        same keys. Might be a generator.
+        @param columns List of columns to load. Keys of first row are
+        used if not passed.
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @param chunk_size Number of rows in one COPY. "bulk_chunk_size"
+        option is used if not passed.
+        @retval count Number of loaded rows.
+        """
+        engine = self.get_database_connection(connection_name)
+        if engine.dialect.name != "postgresql" or engine.dialect.driver != "psycopg2":
+            self.log(2, "COPY isn't supported by '{driver}', using batched inserts", {"driver": engine.dialect.driver})
+            return self.bulk_insert(table, rows, connection_name, chunk_size)
+
+        table = self.__get_table(table)
+        preparer = engine.dialect.identifier_preparer
+        query = None
+        count = 0
+        with engine.begin() as connection:
+            # COPY is executed with DBAPI cursor, which bypasses engine's
+            # cursor events, so written table and query statistics are
+            # accounted here. Transaction end events are fired as usual.
+            cursor = connection.connection.cursor()
+            try:
+                for chunk in self.__get_chunks(rows, chunk_size):
+                    if query is None:
+                        if columns is None:
+                            columns = list(chunk[0].keys())
+                        query = "COPY {0} ({1}) FROM STDIN".format(preparer.format_table(table), ", ".join(preparer.quote(column) for column in columns))
+
+                    data = io.StringIO()
+                    for row in chunk:
+                        data.write("\t".join(self.__get_copy_value(row.get(column)) for column in columns))
+                        data.write("\n")
+                    data.seek(0)
+
+                    started = time.perf_counter()
+                    cursor.copy_expert(query, data)
+                    if self.__instrumentation:
+                        self.__instrumentation.record(query, time.perf_counter() - started, len(chunk))
+                    self.__invalidate_table(connection, table.name)
+                    count += len(chunk)
+            finally:
+                cursor.close()
+
+        self.log(2, "Copied {count} rows into '{table}'", {"count": count, "table": table.name})
+        return count
+
     def create_connection(self, connection_name):
         """
-        Creates connection to database.
+        Creates connection to database and its read replicas, if they
+        are configured. Last created connection becomes default one.
 
         In case of error will set temporary option "DB_ERROR_CODE" and
         "DB_ERROR_DESCRIPTION", for later usage by other modules.
+
+        @param connection_name Connection name from "database"
+        configuration group.
+        """
+        engine_string, engine = self.__create_engine(connection_name)
+        self.__engines[connection_name] = engine
+        self.__default_connection = connection_name
+        self.__forget_sessions(connection_name)
+        self.config.set_temp_value("database/db_string", engine_string)
+
+        replicas = self.__get_replicas(connection_name)
+        for replica in replicas:
+            if replica not in self.__engines:
+                self.__engines[replica] = self.__create_engine(replica)[1]
+        self.__replicas[connection_name] = replicas
+
+        if replicas:
+            self.log(1, "Reads from '{conn_name}' are routed to replicas: {replicas}", {"conn_name": connection_name, "replicas": ", ".join(replicas)})
+
+        return 1
+
+    def create_standin_connection(self, connection_name, replicas = 1, path = None):
+        """
+        Creates SQLite connection which replaces real primary and
+        replicas connections, for testing. Primary and replicas are
+        using same database file, replicas are opened in read-only mode,
+        so misrouted writes are failing. Stand-in becomes default
+        connection.
+
+        @param connection_name Connection name.
+        @param replicas Number of replica connections.
+        @param path Database file path. If not passed - temporary file
+        will be created.
+        @retval path Database file path.
+        """
+        if not path:
+            fd, path = tempfile.mkstemp(prefix = "regius-", suffix = ".sqlite")
+            os.close(fd)
+
+        self.log(0, "Creating SQLite stand-in for connection '{conn_name}' in '{path}'", {"conn_name": connection_name, "path": path})
+
+        # Pool is configured as for real connection.
+        engine_parameters = self.__get_pool_parameters(connection_name, "sqlite", dbname = path)
+        self.__engines[connection_name] = create_engine("sqlite:///{0}".format(path), **engine_parameters)
+        self.__install_events(self.__engines[connection_name])
+        self.__default_connection = connection_name
+        self.__forget_sessions(connection_name)
+        self.config.set_temp_value("database/db_string", "sqlite:///{0}".format(path))
+
+        replica_names = []
+        for index in range(replicas):
+            replica = "{0}_replica{1}".format(connection_name, index)
+            self.__engines[replica] = create_engine("sqlite:///file:{0}?mode=ro&uri=true".format(path), **self.__get_pool_parameters(replica, "sqlite", dbname = path))
+            self.__install_events(self.__engines[replica])
+            replica_names.append(replica)
+        self.__replicas[connection_name] = replica_names
+
+        return path
+
+    def executemany(self, query, parameters, connection_name = None, chunk_size = None):
+        """
+        Executes query for every parameters set, in batches, in one
+        transaction.
+
+            database.executemany("UPDATE users SET active = :active WHERE id = :id", [{"id": 1, "active": True}, ...])
+
+        @param query SQL string or SQLAlchemy statement.
+        @param parameters Iterable of dictionaries with query parameters.
+        Might be a generator.
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @param chunk_size Number of parameters sets in batch.
+        "bulk_chunk_size" option is used if not passed.
+        @retval count Number of processed parameters sets.
+        """
+        if isinstance(query, str):
+            query = text(query)
+
+        return self.__execute_chunks(query, parameters, connection_name, chunk_size)
+
+    def get_async_database_connection(self, connection_name = None):
+        """
+        Returns asynchronous engine (SQLAlchemy's AsyncEngine).
+
+        @param connection_name Connection name. Default asynchronous
+        connection is returned if not passed.
+        """
+        return self.__async_engines.get(connection_name or self.__default_async_connection)
+
+    def get_async_session(self, connection_name = None):
+        """
+        Returns new asynchronous session (SQLAlchemy's AsyncSession).
+        Reads are routed to replicas same way as for get_session().
+
+        Caller is responsible for closing session. Session must not be
+        shared between concurrent tasks.
+
+        @param connection_name Connection name. Default asynchronous
+        connection is used if not passed.
+        """
+        connection_name = connection_name or self.__default_async_connection
+        factory = self.__async_session_factories.get(connection_name)
+        if factory is None:
+            engine = self.__async_engines[connection_name]
+            replicas = [self.__async_engines[replica].sync_engine for replica in self.__replicas.get(connection_name, [])]
+            if replicas:
+                factory = sessionmaker(bind = engine, class_ = AsyncSession, sync_session_class = RoutingSession, expire_on_commit = False, primary = engine.sync_engine, replicas = replicas)
+            else:
+                factory = sessionmaker(bind = engine, class_ = AsyncSession, expire_on_commit = False)
+            self.__async_session_factories[connection_name] = factory
+
+        return factory()
+
+    def get_cache_statistics(self):
+        """
+        Returns a dictionary with query results cache statistics (see
+        lib.common_libs.database_types.cache.ResultCache).
+        """
+        return self.__result_cache.get_statistics()
+
+    def get_connections(self):
+        """
+        Returns a list of created connections names, including replicas.
+        """
+        return sorted(self.__engines)
+
+    def get_database_connection(self, connection_name = None):
+        """
+        This method returns RAW database connection pointer to caller.
+        Useful when running migrations.
+
+        @param connection_name Connection name. Default connection is
+        returned if not passed.
+        @retval db_engine Raw database connection.
+        """
+        return self.__engines.get(connection_name or self.__default_connection)
+
+    def get_database_mapping(self, mapping_name):
+        """
+        Call lib.common_libs.loader.Loader for loading or returning a
+        pointer to database mapping class, which can be used with
+        database session.
+
+        @param mapping_name Name of table to obtain mapping.
+        @retval Mapping Instance of ``lib.common_libs.database_mappings.{mapping_name}``
+        """
+        caller = sys._getframe(1).f_locals["self"].__class__.__name__
+        db_mapping = self.loader.request_db_mapping(mapping_name)
+        self.log(2, "Returning database mapping '{BLUE}{mapping_name}{RESET}' to '{MAGENTA}{caller}{RESET}'", {"caller": caller, "mapping_name": mapping_name})
+        return db_mapping
+
+    def get_pool_statistics(self, connection_name = None):
+        """
+        Returns a dictionary with connection pool statistics (see
+        lib.common_libs.database_types.pool.StatisticsQueuePool), or
+        None if connection isn't pooled.
+
+        @param connection_name Connection name. If there is no such
+        connection, asynchronous connection with this name is used.
+        Default connection (or default asynchronous connection, if there
+        are no other ones) is used if not passed.
+        """
+        engine = self.get_database_connection(connection_name)
+        if engine is None:
+            engine = self.get_async_database_connection(connection_name)
+            if engine is not None:
+                engine = engine.sync_engine
+        if hasattr(engine, "pool") and isinstance(engine.pool, StatisticsQueuePool):
+            return engine.pool.get_statistics()
+
+    def get_query_statistics(self, count = 10):
+        """
+        Returns statistics of queries which took most total time (see
+        lib.common_libs.database_types.instrumentation.QueryInstrumentation).
+        Empty list is returned if statistics are disabled.
+
+        @param count Number of queries to return.
+        """
+        if not self.__instrumentation:
+            return []
+
+        return self.__instrumentation.get_top(count)
+
+    def get_scoped_session(self, connection_name = None):
+        """
+        Returns scoped session registry for connection. Calling it
+        returns session which belongs to current asyncio task or, if
+        called outside of task, to current thread. Session lives until
+        registry's remove() is called (see session_scope() for handy
+        wrapper), or until its task is done or its thread exits, then
+        it is closed.
+
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @retval scoped_session Scoped session registry.
+        """
+        connection_name = connection_name or self.__default_connection
+        registry = self.__scoped_sessions.get(connection_name)
+        if registry is None:
+            with self.__sessions_lock:
+                registry = self.__scoped_sessions.get(connection_name)
+                if registry is None:
+                    registry = scoped_session(self.__get_session_factory(connection_name), scopefunc = self.__get_scope)
+                    self.__scoped_sessions[connection_name] = registry
+
+        return registry
+
+    def get_session(self, connection_name = None):
+        """
+        Returns new session object from currently established
+        connection. If connection has read replicas, reads are routed to
+        them (see lib.common_libs.database_types.routing.RoutingSession).
+
+        Caller is responsible for closing session.
+
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @retval Session Session pointer.
+        """
+        caller = sys._getframe(1).f_locals["self"].__class__.__name__
+        self.log(2, "Returning session object to '{CYAN}{caller}{RESET}'", {"caller": caller})
+
+        return self.__get_session_factory(connection_name or self.__default_connection)()
+
+    def init_library(self):
+        """
+        """
+        self.log(0, "Initializing database connection...")
+
+        self.config.register_schema("database", {
+            "bulk_chunk_size"       : {"type": int, "default": 1000, "validator": lambda value: value > 0},
+            "stream_fetch_size"     : {"type": int, "default": 1000, "validator": lambda value: value > 0},
+            "result_cache_size"     : {"type": int, "default": 1000, "validator": lambda value: value > 0},
+            "result_cache_ttl"      : {"type": float, "default": 60, "validator": lambda value: value > 0},
+            "query_statistics"      : {"type": bool, "default": True},
+            "slow_query_threshold"  : {"type": float, "default": 1, "validator": lambda value: value >= 0}
+        })
+        self.__result_cache = ResultCache(self.config.get_value("all", "database", "result_cache_size"), self.config.get_value("all", "database", "result_cache_ttl"))
+        if self.config.get_value("all", "database", "query_statistics"):
+            self.__instrumentation = QueryInstrumentation(self.log, self.config.get_value("all", "database", "slow_query_threshold"))
+            self.config.subscribe(self.__on_configuration_changed, "database")
+
+        self.__database_data = self.config.get_keys_for_group("all", "database")
+        # Options of all configured connections are validated right
+        # away, so invalid ones are reported on startup, not when
+        # connection is created.
+        connection_names = set()
+        for key in self.__database_data:
+            if key.endswith("_async_type"):
+                connection_names.add(key[:-len("_async_type")])
+            elif key.endswith("_type"):
+                connection_names.add(key[:-len("_type")])
+        self.__register_connection_schemas(connection_names)
+
+        common.TEMP_SETTINGS["DBMap"] = declarative_base()
+
+    def invalidate_cache(self, tables = None):
+        """
+        Invalidates cached query results. Useful when tables were changed
+        bypassing this library.
+
+        @param tables List of tables names. Whole cache is cleared if not
+        passed.
+        """
+        if tables is None:
+            self.__result_cache.clear()
+        else:
+            self.__result_cache.invalidate(table.lower() for table in tables)
+
+    def load_mappings(self):
+        """
+        Loads tables mappings.
+        """
+        self.log(0, "Loading database mappings...")
+
+        mappings_path = os.path.join(self.config.get_temp_value("SCRIPT_PATH"), "lib", "database_mappings")
+        if not os.path.exists(mappings_path):
+            self.log(0, "{RED}ERROR{RESET}: database mappings loading requested, but no database mappings are found in '{mappings_path}'", {"mappings_path": mappings_path})
+            return 1
+
+        files = os.listdir(mappings_path)
+
+        for item in files:
+            if item.startswith("__"):
+                continue
+
+            mapping_module_name = item.split(".")[0]
+            self.log(1, "Loading database mapping: '{BLUE}{mapping_module_name}{RESET}'", {"mapping_module_name": mapping_module_name})
+
+            self.loader.request_db_mapping(mapping_module_name)
+
+    def on_shutdown(self):
+        """
+        Closes asynchronous connections, if event loop is still usable.
+        """
+        if not self.__async_engines:
+            return
+
+        loop = self.loader.request_library("common_libs", "eventloop").get_loop()
+        if loop.is_closed() or loop.is_running():
+            return
+
+        loop.run_until_complete(self.close_async_connections())
+
+    def reset_query_statistics(self):
+        """
+        Forgets collected queries statistics.
+        """
+        if self.__instrumentation:
+            self.__instrumentation.reset()
+
+    @contextlib.contextmanager
+    def session_scope(self, connection_name = None):
+        """
+        Context manager which gives scoped session (see
+        get_scoped_session()) and ends its lifetime on exit: commits it
+        if block succeeded, rolls back otherwise, and removes session
+        from registry. Nested scopes in same thread or task are sharing
+        outer scope's session, which is committed by outer scope only.
+
+            with database.session_scope() as session:
+                session.add(item)
+
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        """
+        registry = self.get_scoped_session(connection_name)
+        if registry.registry.has():
+            yield registry()
+            return
+
+        session = registry()
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            registry.remove()
+
+    def stream_query(self, query, parameters = None, connection_name = None, fetch_size = None, tuples = False):
+        """
+        Executes query and returns generator of result rows. Rows are
+        fetched in portions of fetch_size rows, using server-side
+        cursors for PostgreSQL and MySQL (SQLite fetches rows lazily by
+        itself), so memory usage does not depend on result size.
+
+        Query is executed in its own session, which is closed when
+        generator is exhausted or closed. If connection has read
+        replicas, query is executed on one of them.
+
+        @param query SQL string, SQLAlchemy statement or ORM select().
+        @param parameters Dictionary with query parameters.
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @param fetch_size Number of rows in portion. "stream_fetch_size"
+        option is used if not passed.
+        @param tuples Yield plain tuples instead of Row objects.
+        """
+        if isinstance(query, str):
+            query = text(query)
+
+        if not fetch_size:
+            fetch_size = self.config.get_value("all", "database", "stream_fetch_size")
+
+        session = self.__get_session_factory(connection_name or self.__default_connection)()
+        try:
+            result = session.execute(query.execution_options(yield_per = fetch_size), parameters)
+            for partition in result.partitions(fetch_size):
+                if tuples:
+                    for row in partition:
+                        yield tuple(row)
+                else:
+                    yield from partition
+        finally:
+            session.close()
+
+    def upsert(self, table, rows, index_elements = None, update_columns = None, connection_name = None, chunk_size = None):
+        """
+        Inserts rows in batches, in one transaction. Rows which are
+        conflicting with existing ones are updating them instead:
+        ON CONFLICT DO UPDATE is used for PostgreSQL and SQLite,
+        ON DUPLICATE KEY UPDATE for MySQL.
+
+        @param table Table or mapped class.
+        @param rows Iterable of dictionaries (column => value), all with
+        same keys. Might be a generator.
+        @param index_elements Columns of unique index which detects
+        conflict. Primary key is used if not passed. MySQL always uses
+        all unique indexes of table.
+        @param update_columns Columns to update on conflict. All row's
+        columns except index_elements are updated if not passed.
+        @param connection_name Connection name. Default connection is
+        used if not passed.
+        @param chunk_size Number of rows in batch. "bulk_chunk_size"
+        option is used if not passed.
+        @raises ValueError If connection's database doesn't support upsert.
+        @retval count Number of processed rows.
+        """
+        table = self.__get_table(table)
+        dialect = self.get_database_connection(connection_name).dialect.name
+        if dialect not in ("mysql", "postgresql", "sqlite"):
+            raise ValueError("Upsert isn't supported for '{0}'".format(dialect))
+
+        if index_elements is None:
+            index_elements = [column.name for column in table.primary_key.columns]
+
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+
+        if update_columns is None:
+            update_columns = [column for column in first if column not in index_elements]
+
+        if dialect == "mysql":
+            query = mysql.insert(table)
+            if update_columns:
+                query = query.on_duplicate_key_update({column: query.inserted[column] for column in update_columns})
+            else:
+                query = query.prefix_with("IGNORE")
+        else:
+            if dialect == "postgresql":
+                query = postgresql.insert(table)
+            else:
+                query = sqlite.insert(table)
+            if update_columns:
+                query = query.on_conflict_do_update(index_elements = index_elements, set_ = {column: query.excluded[column] for column in update_columns})
+            else:
+                query = query.on_conflict_do_nothing(index_elements = index_elements)
+
+        return self.__execute_chunks(query, itertools.chain((first, ), rows), connection_name, chunk_size)
+
+    async def __create_async_engine(self, connection_name):
+        """
+        Creates asynchronous engine for connection.
+
+        @param connection_name Connection name.
+        @retval engine Engine.
+        """
+        self.log(0, "Trying to connect to database '{conn_name}' in asynchronous mode...", {"conn_name": connection_name})
+
+        engine_string, db_type = self.__get_engine_string(connection_name, asynchronous = True)
+        engine_parameters = self.__get_engine_parameters(connection_name, db_type, asynchronous = True)
+
+        try:
+            engine = create_async_engine(engine_string, **engine_parameters)
+            self.__install_events(engine.sync_engine)
+            try:
+                async with engine.connect():
+                    pass
+            except exc.OperationalError as e:
+                self.log(0, "{RED}Error while connecting to database:{RESET}")
+                self.log(0, "{RED}{error}{RESET}", {"error": repr(e)})
+            self.log(0, "Connection to database established")
+            return engine
+        except (exc.OperationalError, ImportError) as e:
+            raise DatabaseConnectionException(e)
+
+    def __create_engine(self, connection_name):
+        """
+        Creates engine for connection.
+
+        @param connection_name Connection name.
+        @retval engine_string Engine string.
+        @retval engine Engine.
         """
         self.log(0, "Trying to connect to database '{conn_name}'...", {"conn_name": connection_name})
 
+        engine_string, db_type = self.__get_engine_string(connection_name)
+        engine_parameters = self.__get_engine_parameters(connection_name, db_type)
+
+        try:
+            engine = create_engine(engine_string, **engine_parameters)
+            self.__install_events(engine)
+            try:
+                # Connection is returned to pool right away.
+                with engine.connect():
+                    pass
+            except exc.OperationalError as e:
+                self.log(0, "{RED}Error while connecting to database:{RESET}")
+                self.log(0, "{RED}{error}{RESET}", {"error": repr(e)})
+            self.log(0, "Connection to database established")
+            return engine_string, engine
+        except exc.OperationalError as e:
+            raise DatabaseConnectionException(e)
+
+    def __execute_chunks(self, query, parameters, connection_name, chunk_size):
+        """
+        Executes query with parameters sets chunk by chunk, in one
+        transaction.
+
+        @retval count Number of processed parameters sets.
+        """
+        count = 0
+        with self.get_database_connection(connection_name).begin() as connection:
+            for chunk in self.__get_chunks(parameters, chunk_size):
+                connection.execute(query, chunk)
+                count += len(chunk)
+
+        self.log(2, "Executed batched query for {count} rows", {"count": count})
+        return count
+
+    def __forget_scope(self, scope):
+        """
+        Closes and forgets scoped sessions of done task or exited
+        thread.
+
+        @param scope Task or thread scope key.
+        """
+        sessions = []
+        with self.__sessions_lock:
+            for registry in self.__scoped_sessions.values():
+                session = registry.registry.registry.pop(scope, None)
+                if session is not None:
+                    sessions.append(session)
+
+        for session in sessions:
+            session.close()
+
+    def __forget_sessions(self, connection_name):
+        """
+        Forgets session factories for (re)created connection, they will
+        be created again for new engine.
+        """
+        with self.__sessions_lock:
+            self.__session_factories.pop(connection_name, None)
+            self.__scoped_sessions.pop(connection_name, None)
+
+    def __get_chunks(self, rows, chunk_size):
+        """
+        Splits rows iterable into lists of chunk_size rows.
+        """
+        if not chunk_size:
+            chunk_size = self.config.get_value("all", "database", "bulk_chunk_size")
+
+        rows = iter(rows)
+        chunk = list(itertools.islice(rows, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(rows, chunk_size))
+
+    def __get_copy_value(self, value):
+        """
+        Returns value in COPY text format.
+        """
+        if value is None:
+            return "\\N"
+
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            # bytea in hex format. Its leading backslash is escaped
+            # below, as any other backslash.
+            value = "\\x" + bytes(value).hex()
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def __get_engine_parameters(self, connection_name, db_type, asynchronous = False):
+        """
+        Returns create_engine() parameters for connection.
+
+        @param connection_name Connection name.
+        @param db_type Database type with driver.
+        @param asynchronous Parameters are for asynchronous engine.
+        """
+        engine_parameters = {
+            "isolation_level"       : "READ UNCOMMITTED"
+        }
+        # We should not pass client_encoding for MySQL and SQLite
+        # connections.
+        if "postgresql" in db_type and "asyncpg" not in db_type:
+            engine_parameters["client_encoding"] = "utf8"
+        engine_parameters.update(self.__get_pool_parameters(connection_name, db_type, asynchronous))
+
+        return engine_parameters
+
+    def __get_engine_string(self, connection_name, asynchronous = False):
+        """
+        Composes engine string for connection.
+
+        @param connection_name Connection name.
+        @param asynchronous Use asynchronous driver.
+        @retval engine_string Engine string.
+        @retval db_type Database type with driver.
+        """
         # Creating engine string.
         self.log(2, "Composing engine string...")
 
@@ -94,6 +987,14 @@ class Database(Library):
         else:
             __db_type = __cfg_db_type
 
+        if asynchronous:
+            self.__register_connection_schemas((connection_name, ))
+            __cfg_async_type = self.config.get_value("all", "database", "{0}_async_type".format(connection_name))
+            if __cfg_async_type:
+                __db_type = __cfg_async_type
+            else:
+                __db_type = self.ASYNC_DRIVERS.get(__db_type.split("+")[0], __db_type)
+
         self.log(2, "Connection type: {__db_type}", {"__db_type": __db_type})
 
         # Checking if port is defined. If not - use approriate default
@@ -118,8 +1019,8 @@ class Database(Library):
         # If port was defined - add ":" in front, so it will be
         # counted as port. If nothing is defined, then it will
         # use default port.
-        if __db_type != "sqlite":
-            self.__db_engine = "{0}://{1}:{2}@{3}{4}/{5}".format(
+        if "sqlite" not in __db_type:
+            engine_string = "{0}://{1}:{2}@{3}{4}/{5}".format(
                 __db_type,
                 self.config.get_value("all", "database", "{0}_user".format(connection_name)),
                 self.config.get_value("all", "database", "{0}_pass".format(connection_name)),
@@ -128,99 +1029,178 @@ class Database(Library):
                 self.config.get_value("all", "database", "{0}_dbname".format(connection_name))
                 )
         else:
-            self.__db_engine = "{0}:///{1}".format(__db_type, self.config.get_value("all", "database", "{0}_dbname".format(connection_name)))
+            engine_string = "{0}:///{1}".format(__db_type, self.config.get_value("all", "database", "{0}_dbname".format(connection_name)))
 
         # If we are on MySQL: add charset definition in the end of engine
         # string.
         if "mysql" in __db_type:
-            self.__db_engine += "?charset=utf8mb4"
+            engine_string += "?charset=utf8mb4"
 
-        self.log(1, "Engine string created: '{engine_string}'", {"engine_string": self.__db_engine})
-        self.config.set_temp_value("database/db_string", self.__db_engine)
+        self.log(1, "Engine string created: '{engine_string}'", {"engine_string": engine_string})
 
-        try:
-            # We should not pass client_encoding for MySQL connections.
-            if "mysql" in __db_type:
-                self.__db_engine = create_engine(self.__db_engine, isolation_level="READ UNCOMMITTED")
-            elif "sqlite" in __db_type:
-                self.__db_engine = create_engine(self.__db_engine, isolation_level="READ UNCOMMITTED")
-            else:
-                self.__db_engine = create_engine(self.__db_engine, client_encoding='utf8', isolation_level="READ UNCOMMITTED")
-            try:
-                self.__db_engine.connect()
-            except exc.OperationalError as e:
-                self.log(0, "{RED}Error while connecting to database:{RESET}")
-                self.log(0, "{RED}{error}{RESET}", {"error": repr(e)})
-            self.log(0, "Connection to database established")
-            return 1
-        except exc.OperationalError as e:
-            raise DatabaseConnectionException(e)
+        return engine_string, __db_type
 
-    def get_database_connection(self):
+    def __get_pool_parameters(self, connection_name, db_type, asynchronous = False, dbname = None):
         """
-        This method returns RAW database connection pointer to caller.
-        Useful when running migrations.
+        Returns create_engine() parameters for connection pool.
 
-        @retval db_engine Raw database connection.
+        @param dbname Database name. Taken from configuration if not
+        passed.
         """
-        return self.__db_engine
+        if not dbname:
+            dbname = self.config.get_value("all", "database", "{0}_dbname".format(connection_name))
+        if "sqlite" in db_type and (not dbname or dbname == ":memory:"):
+            # Every connection to in-memory database creates new
+            # database, so only one connection should be used.
+            return {
+                "poolclass"         : pool.StaticPool,
+                "connect_args"      : {"check_same_thread": False}
+            }
 
-    def get_database_mapping(self, mapping_name):
+        self.__register_connection_schemas((connection_name, ))
+        parameters = {
+            "poolclass"         : StatisticsAsyncQueuePool if asynchronous else StatisticsQueuePool,
+            "pool_size"         : self.config.get_value("all", "database", "{0}_pool_size".format(connection_name)),
+            "max_overflow"      : self.config.get_value("all", "database", "{0}_max_overflow".format(connection_name)),
+            "pool_timeout"      : self.config.get_value("all", "database", "{0}_pool_timeout".format(connection_name)),
+            "pool_recycle"      : self.config.get_value("all", "database", "{0}_pool_recycle".format(connection_name)),
+            "pool_pre_ping"     : self.config.get_value("all", "database", "{0}_pool_pre_ping".format(connection_name))
+        }
+        if "sqlite" in db_type:
+            # Pooled SQLite connections are used from different threads.
+            parameters["connect_args"] = {"check_same_thread": False}
+
+        self.log(1, "Connection pool for '{conn_name}': size {pool_size}, overflow {max_overflow}", {"conn_name": connection_name, "pool_size": parameters["pool_size"], "max_overflow": parameters["max_overflow"]})
+        return parameters
+
+    def __get_replicas(self, connection_name):
         """
-        Call lib.common_libs.loader.Loader for loading or returning a
-        pointer to database mapping class, which can be used with
-        database session.
+        Returns a list of connection's replicas names.
+        """
+        self.__register_connection_schemas((connection_name, ))
+        replicas = self.config.get_value("all", "database", "{0}_replicas".format(connection_name))
+        return [replica.strip() for replica in replicas.split(",") if replica.strip()]
 
-        @param mapping_name Name of table to obtain mapping.
-        @retval Mapping Instance of ``lib.common_libs.database_mappings.{mapping_name}``
+    def __get_scope(self):
         """
-        caller = sys._getframe(1).f_locals["self"].__class__.__name__
-        db_mapping = self.loader.request_db_mapping(mapping_name)
-        self.log(2, "Returning database mapping '{BLUE}{mapping_name}{RESET}' to '{MAGENTA}{caller}{RESET}'", {"caller": caller, "mapping_name": mapping_name})
-        return db_mapping
+        Returns scope for scoped sessions: current asyncio task, or
+        current thread's scope key if called outside of task. Sessions
+        of scope are forgotten when task is done or thread exits.
+        """
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        if task is not None:
+            if task not in self.__task_scopes:
+                self.__task_scopes.add(task)
+                task.add_done_callback(self.__forget_scope)
+            return task
 
-    def get_session(self):
+        scope = getattr(self.__thread_scope, "scope", None)
+        if scope is None:
+            scope = ThreadScope(self.__forget_scope)
+            self.__thread_scope.scope = scope
+        return scope.key
+
+    def __get_session_factory(self, connection_name):
+        """
+        Returns cached session factory for connection.
         """
-        Returns session object from currently established connection.
+        factory = self.__session_factories.get(connection_name)
+        if factory is not None:
+            return factory
 
-        @retval Session Session pointer.
+        engine = self.__engines[connection_name]
+        replicas = [self.__engines[replica] for replica in self.__replicas.get(connection_name, [])]
+        if replicas:
+            factory = sessionmaker(bind = engine, class_ = RoutingSession, expire_on_commit = False, primary = engine, replicas = replicas)
+        else:
+            factory = sessionmaker(bind = engine, expire_on_commit = False)
+
+        self.__session_factories[connection_name] = factory
+        return factory
+
+    def __get_table(self, table):
         """
-        caller = sys._getframe(1).f_locals["self"].__class__.__name__
-        self.log(2, "Returning session object to '{CYAN}{caller}{RESET}'", {"caller": caller})
-        session = sessionmaker(bind = self.__db_engine, expire_on_commit = False)
-        session.configure(bind = self.__db_engine)
-        return session()
+        Returns Table object for table or mapped class.
+        """
+        return getattr(table, "__table__", table)
 
-    def init_library(self):
+    def __install_events(self, engine):
         """
+        Installs engine events handlers.
         """
-        self.log(0, "Initializing database connection...")
+        if self.__instrumentation:
+            event.listen(engine, "before_cursor_execute", self.__instrumentation.before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self.__instrumentation.after_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.__on_cursor_execute)
+        event.listen(engine, "commit", self.__on_transaction_end)
+        event.listen(engine, "rollback", self.__on_transaction_end)
 
-        self.__database_data = self.config.get_keys_for_group("all", "database")
+    def __invalidate_table(self, connection, table):
+        """
+        Invalidates cached results of table which was written to, and
+        remembers it for invalidating them again on transaction end.
+        """
+        table = table.lower()
+        self.__result_cache.invalidate((table, ))
+        connection.info.setdefault("written_tables", set()).add(table)
 
-        common.TEMP_SETTINGS["DBMap"] = declarative_base()
+    def __on_configuration_changed(self, changes):
+        """
+        Applies changed slow query threshold.
+        """
+        if ("database", "slow_query_threshold") in changes:
+            self.__instrumentation.set_slow_threshold(changes[("database", "slow_query_threshold")][1])
 
-    def load_mappings(self):
+    def __on_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
         """
-        Loads tables mappings.
+        Invalidates cached results of table which query writes to.
         """
-        self.log(0, "Loading database mappings...")
+        match = self.WRITE_QUERY.match(statement)
+        if match is None:
+            return
 
-        mappings_path = os.path.join(self.config.get_temp_value("SCRIPT_PATH"), "lib", "database_mappings")
-        if not os.path.exists(mappings_path):
-            self.log(0, "{RED}ERROR{RESET}: database mappings loading requested, but no database mappings are found in '{mappings_path}'", {"mappings_path": mappings_path})
-            return 1
+        self.__invalidate_table(connection, match.group(1))
 
-        files = os.listdir(mappings_path)
+    def __on_transaction_end(self, connection):
+        """
+        Invalidates cached results of tables written in transaction
+        again, as results might be cached between write and transaction
+        end.
+        """
+        tables = connection.info.pop("written_tables", None)
+        if tables:
+            self.__result_cache.invalidate(tables)
 
-        for item in files:
-            if item.startswith("__"):
+    def __register_connection_schemas(self, connection_names):
+        """
+        Registers schemas of connections options, if they aren't
+        registered yet.
+
+        @param connection_names Iterable of connections names.
+        """
+        not_negative = lambda value: value >= 0
+        schema = {}
+        for connection_name in connection_names:
+            if connection_name in self.__connection_schemas:
                 continue
 
-            mapping_module_name = item.split(".")[0]
-            self.log(1, "Loading database mapping: '{BLUE}{mapping_module_name}{RESET}'", {"mapping_module_name": mapping_module_name})
+            self.__connection_schemas.add(connection_name)
+            schema.update({
+                "{0}_async_type".format(connection_name)        : {"type": str, "default": ""},
+                "{0}_replicas".format(connection_name)          : {"type": str, "default": ""},
+                "{0}_pool_size".format(connection_name)         : {"type": int, "default": 5, "validator": not_negative},
+                "{0}_max_overflow".format(connection_name)      : {"type": int, "default": 10, "validator": lambda value: value >= -1},
+                "{0}_pool_timeout".format(connection_name)      : {"type": float, "default": 30, "validator": not_negative},
+                "{0}_pool_recycle".format(connection_name)      : {"type": int, "default": -1},
+                "{0}_pool_pre_ping".format(connection_name)     : {"type": bool, "default": False}
+            })
 
-            self.loader.request_db_mapping(mapping_module_name)
+        if schema:
+            self.config.register_schema("database", schema)
 
 class DatabaseConnectionException(RegiusException):
     """
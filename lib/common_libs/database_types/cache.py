@@ -0,0 +1,165 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import collections
+import threading
+import time
+
+class ResultCache:
+    """
+    LRU cache of query results with TTL and per-table invalidation.
+
+    Results are kept until they are expired (TTL), evicted (least
+    recently used results are evicted when cache is full) or
+    invalidated. Every result is linked with tables it was read from,
+    so write to table invalidates all results which were read from it.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.__max_size = max_size
+        self.__ttl = ttl
+
+        # Key => (expiration time, value, tables).
+        self.__entries = collections.OrderedDict()
+        # Table name => set of keys.
+        self.__tables = {}
+        # Table name => number of invalidations. Used for detecting
+        # results which were read before invalidation, but are put into
+        # cache after it.
+        self.__versions = {}
+        self.__clears = 0
+        self.__lock = threading.Lock()
+
+        self.__statistics = {
+            "hits"              : 0,
+            "misses"            : 0,
+            "evictions"         : 0,
+            "expirations"       : 0,
+            "invalidations"     : 0
+        }
+
+    def clear(self):
+        """
+        Removes all results from cache.
+        """
+        with self.__lock:
+            self.__statistics["invalidations"] += len(self.__entries)
+            self.__entries.clear()
+            self.__tables.clear()
+            self.__clears += 1
+
+    def get(self, key):
+        """
+        Returns cached result, or None if there is no valid result for
+        key.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__statistics["misses"] += 1
+                return None
+
+            if entry[0] <= time.monotonic():
+                self.__remove(key)
+                self.__statistics["expirations"] += 1
+                self.__statistics["misses"] += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.__statistics["hits"] += 1
+            return entry[1]
+
+    def get_statistics(self):
+        """
+        Returns a dictionary with cache statistics: number of hits,
+        misses, evictions, expirations, invalidations, current size and
+        hit ratio.
+        """
+        with self.__lock:
+            stats = dict(self.__statistics)
+            stats["size"] = len(self.__entries)
+
+        stats["hit_ratio"] = 0
+        if stats["hits"] + stats["misses"]:
+            stats["hit_ratio"] = stats["hits"] / (stats["hits"] + stats["misses"])
+        return stats
+
+    def get_versions(self, tables):
+        """
+        Returns tables versions, which should be passed to set() for
+        results which are read after this call.
+
+        @param tables Iterable of tables names.
+        """
+        with self.__lock:
+            return (self.__clears, tuple(self.__versions.get(table, 0) for table in sorted(tables)))
+
+    def invalidate(self, tables):
+        """
+        Removes all results which were read from tables.
+
+        @param tables Iterable of tables names.
+        """
+        with self.__lock:
+            for table in tables:
+                self.__versions[table] = self.__versions.get(table, 0) + 1
+                for key in list(self.__tables.get(table, ())):
+                    self.__remove(key)
+                    self.__statistics["invalidations"] += 1
+
+    def set(self, key, value, tables, ttl = None, versions = None):
+        """
+        Puts result into cache.
+
+        @param key Result key, should be hashable.
+        @param value Result, must not be None.
+        @param tables Iterable of tables names result was read from.
+        @param ttl Result lifetime in seconds. Cache's default is used if
+        not passed.
+        @param versions Tables versions (see get_versions()) taken before
+        result was read. Result isn't cached if tables were invalidated
+        since then.
+        """
+        if ttl is None:
+            ttl = self.__ttl
+
+        with self.__lock:
+            if versions is not None and versions != (self.__clears, tuple(self.__versions.get(table, 0) for table in sorted(tables))):
+                return
+
+            if key in self.__entries:
+                self.__remove(key)
+
+            tables = frozenset(tables)
+            self.__entries[key] = (time.monotonic() + ttl, value, tables)
+            for table in tables:
+                self.__tables.setdefault(table, set()).add(key)
+
+            while len(self.__entries) > self.__max_size:
+                self.__remove(next(iter(self.__entries)))
+                self.__statistics["evictions"] += 1
+
+    def __remove(self, key):
+        """
+        Removes result from cache. Lock must be held.
+        """
+        entry = self.__entries.pop(key)
+        for table in entry[2]:
+            keys = self.__tables[table]
+            keys.discard(key)
+            if not keys:
+                del self.__tables[table]
@@ -0,0 +1,192 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import contextlib
+import os
+import re
+import sys
+import threading
+import time
+
+import sqlalchemy
+
+class QueryInstrumentation:
+    """
+    Collects per-query statistics of SQL queries.
+
+    Its before_cursor_execute() and after_cursor_execute() methods are
+    SQLAlchemy engine events handlers. Every executed query is timed
+    and accounted under its normalized form (literals and lists of
+    values are replaced), so same query with different parameters is
+    counted once. For every normalized query place in code which
+    executed it first is remembered. Queries which took longer than
+    slow query threshold are logged, with place in code which executed
+    them.
+    """
+
+    # Normalized forms of this number of different statements are
+    # remembered.
+    NORMALIZED_CACHE_SIZE = 1000
+    # Files which aren't considered as query call site.
+    SKIP_PATHS = (
+        os.path.dirname(sqlalchemy.__file__),
+        os.path.dirname(os.path.abspath(__file__)),
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database.py"),
+        contextlib.__file__
+    )
+
+    LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+    VALUES = re.compile(r"\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+    # Placeholders of different drivers: %s, %(name)s, :name, $1.
+    PLACEHOLDERS = re.compile(r"%s|%\(\w+\)s|(?<![:\w]):\w+|\$\d+")
+    WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self, logger, slow_threshold):
+        self.log = logger
+        self.__slow_threshold = slow_threshold
+
+        # Normalized statement => statistics.
+        self.__statistics = {}
+        # Statement => normalized statement.
+        self.__normalized = {}
+        self.__lock = threading.Lock()
+
+    def after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        """
+        Accounts executed query.
+        """
+        rows = cursor.rowcount if cursor.rowcount > 0 else 0
+        self.record(statement, time.perf_counter() - context.regius_query_started, rows)
+
+    def before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        """
+        Remembers query start time.
+        """
+        context.regius_query_started = time.perf_counter()
+
+    def get_top(self, count = 10):
+        """
+        Returns a list of statistics for count normalized queries which
+        took most total time. Every item is a dictionary with query,
+        number of executions, total, maximum and average execution time
+        in seconds, number of affected (or fetched, if driver reports
+        it) rows, number of slow executions and call site.
+        """
+        with self.__lock:
+            top = [dict(stats) for stats in self.__statistics.values()]
+
+        top.sort(key = lambda stats: stats["total_time"], reverse = True)
+        top = top[:count]
+        for stats in top:
+            stats["average_time"] = stats["total_time"] / stats["count"]
+        return top
+
+    def record(self, statement, duration, rows):
+        """
+        Accounts query which was executed bypassing engine events (like
+        COPY, which is executed with DBAPI cursor directly).
+
+        @param statement Executed statement.
+        @param duration Execution time in seconds.
+        @param rows Number of affected rows.
+        """
+        normalized = self.__normalized.get(statement)
+        if normalized is None:
+            normalized = self.__normalize(statement)
+
+        slow = self.__slow_threshold and duration >= self.__slow_threshold
+
+        with self.__lock:
+            stats = self.__statistics.get(normalized)
+            if stats is None:
+                stats = {
+                    "statement"     : normalized,
+                    "count"         : 0,
+                    "total_time"    : 0,
+                    "max_time"      : 0,
+                    "rows"          : 0,
+                    "slow"          : 0,
+                    "call_site"     : None
+                }
+                self.__statistics[normalized] = stats
+
+            stats["count"] += 1
+            stats["total_time"] += duration
+            stats["rows"] += rows
+            if duration > stats["max_time"]:
+                stats["max_time"] = duration
+            if slow:
+                stats["slow"] += 1
+
+        # Call site is looked up only for new and slow queries, as
+        # stack walking isn't cheap.
+        if stats["call_site"] is None or slow:
+            call_site = self.__get_call_site()
+            stats["call_site"] = stats["call_site"] or call_site
+
+        if slow:
+            self.log(0, "{YELLOW}Slow query{RESET} ({duration} s, {rows} rows) at {CYAN}{call_site}{RESET}: {statement}", {"duration": round(duration, 3), "rows": rows, "call_site": call_site, "statement": statement})
+
+    def reset(self):
+        """
+        Forgets collected statistics.
+        """
+        with self.__lock:
+            self.__statistics = {}
+
+    def set_slow_threshold(self, slow_threshold):
+        """
+        Sets slow query threshold in seconds. 0 disables slow queries
+        logging.
+        """
+        self.__slow_threshold = slow_threshold
+
+    def __get_call_site(self):
+        """
+        Returns first place in stack which is outside of SQLAlchemy and
+        database library.
+        """
+        frame = sys._getframe(2)
+        while frame:
+            filename = frame.f_code.co_filename
+            # Generated code (like SQLAlchemy's decorators) has
+            # filenames like "<string>".
+            if not filename.startswith(self.SKIP_PATHS) and not filename.startswith("<"):
+                return "{0}:{1} in {2}".format(filename, frame.f_lineno, frame.f_code.co_name)
+            frame = frame.f_back
+
+        return "unknown"
+
+    def __normalize(self, statement):
+        """
+        Returns statement with literals, placeholders and lists of
+        values replaced, and whitespace collapsed.
+        """
+        # Placeholders go first, as numbers of "$1" placeholders would
+        # be taken for literals.
+        normalized = self.PLACEHOLDERS.sub("?", statement)
+        normalized = self.LITERALS.sub("?", normalized)
+        normalized = self.LISTS.sub("(...)", normalized)
+        normalized = self.VALUES.sub(r"VALUES \1, ...", normalized)
+        normalized = self.WHITESPACE.sub(" ", normalized).strip()
+
+        if len(self.__normalized) >= self.NORMALIZED_CACHE_SIZE:
+            self.__normalized.clear()
+        self.__normalized[statement] = normalized
+
+        return normalized
@@ -0,0 +1,76 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import time
+
+from sqlalchemy import exc
+from sqlalchemy import pool
+
+class StatisticsQueuePool(pool.QueuePool):
+    """
+    SQLAlchemy's QueuePool which also counts checkouts and measures how
+    long they were waiting for free connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pool.QueuePool.__init__(self, *args, **kwargs)
+
+        self.__statistics = {
+            "checkouts"         : 0,
+            "timeouts"          : 0,
+            "wait_total"        : 0,
+            "wait_max"          : 0
+        }
+
+    def get_statistics(self):
+        """
+        Returns a dictionary with pool statistics: pool size, number of
+        idle, checked out and overflow connections, number of checkouts
+        and checkouts which timed out, and total, maximum and average
+        checkout wait time in seconds.
+        """
+        stats = dict(self.__statistics)
+        stats["size"] = self.size()
+        stats["checked_in"] = self.checkedin()
+        stats["checked_out"] = self.checkedout()
+        stats["overflow"] = max(self.overflow(), 0)
+        stats["wait_average"] = 0
+        if stats["checkouts"]:
+            stats["wait_average"] = stats["wait_total"] / stats["checkouts"]
+        return stats
+
+    def _do_get(self):
+        """
+        Takes connection from pool, measuring wait time.
+        """
+        start = time.perf_counter()
+        try:
+            return pool.QueuePool._do_get(self)
+        except exc.TimeoutError:
+            self.__statistics["timeouts"] += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            self.__statistics["checkouts"] += 1
+            self.__statistics["wait_total"] += wait
+            if wait > self.__statistics["wait_max"]:
+                self.__statistics["wait_max"] = wait
+
+class StatisticsAsyncQueuePool(StatisticsQueuePool, pool.AsyncAdaptedQueuePool):
+    """
+    StatisticsQueuePool for asynchronous engines.
+    """
@@ -0,0 +1,95 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import random
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+
+class RoutingSession(Session):
+    """
+    Session which routes queries between primary connection and its
+    read replicas.
+
+    SELECTs are sent to randomly chosen replica, everything else
+    (flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE, raw
+    connection requests) goes to primary. After first write all
+    queries are sent to primary until transaction ends, so session
+    always sees its own changes.
+    """
+
+    def __init__(self, primary = None, replicas = None, **kwargs):
+        """
+        @param primary Primary engine.
+        @param replicas List of replica engines.
+        """
+        Session.__init__(self, **kwargs)
+
+        self.__primary = primary
+        self.__replicas = replicas or []
+        # Was something written in current transaction?
+        self.__written = False
+
+    def close(self):
+        """
+        Closes session.
+        """
+        self.__written = False
+        Session.close(self)
+
+    def commit(self):
+        """
+        Commits current transaction.
+        """
+        Session.commit(self)
+        self.__written = False
+
+    def get_bind(self, mapper = None, clause = None, **kwargs):
+        """
+        Returns engine which should execute clause.
+        """
+        if self.__primary is None:
+            return Session.get_bind(self, mapper, clause = clause, **kwargs)
+
+        if not self.__replicas or self.__written or self.__is_write(clause):
+            self.__written = True
+            return self.__primary
+
+        return random.choice(self.__replicas)
+
+    def rollback(self):
+        """
+        Rolls back current transaction.
+        """
+        Session.rollback(self)
+        self.__written = False
+
+    def __is_write(self, clause):
+        """
+        Checks if clause should be executed on primary.
+        """
+        if self._flushing or clause is None:
+            return True
+
+        if getattr(clause, "is_select", False):
+            return getattr(clause, "_for_update_arg", None) is not None
+
+        if isinstance(clause, TextClause):
+            text = clause.text.lstrip().lower()
+            return not text.startswith("select") or "for update" in text
+
+        return True
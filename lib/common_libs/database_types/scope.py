@@ -0,0 +1,39 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import itertools
+import weakref
+
+class ThreadScope:
+    """
+    Key of thread's scoped sessions, which is never reused.
+
+    Scope object is kept in thread-local storage, so it is dropped when
+    thread exits, and on_exit callback is called with scope's key then.
+    Unlike thread idents, keys are never reused, so new thread can't
+    get sessions of exited one.
+    """
+
+    __keys = itertools.count()
+
+    def __init__(self, on_exit):
+        """
+        @param on_exit Callable which is called with scope's key when
+        scope is dropped.
+        """
+        self.key = next(ThreadScope.__keys)
+        weakref.finalize(self, on_exit, self.key)
@@ -10,8 +10,9 @@ All parts of application is able to add own events and event handlers.
 This class will not be autoloaded, it should be loaded only if you want
 to write event-based application.
 
-This class is not using asyncio for now, all events are dispatched in
-synchronous mode.
+All events are dispatched in synchronous mode. Events might be also
+fired with fire_event_soon(), which will dispatch them later on shared
+event loop (see lib.common_libs.eventloop.Eventloop).
 """
 
 class Eventer(Library):
@@ -30,6 +31,10 @@ class Eventer(Library):
         Library.__init__(self)
 
         self.__events = OrderedDict()
+        # Shared event loop. Obtained on first fire_event_soon() call,
+        # so event-based applications without loop will not create it.
+        # Replaced when loop is re-created (e.g. in forked process).
+        self.__loop = None
 
     def init_library(self):
         """
@@ -95,6 +100,20 @@ class Eventer(Library):
                 self.log(2, "Firing handler '{MAGENTA}{handler}{RESET}' for '{CYAN}{event_name}{RESET}'...", {"event_name": event_name, "handler": self.__events[event_name]["handlers"][weight]["name"]})
             self.__events[event_name]["handlers"][weight]["handler"](data)
 
+    def fire_event_soon(self, event_name, data = None):
+        """
+        Schedules event firing on shared event loop. Can be called from
+        any thread.
+
+        @param event_name Name of event to fire.
+        """
+        if not self.__loop:
+            eventloop = self.loader.request_library("common_libs", "eventloop")
+            self.__loop = eventloop.get_loop()
+            eventloop.add_loop_callback(self.__on_loop_recreated)
+
+        self.__loop.call_soon_threadsafe(self.fire_event, event_name, data)
+
     def get_events(self):
         """
         Returns all available events. This can be used for iterating
@@ -102,4 +121,10 @@ class Eventer(Library):
 
         @retval list_of_events List of added events.
         """
-        return self.__events.keys()
\ No newline at end of file
+        return self.__events.keys()
+
+    def __on_loop_recreated(self, loop):
+        """
+        Switches events firing to new event loop.
+        """
+        self.__loop = loop
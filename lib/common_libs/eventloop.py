@@ -0,0 +1,189 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+
+from lib.common_libs.library import Library
+
+class Eventloop(Library):
+    """
+    This library provides event loop which is shared between all other
+    libraries (Listener, Timer, Eventer, ...). Nobody else should create
+    or close event loops.
+
+    Loop implementation is selected with "eventloop/implementation"
+    configuration value:
+
+        * "asyncio" - default asyncio loop.
+        * "uvloop" - uvloop's loop, if uvloop is installed. Otherwise
+          default asyncio loop will be used.
+
+    This library also monitors loop lag - how late loop executes
+    scheduled callbacks. Lag is measured every "eventloop/lag_interval"
+    seconds (1 by default, 0 disables monitoring), and if it is above
+    "eventloop/lag_warning" seconds (0.1 by default) - warning will be
+    logged. See get_lag_statistics().
+    """
+
+    _info = {
+        "name"          : "Event loop library",
+        "shortname"     : "eventloop",
+        "description"   : "This library responsible for providing shared event loop."
+    }
+
+    def __init__(self):
+        Library.__init__(self)
+
+        self.__loop = None
+        self.__implementation = "asyncio"
+        # Callbacks which will be executed when loop is re-created.
+        self.__loop_callbacks = []
+
+        self.__lag_interval = 1
+        self.__lag_warning = 0.1
+        self.__lag_handle = None
+        self.__lag_stats = {
+            "last"          : 0,
+            "max"           : 0,
+            "total"         : 0,
+            "count"         : 0
+        }
+
+    def add_loop_callback(self, callback):
+        """
+        Adds callback which will be executed with new loop as parameter
+        when loop will be re-created with recreate_loop().
+        """
+        self.__loop_callbacks.append(callback)
+
+    def get_implementation(self):
+        """
+        Returns name of used loop implementation.
+        """
+        return self.__implementation
+
+    def get_lag_statistics(self):
+        """
+        Returns a dictionary with loop lag statistics (in seconds):
+        last, maximum and average lag, and number of measurements.
+        """
+        stats = dict(self.__lag_stats)
+        stats["average"] = 0
+        if stats["count"]:
+            stats["average"] = stats["total"] / stats["count"]
+        return stats
+
+    def get_loop(self):
+        """
+        Returns shared event loop.
+        """
+        return self.__loop
+
+    def init_library(self):
+        """
+        Library initialization.
+
+        Sets up event loop policy and creates shared event loop.
+        """
+        self.config.register_schema("eventloop", {
+            "implementation"    : {"type": str, "default": "asyncio", "validator": lambda value: value in ("asyncio", "uvloop")},
+            "lag_interval"      : {"type": float, "default": 1, "validator": lambda value: value >= 0},
+            "lag_warning"       : {"type": float, "default": 0.1, "validator": lambda value: value > 0}
+        })
+
+        implementation = self.config.get_value("all", "eventloop", "implementation")
+        if implementation == "uvloop":
+            try:
+                import uvloop
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+                self.__implementation = "uvloop"
+            except ImportError:
+                self.log(0, "{YELLOW}Warning{RESET}: uvloop requested, but it isn't installed. Using asyncio loop.")
+
+        self.__lag_interval = self.config.get_value("all", "eventloop", "lag_interval")
+        self.__lag_warning = self.config.get_value("all", "eventloop", "lag_warning")
+
+        self.log(0, "Initializing {implementation} event loop...", {"implementation": self.__implementation})
+        self.__create_loop()
+
+    def on_shutdown(self):
+        """
+        Closes event loop.
+        """
+        if self.__lag_handle:
+            self.__lag_handle.cancel()
+            self.__lag_handle = None
+
+        if self.__loop and not self.__loop.is_running() and not self.__loop.is_closed():
+            self.log(1, "Closing event loop...")
+            self.__loop.close()
+
+    def recreate_loop(self):
+        """
+        Creates new event loop instead of current one. Should be used
+        in forked processes, which must not use parent's loop. Callbacks
+        added with add_loop_callback() will be executed with new loop.
+
+        @retval loop New event loop.
+        """
+        self.log(1, "Re-creating event loop...")
+        if self.__lag_handle:
+            self.__lag_handle.cancel()
+            self.__lag_handle = None
+
+        self.__create_loop()
+
+        for callback in self.__loop_callbacks:
+            callback(self.__loop)
+
+        return self.__loop
+
+    def __create_loop(self):
+        """
+        Creates event loop, makes it current and starts lag monitoring.
+        """
+        self.__loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.__loop)
+
+        # Monitoring is armed when loop starts running, otherwise time
+        # spent on startup before that would be measured as lag.
+        if self.__lag_interval > 0:
+            self.__lag_handle = self.__loop.call_soon(self.__schedule_lag_check)
+
+    def __check_lag(self, expected):
+        """
+        Measures loop lag.
+        """
+        lag = self.__loop.time() - expected
+        self.__lag_stats["last"] = lag
+        self.__lag_stats["total"] += lag
+        self.__lag_stats["count"] += 1
+        if lag > self.__lag_stats["max"]:
+            self.__lag_stats["max"] = lag
+
+        if lag > self.__lag_warning:
+            self.log(0, "{YELLOW}Warning{RESET}: event loop lag is {lag:.3f}s", {"lag": lag})
+
+        self.__schedule_lag_check()
+
+    def __schedule_lag_check(self):
+        """
+        Schedules next loop lag measurement. Measurement is anchored on
+        time this method is called on.
+        """
+        expected = self.__loop.time() + self.__lag_interval
+        self.__lag_handle = self.__loop.call_at(expected, self.__check_lag, expected)
@@ -1,6 +1,14 @@
 import asyncio
+import concurrent.futures
 import importlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import subprocess
 import sys
+import time
 
 from lib.common_libs.library import Library
 
@@ -13,8 +21,74 @@ class Listener(Library):
     """
     This class responsible for starting listening for client connections
     in asyncio loop.
+
+    Server parameters are taken from "listener" configuration group:
+
+        * protocol - protocol name, lib.protocols.{protocol}.
+        * address, port - address and port to listen on.
+        * backlog - listening socket's backlog (100 by default).
+        * reuse_port - set SO_REUSEPORT on listening socket.
+        * max_connections - maximum number of simultaneous connections,
+          connections above it will be closed right after accepting.
+          0 (default) means unlimited.
+        * read_buffer_limit, write_buffer_limit - per-connection
+          buffers limits in bytes, 65536 by default. See
+          lib.common_libs.protocol.Protocol for flow control details.
+        * idle_timeout - close connections which received nothing for
+          this amount of seconds. 0 (default) disables it.
+        * dispatch - where protocols process_request() is executed:
+          "inline" (default, on event loop), "thread" or "process"
+          (in pool). See lib.common_libs.protocol.Protocol.
+        * dispatch_workers - dispatch pool size, Python's default by
+          default.
+        * dispatch_queue - maximum number of requests in dispatch pool
+          queue (1024 by default). If it is reached - connections with
+          requests in flight stop reading.
+        * pipeline_depth - maximum number of requests in flight per
+          connection (16 by default).
+        * mode - "single" (default) serves everything in this process,
+          "prefork" spawns worker processes.
+        * workers - number of worker processes for "prefork" mode,
+          CPU count by default.
+        * drain_timeout - maximum number of seconds to wait for requests
+          in flight while draining (30 by default).
+
+    Limits are enforced by lib.common_libs.protocol.Protocol, so
+    protocols should be subclassed from it.
+
+    In "prefork" mode every worker runs own event loop with own
+    SO_REUSEPORT socket, so kernel balances connections between them.
+    This process becomes a supervisor: it restarts crashed workers
+    (with increasing delay if they keep crashing right after start) and
+    collects workers statistics, which are sent by every worker once
+    per second. Limits are applied per worker.
+
+    Signals:
+
+        * SIGTERM - drain: stop accepting new connections, close every
+          connection when it will have no requests in flight and stop
+          when all connections are closed or drain_timeout is reached.
+          Supervisor forwards SIGTERM to workers and waits for them.
+        * SIGHUP - hot restart: start new application process with same
+          arguments and drain this one when new process is ready. In
+          "single" mode listening sockets are passed to new process, so
+          connections are accepted all the time. In "prefork" mode new
+          workers are binding own SO_REUSEPORT sockets. New process
+          sends SIGTERM to old one when it is listening, so if it fails
+          to start - old process keeps serving.
     """
 
+    # Environment variables used for passing state to new process on
+    # hot restart.
+    LISTENER_FDS_ENV = "REGIUS_LISTENER_FDS"
+    LISTENER_PARENT_ENV = "REGIUS_LISTENER_PARENT"
+
+    _info = {
+        "name"          : "Listener library",
+        "shortname"     : "listener",
+        "description"   : "This library responsible for listening for client connections."
+    }
+
     def __init__(self):
         Library.__init__(self)
 
@@ -22,15 +96,221 @@ class Listener(Library):
         self.__address = None
         self.__port = None
 
+        self.__backlog = 100
+        self.__reuse_port = False
+        self.__limits = {
+            "max_connections"       : 0,
+            "read_buffer_limit"     : 65536,
+            "write_buffer_limit"    : 65536,
+            "idle_timeout"          : 0,
+            "dispatch"              : "inline",
+            "dispatch_queue"        : 1024,
+            "pipeline_depth"        : 16
+        }
+
+        # Pool for dispatching requests. Created on first use, so every
+        # prefork worker have own pool.
+        self.__dispatch_pool = None
+        self.__dispatch_workers = None
+        # Number of requests in dispatch pool (queued or running).
+        self.__dispatch_queue = 0
+
+        # Currently opened connections (protocol instances).
+        self.__connections = set()
+        self.__stats = {
+            "connections_total"     : 0,
+            "connections_rejected"  : 0,
+            "connections_idle"      : 0,
+            "requests_dispatched"   : 0,
+            "requests_failed"       : 0,
+            "dispatch_queue_max"    : 0
+        }
+
+        self.__eventloop = None
+        self.__loop = None
+        self.__idle_handle = None
+        self.__servers = []
+
+        self.__drain_timeout = 30
+        self.__draining = False
+        self.__drain_handle = None
+
+        self.__mode = "single"
+        self.__workers_count = os.cpu_count() or 1
+        # Worker index => worker data. Supervisor only.
+        self.__workers = {}
+        # Worker index => last statistics received from worker.
+        self.__workers_stats = {}
+        self.__supervising = False
+        # Index of this worker. None for supervisor or single mode.
+        self.__worker_index = None
+        self.__stats_handle = None
+
+    def dispatch(self, function, *args):
+        """
+        Executes function in dispatch pool.
+
+        @retval future asyncio future with function's result.
+        """
+        if not self.__dispatch_pool:
+            self.log(1, "Creating {dispatch} dispatch pool...", {"dispatch": self.__limits["dispatch"]})
+            if self.__limits["dispatch"] == "process":
+                self.__dispatch_pool = concurrent.futures.ProcessPoolExecutor(self.__dispatch_workers)
+            else:
+                self.__dispatch_pool = concurrent.futures.ThreadPoolExecutor(self.__dispatch_workers)
+
+        try:
+            concurrent_future = self.__dispatch_pool.submit(function, *args)
+        except Exception:
+            # Request is never dispatched, so it must not occupy dispatch
+            # queue.
+            self.__stats["requests_failed"] += 1
+            raise
+
+        self.__dispatch_queue += 1
+        self.__stats["requests_dispatched"] += 1
+        if self.__dispatch_queue > self.__stats["dispatch_queue_max"]:
+            self.__stats["dispatch_queue_max"] = self.__dispatch_queue
+
+        # Request occupies dispatch queue until function is finished in
+        # pool, even if asyncio future was cancelled earlier (e.g. when
+        # connection was lost).
+        concurrent_future.add_done_callback(self.__dispatch_finished)
+        return asyncio.wrap_future(concurrent_future, loop = self.__loop)
+
+    def drain(self):
+        """
+        Stops accepting new connections and closes opened connections
+        as soon as they will have no requests in flight. Event loop is
+        stopped when all connections are closed, or when drain_timeout
+        is reached - remaining connections are aborted then.
+        """
+        if self.__draining:
+            return
+
+        self.__draining = True
+        self.log(0, "Draining {count} connections...", {"count": len(self.__connections)})
+
+        for server in self.__servers:
+            server.close()
+        if self.__idle_handle:
+            self.__idle_handle.cancel()
+            self.__idle_handle = None
+
+        for protocol in list(self.__connections):
+            protocol.close_when_idle()
+
+        if self.__connections:
+            self.__drain_handle = self.__loop.call_later(self.__drain_timeout, self.__drain_deadline)
+        else:
+            self.__loop.stop()
+
+    def get_limits(self):
+        """
+        Returns a dictionary with connection limits.
+        """
+        return self.__limits
+
+    def get_statistics(self):
+        """
+        Returns a dictionary with connections statistics: currently
+        opened connections, total accepted connections, rejected
+        connections (due to connections limit), connections closed
+        due to idle timeout, dispatched and failed requests, and current
+        and maximum dispatch queue depth.
+
+        In "prefork" mode supervisor returns sum of all workers
+        statistics with number of running workers and workers restarts.
+        """
+        if self.__mode == "prefork" and self.__worker_index is None:
+            stats = {
+                "connections"           : 0,
+                "workers"               : 0,
+                "workers_restarts"      : 0
+            }
+            for key in self.__stats:
+                stats[key] = 0
+
+            for index in self.__workers_stats:
+                for key, value in self.__workers_stats[index].items():
+                    stats[key] = stats.get(key, 0) + value
+
+            for index in self.__workers:
+                stats["workers_restarts"] += self.__workers[index]["restarts"]
+                if self.__workers[index]["process"] and self.__workers[index]["process"].is_alive():
+                    stats["workers"] += 1
+
+            return stats
+
+        stats = dict(self.__stats)
+        stats["connections"] = len(self.__connections)
+        stats["dispatch_queue"] = self.__dispatch_queue
+        return stats
+
+    def get_workers_statistics(self):
+        """
+        Returns a dictionary with last statistics received from every
+        worker, worker index => statistics. Supervisor only.
+        """
+        return dict(self.__workers_stats)
+
+    def hot_restart(self):
+        """
+        Starts new application process with same arguments. In "single"
+        mode listening sockets are inherited by new process. This
+        process will be drained when new process will send SIGTERM.
+        """
+        env = dict(os.environ)
+        env[self.LISTENER_PARENT_ENV] = str(os.getpid())
+
+        fds = []
+        if self.__mode == "single":
+            for server in self.__servers:
+                for sock in server.sockets:
+                    fds.append(sock.fileno())
+            env[self.LISTENER_FDS_ENV] = ",".join([str(fd) for fd in fds])
+
+        self.log(0, "Hot restart requested, starting new process...")
+        try:
+            process = subprocess.Popen([sys.executable] + sys.argv, env = env, pass_fds = fds)
+        except OSError as e:
+            self.log(0, "{RED}ERROR:{RESET} failed to start new process: {error}", {"error": e})
+            return
+
+        self.log(0, "Started new process with PID {pid}, waiting for it to become ready...", {"pid": process.pid})
+
     def init_library(self):
         """
         Library initialization.
 
-        For this class doing nothing that just print initialization
-        message.
+        Imports protocol handler and reads server parameters from
+        configuration.
         """
         self.log(0, "Initializing Listener...")
 
+        self.__eventloop = self.loader.request_library("common_libs", "eventloop")
+
+        not_negative = lambda value: value >= 0
+        positive = lambda value: value > 0
+        self.config.register_schema("listener", {
+            "protocol"              : {"type": str},
+            "address"               : {"type": str},
+            "port"                  : {"type": int, "validator": lambda value: 0 <= value <= 65535},
+            "backlog"               : {"type": int, "default": 100, "validator": positive},
+            "reuse_port"            : {"type": bool, "default": False},
+            "max_connections"       : {"type": int, "default": 0, "validator": not_negative},
+            "read_buffer_limit"     : {"type": int, "default": 65536, "validator": not_negative},
+            "write_buffer_limit"    : {"type": int, "default": 65536, "validator": not_negative},
+            "idle_timeout"          : {"type": int, "default": 0, "validator": not_negative},
+            "dispatch"              : {"type": str, "default": "inline", "validator": lambda value: value in ("inline", "thread", "process")},
+            "dispatch_workers"      : {"type": int, "validator": positive},
+            "dispatch_queue"        : {"type": int, "default": 1024, "validator": positive},
+            "pipeline_depth"        : {"type": int, "default": 16, "validator": positive},
+            "mode"                  : {"type": str, "default": "single", "validator": lambda value: value in ("single", "prefork")},
+            "workers"               : {"type": int, "default": os.cpu_count() or 1, "validator": positive},
+            "drain_timeout"         : {"type": float, "default": 30, "validator": not_negative}
+        })
+
         self.__proto = self.config.get_value("all", "listener", "protocol")
         importlib.import_module("lib.protocols." + self.__proto)
         exec("self.ph = sys.modules['lib.protocols.{0}'].{1}".format(self.__proto, self.__proto.capitalize()))
@@ -39,14 +319,65 @@ class Listener(Library):
         self.__address = self.config.get_value("all", "listener", "address")
         self.__port = self.config.get_value("all", "listener", "port")
 
+        self.__backlog = self.config.get_value("all", "listener", "backlog")
+        self.__reuse_port = self.config.get_value("all", "listener", "reuse_port")
+        for limit in self.__limits:
+            self.__limits[limit] = self.config.get_value("all", "listener", limit)
+
+        self.__dispatch_workers = self.config.get_value("all", "listener", "dispatch_workers")
+        self.__mode = self.config.get_value("all", "listener", "mode")
+        self.__workers_count = self.config.get_value("all", "listener", "workers")
+        self.__drain_timeout = self.config.get_value("all", "listener", "drain_timeout")
+
+        self.config.subscribe(self.__on_configuration_changed, "listener")
+
+    def is_dispatch_queue_full(self):
+        """
+        Returns True if dispatch queue limit is reached.
+        """
+        return self.__dispatch_queue >= self.__limits["dispatch_queue"]
+
+    def on_shutdown(self):
+        """
+        Shuts down dispatch pool.
+        """
+        if self.__dispatch_pool:
+            self.log(1, "Shutting down dispatch pool...")
+            # Pool is waited for, as worker process exits right after
+            # shutdown, and pool processes which weren't told to stop
+            # would outlive it. Requests still in queue are cancelled.
+            self.__dispatch_pool.shutdown(wait = True, cancel_futures = True)
+            self.__dispatch_pool = None
+
+    def register_connection(self, protocol):
+        """
+        Registers new connection. Called by protocol.
+
+        @retval accepted False if connections limit is reached and
+        connection should be closed.
+        """
+        if self.__limits["max_connections"] and len(self.__connections) >= self.__limits["max_connections"]:
+            self.__stats["connections_rejected"] += 1
+            return False
+
+        self.__connections.add(protocol)
+        self.__stats["connections_total"] += 1
+        return True
+
     def start_listening(self):
         """
         This method starts listening on port.
         """
-        loop = asyncio.get_event_loop()
-        coro = loop.create_server(self.__proto_handler, self.__address, self.__port)
-        self.log(0, "Starting listening for connections on tcp://{address}:{port}/", {"address": self.__address, "port": self.__port})
-        server = loop.run_until_complete(coro)
+        if self.__mode == "prefork":
+            self.__supervise()
+            return
+
+        loop = self.__eventloop.get_loop()
+        self.__start_server(loop)
+        loop.add_signal_handler(signal.SIGTERM, self.drain)
+        loop.add_signal_handler(signal.SIGHUP, self.hot_restart)
+        self.__notify_parent()
+
         try:
             loop.run_forever()
         except KeyboardInterrupt as e:
@@ -56,6 +387,334 @@ class Listener(Library):
             self.log(0, "{RED}ERROR:{RESET} RuntimeError appeared: {error}", {"error": e})
             self.log(0, "{RED}Error appeared in __listen_to_tcp() method.{RESET}")
 
-        server.close()
-        loop.run_until_complete(server.wait_closed())
-        loop.close()
+        loop.remove_signal_handler(signal.SIGTERM)
+        loop.remove_signal_handler(signal.SIGHUP)
+        self.__stop_server(loop)
+
+    def unregister_connection(self, protocol):
+        """
+        Removes connection from opened connections list. Called by
+        protocol.
+        """
+        self.__connections.discard(protocol)
+
+        if self.__draining and not self.__connections:
+            if self.__drain_handle:
+                self.__drain_handle.cancel()
+                self.__drain_handle = None
+            self.log(0, "All connections are closed")
+            self.__loop.stop()
+
+    def __close_idle_connections(self):
+        """
+        Closes connections which received nothing for idle_timeout
+        seconds.
+        """
+        if not self.__limits["idle_timeout"]:
+            self.__idle_handle = None
+            return
+
+        deadline = self.__loop.time() - self.__limits["idle_timeout"]
+        for protocol in list(self.__connections):
+            if protocol.last_activity < deadline and not protocol.transport.is_closing():
+                self.__stats["connections_idle"] += 1
+                protocol.transport.close()
+
+        self.__schedule_idle_check()
+
+    def __check_workers(self, ready):
+        """
+        Receives statistics from workers and restarts dead ones.
+        Supervisor only.
+
+        @param ready List of worker pipes and sentinels which are ready.
+        """
+        now = time.monotonic()
+        for index in self.__workers:
+            worker = self.__workers[index]
+            process = worker["process"]
+
+            if worker["pipe"] in ready:
+                try:
+                    while worker["pipe"].poll():
+                        self.__workers_stats[index] = worker["pipe"].recv()
+                except (EOFError, OSError):
+                    pass
+
+                # Every worker sends statistics right after it started
+                # listening.
+                if len(self.__workers_stats) == self.__workers_count:
+                    self.__notify_parent()
+
+            if process and process.sentinel in ready:
+                process.join()
+                worker["pipe"].close()
+                worker["process"] = None
+                self.__workers_stats.pop(index, None)
+
+                # Workers which are crashing right after start are
+                # restarted with increasing delay.
+                if now - worker["started"] < 1:
+                    worker["failures"] += 1
+                else:
+                    worker["failures"] = 0
+                delay = min(2 ** worker["failures"] - 1, 30)
+                worker["restart_at"] = now + delay
+
+                self.log(0, "{RED}ERROR:{RESET} worker {index} (PID {pid}) exited with code {code}, restarting in {delay}s...", {"index": index, "pid": process.pid, "code": process.exitcode, "delay": delay})
+
+            if not worker["process"] and self.__supervising and now >= worker["restart_at"]:
+                worker["restarts"] += 1
+                self.__start_worker(index)
+
+    def __dispatch_done(self, future):
+        """
+        Updates dispatch statistics when request is processed.
+
+        @param future concurrent.futures.Future of request.
+        """
+        self.__dispatch_queue -= 1
+        if future.cancelled() or future.exception():
+            self.__stats["requests_failed"] += 1
+
+    def __dispatch_finished(self, future):
+        """
+        Called in pool's thread when request is processed, passes it to
+        event loop.
+        """
+        try:
+            self.__loop.call_soon_threadsafe(self.__dispatch_done, future)
+        except RuntimeError:
+            # Loop is already closed on shutdown.
+            pass
+
+    def __create_protocol(self):
+        """
+        Protocol factory for event loop.
+        """
+        protocol = self.__proto_handler()
+        protocol.listener = self
+        protocol.log = self.log
+        return protocol
+
+    def __drain_deadline(self):
+        """
+        Aborts connections which are still opened when drain_timeout is
+        reached.
+        """
+        self.__drain_handle = None
+        self.log(0, "{YELLOW}Warning{RESET}: drain timeout reached, aborting {count} connections", {"count": len(self.__connections)})
+        for protocol in list(self.__connections):
+            protocol.transport.abort()
+        self.__loop.stop()
+
+    def __notify_parent(self):
+        """
+        Tells process which started this one with hot_restart() that
+        this process is ready, so it can be drained.
+        """
+        parent = os.environ.pop(self.LISTENER_PARENT_ENV, None)
+        if not parent:
+            return
+
+        self.log(0, "Listening, draining old process with PID {pid}...", {"pid": parent})
+        try:
+            os.kill(int(parent), signal.SIGTERM)
+        except (OSError, ValueError) as e:
+            self.log(0, "{RED}ERROR:{RESET} failed to signal old process: {error}", {"error": e})
+
+    def __on_supervisor_signal(self, signum, frame):
+        """
+        Supervisor's signals handler.
+        """
+        if signum == signal.SIGHUP:
+            self.hot_restart()
+        elif signum == signal.SIGTERM:
+            self.__supervising = False
+
+    def __on_configuration_changed(self, changes):
+        """
+        Applies changed limits from re-read configuration. Buffers
+        limits and pipeline depth are applied to new connections only.
+        Other parameters require restart.
+        """
+        for (group, key), (old, new) in changes.items():
+            if key in self.__limits and key != "dispatch":
+                self.__limits[key] = new
+            elif key == "drain_timeout":
+                self.__drain_timeout = new
+            else:
+                continue
+
+            self.log(0, "Listener parameter {CYAN}{key}{RESET} changed: {old} => {new}", {"key": key, "old": old, "new": new})
+
+        if self.__limits["idle_timeout"] and not self.__idle_handle and self.__servers and not self.__draining:
+            self.__schedule_idle_check()
+
+    def __report_statistics(self, pipe):
+        """
+        Sends worker statistics to supervisor. Worker only.
+        """
+        try:
+            pipe.send(self.get_statistics())
+        except (OSError, ValueError):
+            # Supervisor is gone.
+            self.__loop.stop()
+            return
+
+        self.__stats_handle = self.__loop.call_later(1, self.__report_statistics, pipe)
+
+    def __schedule_idle_check(self):
+        """
+        Schedules idle connections check. One check for all connections
+        is much cheaper than rescheduling per-connection timeout on
+        every received chunk of data.
+        """
+        self.__idle_handle = self.__loop.call_later(self.__limits["idle_timeout"] / 2, self.__close_idle_connections)
+
+    def __start_server(self, loop):
+        """
+        Starts listening on configured address and port in passed loop,
+        or on sockets inherited from old process on hot restart.
+        """
+        self.__loop = loop
+        self.__servers = []
+        self.__draining = False
+
+        fds = os.environ.pop(self.LISTENER_FDS_ENV, None)
+        if fds:
+            for fd in fds.split(","):
+                sock = socket.socket(fileno = int(fd))
+                self.log(0, "Starting listening for connections on inherited socket {address}", {"address": sock.getsockname()})
+                self.__servers.append(loop.run_until_complete(loop.create_server(self.__create_protocol, sock = sock, backlog = self.__backlog)))
+        else:
+            coro = loop.create_server(self.__create_protocol, self.__address, self.__port, backlog = self.__backlog, reuse_port = self.__reuse_port or None)
+            self.log(0, "Starting listening for connections on tcp://{address}:{port}/", {"address": self.__address, "port": self.__port})
+            self.__servers.append(loop.run_until_complete(coro))
+
+        if self.__limits["idle_timeout"]:
+            self.__schedule_idle_check()
+
+    def __start_worker(self, index):
+        """
+        Starts worker process. Supervisor only.
+        """
+        supervisor_pipe, worker_pipe = multiprocessing.Pipe(duplex = False)
+        # Workers aren't daemonic, as daemonic processes can't have
+        # children, and process dispatch pool is started by worker.
+        # Supervisor terminates and joins them by itself.
+        process = multiprocessing.get_context("fork").Process(target = self.__worker_main, args = (index, supervisor_pipe, worker_pipe), name = "listener-worker-{0}".format(index))
+        process.start()
+        worker_pipe.close()
+
+        if not index in self.__workers:
+            self.__workers[index] = {
+                "restarts"          : 0,
+                "failures"          : 0,
+                "restart_at"        : 0
+            }
+        self.__workers[index]["process"] = process
+        self.__workers[index]["pipe"] = supervisor_pipe
+        self.__workers[index]["started"] = time.monotonic()
+
+        self.log(1, "Started worker {index} with PID {pid}", {"index": index, "pid": process.pid})
+
+    def __stop_server(self, loop):
+        """
+        Stops servers. Loop itself is closed by Eventloop library.
+        """
+        if self.__idle_handle:
+            self.__idle_handle.cancel()
+        if self.__drain_handle:
+            self.__drain_handle.cancel()
+
+        for server in self.__servers:
+            server.close()
+        for server in self.__servers:
+            loop.run_until_complete(server.wait_closed())
+        self.__servers = []
+
+    def __supervise(self):
+        """
+        Starts workers and supervises them until interrupted.
+        """
+        self.log(0, "Starting {count} listener workers...", {"count": self.__workers_count})
+        # Every worker will bind own socket.
+        self.__reuse_port = True
+        self.__supervising = True
+        # Inherited sockets are not used in this mode.
+        os.environ.pop(self.LISTENER_FDS_ENV, None)
+        signal.signal(signal.SIGTERM, self.__on_supervisor_signal)
+        signal.signal(signal.SIGHUP, self.__on_supervisor_signal)
+
+        try:
+            # Workers are started inside try block, so already started
+            # ones are stopped if starting next one fails.
+            for index in range(self.__workers_count):
+                self.__start_worker(index)
+
+            while self.__supervising:
+                waitables = []
+                for worker in self.__workers.values():
+                    if worker["process"]:
+                        waitables.append(worker["process"].sentinel)
+                        waitables.append(worker["pipe"])
+
+                ready = multiprocessing.connection.wait(waitables, timeout = 1)
+                self.__check_workers(ready)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            self.__supervising = False
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+            # SIGTERM makes workers drain their connections.
+            self.log(0, "Stopping listener workers...")
+            for worker in self.__workers.values():
+                if worker["process"]:
+                    worker["process"].terminate()
+
+            deadline = time.monotonic() + self.__drain_timeout + 5
+            for index, worker in self.__workers.items():
+                if worker["process"]:
+                    worker["process"].join(max(deadline - time.monotonic(), 0))
+                    if worker["process"].is_alive():
+                        self.log(0, "{YELLOW}Warning{RESET}: worker {index} did not stop in time, killing it", {"index": index})
+                        worker["process"].kill()
+                        worker["process"].join()
+
+    def __worker_main(self, index, supervisor_pipe, worker_pipe):
+        """
+        Worker process entry point.
+        """
+        # Interrupts are handled by supervisor, which will terminate
+        # workers.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Hot restart is handled by supervisor.
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        supervisor_pipe.close()
+
+        self.__worker_index = index
+        self.__workers = {}
+        self.__workers_stats = {}
+        self.__dispatch_pool = None
+
+        # Parent's loop must not be used in forked process.
+        loop = self.__eventloop.recreate_loop()
+        self.__start_server(loop)
+        loop.add_signal_handler(signal.SIGTERM, self.drain)
+        self.__report_statistics(worker_pipe)
+
+        try:
+            loop.run_forever()
+        except RuntimeError as e:
+            self.log(0, "{RED}ERROR:{RESET} RuntimeError appeared in worker {index}: {error}", {"index": index, "error": e})
+
+        if self.__stats_handle:
+            self.__stats_handle.cancel()
+        loop.remove_signal_handler(signal.SIGTERM)
+        self.__stop_server(loop)
+        self.on_shutdown()
+        self.__eventloop.on_shutdown()
@@ -170,6 +170,11 @@ class Logger(Library):
         # Hack: start time should be available everywhere.
         config.set_temp_value("main/application_start_timestamp", self.__vars["startdate"])
 
+        # Apply debug level from re-read configuration, unless it is
+        # forced by environment.
+        if not "DEBUG" in config.get_temp_value("env"):
+            config.subscribe(self.__on_configuration_changed, "logger")
+
     def log(self, level, data, replace_data = {}):
         """
         Do logprinting. By default, it will print to console. But this
@@ -448,3 +453,12 @@ class Logger(Library):
             self.log(0, "{RED}INTERNAL ERROR:{RESET} unsupported data type passed to Logger.__dump_list(): {datatype}", {"datatype": type(received_data)})
 
         return ", ".join(data)
+
+    def __on_configuration_changed(self, changes):
+        """
+        Applies changed debug level.
+        """
+        if ("logger", "debug_level") in changes:
+            level = changes[("logger", "debug_level")][1]
+            self.log(0, "Setting log level to {log_level} (from config)", {"log_level": level})
+            self.set_debug_level(int(level or 0))
@@ -0,0 +1,507 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+import collections
+import struct
+
+class Protocol(asyncio.BufferedProtocol):
+    """
+    This is a base class for all protocols in lib.protocols, which are
+    served by lib.common_libs.listener.Listener.
+
+    It registers every connection in Listener (which might reject it
+    if connections limit is reached), applies per-connection buffer
+    limits and implements flow control.
+
+    Data is read from socket directly into preallocated read buffer
+    (bytearray), without creating intermediate bytes objects. Buffer
+    starts with INITIAL_BUFFER_SIZE bytes and grows (by doubling) up
+    to read buffer limit, if unconsumed data does not fit in it or if
+    read filled it completely (more data is probably waiting in
+    socket, and transport reads no more than buffer can take). After
+    every read handle_data() is called with buffer and boundaries of
+    unconsumed data, and should return number of consumed bytes.
+    Protocols which are processing data asynchronously might return 0
+    and call consume() later. If unconsumed data fills buffer of
+    maximum size - connection will be closed.
+
+    If transport's write buffer is above write buffer limit (client
+    isn't reading our responses) - reading from socket will be paused
+    until write buffer will be drained.
+
+    Protocol should use write() for sending data and might await
+    drain() to wait until write buffer is drained.
+
+    Usually protocols should be subclassed from one of framing
+    protocols below (LineProtocol, LengthPrefixedProtocol or
+    FixedSizeProtocol) and implement frame_received() only.
+
+    Request-response protocols might implement process_request()
+    instead, which receives every frame as request and returns response.
+    Depending on Listener's dispatch mode it is executed right on event
+    loop, or in Listener's thread or process pool. Requests are
+    pipelined: next requests are dispatched without waiting for
+    previous responses, but responses are written in requests order.
+    If connection have too many requests in flight (pipeline depth), or
+    Listener's dispatch queue is full - connection is backlogged: framing
+    protocols stop taking frames from buffer and reading from socket is
+    paused until some responses will be written.
+
+    When Listener is draining, close_when_idle() is called for every
+    connection: it is closed as soon as all requests in flight are
+    answered and there is no unprocessed data in read buffer.
+    """
+
+    # Initial read buffer size, in bytes.
+    INITIAL_BUFFER_SIZE = 4096
+
+    def __init__(self):
+        # Set by Listener's protocol factory.
+        self.listener = None
+        self.log = None
+
+        self.loop = None
+        self.transport = None
+        # Loop time of last received data. Used for closing idle
+        # connections.
+        self.last_activity = 0
+
+        self.__read_limit = 65536
+        self.__buffer = bytearray(self.INITIAL_BUFFER_SIZE)
+        self.__view = memoryview(self.__buffer)
+        # Unconsumed data boundaries in buffer.
+        self.__start = 0
+        self.__end = 0
+        # Last read filled buffer up to its end.
+        self.__filled = False
+
+        self.__reading_paused = False
+        self.__writing_paused = False
+        # Futures waiting for write buffer to be drained.
+        self.__drain_waiters = []
+
+        self.__dispatch_mode = "inline"
+        self.__pipeline_depth = 0
+        # Futures of dispatched requests, in requests order.
+        self.__pending = collections.deque()
+        # Close connection when it will have nothing to do.
+        self.__close_when_idle = False
+
+    def buffer_updated(self, nbytes):
+        """
+        Executes when data was received into buffer.
+        """
+        self.last_activity = self.loop.time()
+        self.__end += nbytes
+        self.__filled = self.__end == len(self.__buffer)
+        self.consume(self.handle_data(self.__buffer, self.__start, self.__end))
+
+        # Buffer of maximum size is full and nothing can be consumed
+        # from it.
+        if self.__end == len(self.__buffer) and self.__start == 0 and len(self.__buffer) >= self.__read_limit and not self.is_backlogged():
+            if self.log:
+                self.log(0, "{RED}ERROR:{RESET} read buffer limit ({limit} bytes) exceeded, closing connection", {"limit": self.__read_limit})
+            self.transport.close()
+            return
+
+        self.__close_if_idle()
+
+    def close_when_idle(self):
+        """
+        Closes connection as soon as it will have no requests in flight
+        and no unprocessed data. Used by Listener while draining.
+        """
+        self.__close_when_idle = True
+        self.__close_if_idle()
+
+    def connection_lost(self, exc):
+        """
+        Executes when connection is closed.
+        """
+        if self.listener:
+            self.listener.unregister_connection(self)
+
+        for waiter in self.__drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError("Connection lost"))
+        self.__drain_waiters = []
+
+        # Responses can't be written anymore.
+        for future in self.__pending:
+            future.cancel()
+        self.__pending.clear()
+
+    def connection_made(self, transport):
+        """
+        Executes when connection is established.
+        """
+        self.transport = transport
+        self.loop = asyncio.get_event_loop()
+        self.last_activity = self.loop.time()
+
+        if not self.listener:
+            return
+
+        if not self.listener.register_connection(self):
+            transport.abort()
+            return
+
+        limits = self.listener.get_limits()
+        if limits["read_buffer_limit"]:
+            self.__read_limit = limits["read_buffer_limit"]
+        if limits["write_buffer_limit"]:
+            transport.set_write_buffer_limits(high = limits["write_buffer_limit"])
+
+        self.__dispatch_mode = limits["dispatch"]
+        self.__pipeline_depth = limits["pipeline_depth"]
+
+    def consume(self, count):
+        """
+        Marks 'count' bytes from beginning of unconsumed data as
+        consumed.
+        """
+        if count:
+            self.__start += count
+            if self.__start >= self.__end:
+                # Everything is consumed, next read will start from
+                # buffer beginning.
+                self.__start = 0
+                self.__end = 0
+
+    async def drain(self):
+        """
+        Waits until transport's write buffer will be drained below
+        limit.
+        """
+        if not self.__writing_paused:
+            return
+
+        waiter = self.loop.create_future()
+        self.__drain_waiters.append(waiter)
+        await waiter
+
+    def get_buffer(self, sizehint):
+        """
+        Returns free part of read buffer for transport to read data in.
+        """
+        if self.__end == len(self.__buffer) or (self.__filled and len(self.__buffer) < self.__read_limit):
+            self.__make_room()
+
+        return self.__view[self.__end:]
+
+    def handle_data(self, buffer, start, end):
+        """
+        Handles data from read buffer. Should be overrided by protocol.
+
+        @param buffer Read buffer (bytearray). Should not be modified
+        here.
+        @param start Unconsumed data start offset.
+        @param end Unconsumed data end offset.
+        @retval consumed Number of bytes consumed from unconsumed data
+        beginning.
+        """
+        return end - start
+
+    def handle_error(self, error):
+        """
+        Executes when process_request() failed. By default logs error
+        and closes connection, as responses order is broken.
+        """
+        if self.log:
+            self.log(0, "{RED}ERROR:{RESET} request processing failed: {error}", {"error": repr(error)})
+        self.transport.close()
+
+    def is_backlogged(self):
+        """
+        Returns True if connection have too many requests in flight, so
+        no more requests should be taken.
+        """
+        if not self.__pending:
+            # Connection is woken up only by its own responses, so it
+            # is backlogged by full dispatch queue only if it have
+            # requests in flight.
+            return False
+
+        return len(self.__pending) >= self.__pipeline_depth or self.listener.is_dispatch_queue_full()
+
+    def pause_writing(self):
+        """
+        Executes by transport when write buffer is above high limit.
+        """
+        self.__writing_paused = True
+        self.__update_reading()
+
+    @staticmethod
+    def process_request(request):
+        """
+        Processes request and returns response. Should be overrided by
+        request-response protocols.
+
+        It must be a static method, which does not use protocol or
+        application state, as it might be executed in other thread or
+        process.
+
+        @param request Request data (bytes-like object).
+        @retval response Response data (bytes-like object) or None, if
+        there is nothing to respond.
+        """
+        return None
+
+    def request_received(self, request):
+        """
+        Dispatches request to process_request() according to Listener's
+        dispatch mode.
+
+        @param request Request data (bytes-like object). It might be
+        memoryview which is valid only while this method is running.
+        """
+        if self.__dispatch_mode == "inline":
+            try:
+                response = self.process_request(request)
+            except Exception as e:
+                self.handle_error(e)
+                return
+
+            if response is not None:
+                self.write_response(response)
+            return
+
+        future = self.listener.dispatch(self.process_request, bytes(request))
+        self.__pending.append(future)
+        future.add_done_callback(self.__write_responses)
+        self.__update_reading()
+
+    def resume_writing(self):
+        """
+        Executes by transport when write buffer is drained below low
+        limit.
+        """
+        self.__writing_paused = False
+
+        for waiter in self.__drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.__drain_waiters = []
+
+        self.__update_reading()
+
+    def write(self, data):
+        """
+        Writes data (bytes-like object) to transport.
+        """
+        self.transport.write(data)
+
+    def write_response(self, response):
+        """
+        Writes response to transport. Framing protocols are overriding
+        this to add framing.
+        """
+        self.transport.write(response)
+
+    def __close_if_idle(self):
+        """
+        Closes connection if close_when_idle() was called and connection
+        have nothing to do. Transport will write buffered responses
+        before closing.
+        """
+        if not self.__close_when_idle or self.__pending or self.__end > self.__start:
+            return
+
+        if self.transport and not self.transport.is_closing():
+            self.transport.close()
+
+    def __make_room(self):
+        """
+        Makes room in read buffer: grows buffer if there is nothing to
+        move or if last read filled it, otherwise moves unconsumed data
+        to buffer beginning.
+        """
+        length = self.__end - self.__start
+        if len(self.__buffer) < self.__read_limit and (self.__filled or not self.__start):
+            buffer = bytearray(min(len(self.__buffer) * 2, self.__read_limit))
+            buffer[:length] = self.__view[self.__start:self.__end]
+            self.__view.release()
+            self.__buffer = buffer
+            self.__view = memoryview(self.__buffer)
+        elif self.__start:
+            # Only incomplete data is moved here, usually it is small.
+            self.__buffer[:length] = self.__view[self.__start:self.__end].tobytes()
+
+        self.__start = 0
+        self.__end = length
+        self.__filled = False
+
+    def __update_reading(self):
+        """
+        Pauses or resumes reading from socket depending on write buffer
+        and dispatched requests state.
+        """
+        if not self.transport or self.transport.is_closing():
+            return
+
+        must_pause = self.__writing_paused or self.is_backlogged()
+
+        if must_pause and not self.__reading_paused:
+            self.__reading_paused = True
+            self.transport.pause_reading()
+        elif not must_pause and self.__reading_paused:
+            self.__reading_paused = False
+            self.transport.resume_reading()
+
+    def __write_responses(self, future):
+        """
+        Writes responses for finished requests, in requests order.
+        """
+        while self.__pending and self.__pending[0].done():
+            future = self.__pending.popleft()
+            if future.cancelled():
+                continue
+
+            error = future.exception()
+            if error:
+                self.handle_error(error)
+                continue
+
+            response = future.result()
+            if response is not None and not self.transport.is_closing():
+                self.write_response(response)
+
+        # Take requests which were left in buffer while connection was
+        # backlogged.
+        if self.__end > self.__start and not self.is_backlogged() and not self.transport.is_closing():
+            self.consume(self.handle_data(self.__buffer, self.__start, self.__end))
+
+        self.__update_reading()
+        self.__close_if_idle()
+
+class LineProtocol(Protocol):
+    """
+    Protocol with frames separated by delimiter (newline by default).
+    Delimiter is not included in frames.
+    """
+
+    delimiter = b"\n"
+
+    def frame_received(self, frame):
+        """
+        Executes for every received frame. Passes frame to
+        request_received() by default.
+
+        @param frame memoryview of frame data. It is valid only while
+        this method is running, use bytes(frame) to keep data.
+        """
+        self.request_received(frame)
+
+    def handle_data(self, buffer, start, end):
+        """
+        Splits unconsumed data into frames.
+        """
+        position = start
+        delimiter_length = len(self.delimiter)
+        with memoryview(buffer) as view:
+            while not self.is_backlogged():
+                index = buffer.find(self.delimiter, position, end)
+                if index < 0:
+                    break
+                self.frame_received(view[position:index])
+                position = index + delimiter_length
+
+        return position - start
+
+    def write_response(self, response):
+        """
+        Writes response to transport with delimiter.
+        """
+        self.transport.writelines((response, self.delimiter))
+
+class LengthPrefixedProtocol(Protocol):
+    """
+    Protocol with frames prefixed by their length. Length header format
+    is defined as struct format (4 bytes unsigned big-endian integer by
+    default). Header is not included in frames.
+    """
+
+    length_format = "!I"
+
+    def frame_received(self, frame):
+        """
+        Executes for every received frame. Passes frame to
+        request_received() by default.
+
+        @param frame memoryview of frame data. It is valid only while
+        this method is running, use bytes(frame) to keep data.
+        """
+        self.request_received(frame)
+
+    def handle_data(self, buffer, start, end):
+        """
+        Splits unconsumed data into frames.
+        """
+        position = start
+        header_length = struct.calcsize(self.length_format)
+        with memoryview(buffer) as view:
+            while end - position >= header_length and not self.is_backlogged():
+                frame_length = struct.unpack_from(self.length_format, buffer, position)[0]
+                frame_end = position + header_length + frame_length
+                if frame_end > end:
+                    break
+                self.frame_received(view[position + header_length:frame_end])
+                position = frame_end
+
+        return position - start
+
+    def write_frame(self, data):
+        """
+        Writes data to transport with length header.
+        """
+        self.transport.writelines((struct.pack(self.length_format, len(data)), data))
+
+    def write_response(self, response):
+        """
+        Writes response to transport with length header.
+        """
+        self.write_frame(response)
+
+class FixedSizeProtocol(Protocol):
+    """
+    Protocol with frames of fixed size.
+    """
+
+    frame_size = 1
+
+    def frame_received(self, frame):
+        """
+        Executes for every received frame. Passes frame to
+        request_received() by default.
+
+        @param frame memoryview of frame data. It is valid only while
+        this method is running, use bytes(frame) to keep data.
+        """
+        self.request_received(frame)
+
+    def handle_data(self, buffer, start, end):
+        """
+        Splits unconsumed data into frames.
+        """
+        position = start
+        with memoryview(buffer) as view:
+            while end - position >= self.frame_size and not self.is_backlogged():
+                self.frame_received(view[position:position + self.frame_size])
+                position += self.frame_size
+
+        return position - start
@@ -16,15 +16,96 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import asyncio
+import concurrent.futures
+import json
+import math
+import os
+import random
+import time
 
 from lib.common_libs.library import Library
+from lib.common_libs.timer_types.wheel import Wheel
 
 class Timer(Library):
     """
     This library responsible for executing tasks with timeout. It allows other
     libraries to add, modify and delete timers based on their own logic.
+
+    All timers are kept in hierarchical timing wheel
+    (lib.common_libs.timer_types.wheel.Wheel), which is driven by one
+    periodic call on shared event loop (see
+    lib.common_libs.eventloop.Eventloop). Loop is woken up only on ticks
+    when some timer expires (or far timers are moved closer in wheel),
+    so idle wheel with timers hours away does not tick every
+    resolution. Tick duration is taken from "timer/resolution"
+    configuration value (in seconds, 0.1 by default). Timers are fired
+    on first tick at or after their time, so every run might be up to
+    one tick late.
+
+    Repeatable timers are executed with fixed rate: every run is
+    anchored on previous run's scheduled time (not on time when
+    callback finished), so period does not drift. If timer was fired
+    later than one period after its scheduled time, some runs were
+    missed, and timer's "missed" policy decides what to do:
+
+        * "skip" - late run is dropped, timer continues from next
+          anchor in future.
+        * "catch_up" - every missed run is executed, one per tick,
+          until timer catches up.
+        * "coalesce" - all missed runs are coalesced into one run,
+          timer continues from next anchor in future. This is default.
+
+    Every run might also be delayed by random jitter, so timers with
+    same timeout will not fire in lockstep. Jitter does not shift
+    anchors. As runs are fired on ticks, jitter below resolution would
+    not spread them, so such jitter is raised to resolution (with
+    warning).
+
+    Every timer have own execution mode:
+
+        * "inline" - callback is executed right on event loop. This is
+          default, and callback should not block.
+        * "thread" - callback is executed in thread pool.
+        * "process" - callback is executed in process pool. Callback
+          must be picklable, e.g. module-level function.
+        * "coroutine" - callback is a coroutine function, it will be
+          scheduled as task on event loop.
+
+    Runs which are not inline may overlap with each other. Set
+    "overlap" to False to prevent this, or "max_concurrency" to limit
+    number of simultaneous runs. Runs above limit are skipped. Pools
+    sizes are taken from "timer/thread_workers" and
+    "timer/process_workers" configuration values.
+
+    Every timer collects statistics about its runs, see
+    get_statistics().
+
+    Timers added with "persistent" flag are surviving restarts: their
+    next fire times (wall clock) are stored in schedule file
+    ("timer/schedule_file" configuration value, "timers.json" in
+    application's configuration directory by default). When same timer
+    is added after restart - it will continue its schedule. Timers
+    which became overdue while application was down are fired once,
+    spread randomly over "timer/startup_spread" seconds (10 by default),
+    so startup will not cause a storm. Schedule file is written every
+    "timer/schedule_save_interval" seconds (60 by default) if something
+    was changed, and on shutdown. Schedules of timers which weren't
+    added again until schedule is written first time are dropped, as
+    well as schedule of timer removed with remove_timer(name, forget =
+    True).
+
+    When event loop is re-created in forked process (e.g. prefork
+    listener worker), timers are left to parent process: worker drops
+    all timers except ones added with "inherit" flag, which are moved
+    to new loop and fired in every worker. Worker never writes schedule
+    file, it belongs to parent.
     """
 
+    # Execution modes for timer callbacks.
+    EXECUTION_MODES = ("inline", "thread", "process", "coroutine")
+    # Policies for missed runs of repeatable timers.
+    MISSED_POLICIES = ("skip", "catch_up", "coalesce")
+
     _info = {
         "name"          : "Timer library",
         "shortname"     : "timer",
@@ -35,29 +116,179 @@ class Timer(Library):
         Library.__init__(self)
 
         self.__tasks = {}
+        self.__wheel = Wheel()
+        # Handle for next wheel tick, if there are timers in wheel.
+        self.__tick_handle = None
+        # Tick duration, in seconds.
+        self.__resolution = 0.1
+        # Executors for "thread" and "process" modes. Created on first
+        # use.
+        self.__pools = {
+            "thread"            : None,
+            "process"           : None
+        }
+        self.__pools_workers = {
+            "thread"            : None,
+            "process"           : None
+        }
 
-        self.timer_loop = asyncio.get_event_loop()
+        # Persistent schedule, name => wall clock time of next run.
+        self.__schedule_data = {}
+        # Names of timers from loaded schedule which weren't added
+        # again yet. Their schedules are dropped on first save.
+        self.__schedule_stale = set()
+        self.__schedule_file = None
+        self.__schedule_changed = False
+        self.__schedule_save_interval = 60
+        self.__startup_spread = 10
 
-    def add_timer(self, name, description, callback, timeout, repeatable):
+        # Shared event loop, obtained on library initialization.
+        self.timer_loop = None
+        # Loop time of tick 0.
+        self.__start_time = 0
+
+    def add_timer(self, name, description, callback, timeout, repeatable, missed = "coalesce", jitter = 0, mode = "inline", overlap = True, max_concurrency = None, persistent = False, inherit = False):
         """
         Adds delayed calls to timer loop.
+
+        @param missed Policy for missed runs of repeatable timer, one of
+        MISSED_POLICIES.
+        @param jitter Maximum random delay (in seconds) added to every run.
+        Should not be less than timer resolution.
+        @param mode Callback execution mode, one of EXECUTION_MODES.
+        @param overlap Allow runs to overlap.
+        @param max_concurrency Maximum number of simultaneous runs.
+        @param persistent Keep timer's schedule across restarts.
+        @param inherit Keep timer in forked processes, which re-created
+        event loop.
         """
         if not name in self.__tasks:
-            self.log(1, "Adding timer: {name} | {description} | {class}.{callback} | {timeout}", {"name": name, "description": description, "class": callback.__self__.__class__.__name__, "callback": callback.__name__, "timeout": timeout})
+            if not missed in self.MISSED_POLICIES:
+                self.log(0, "{RED}ERROR:{RESET} unknown missed runs policy '{YELLOW}{missed}{RESET}' for timer '{BLUE}{name}{RESET}', using 'coalesce'", {"missed": missed, "name": name})
+                missed = "coalesce"
+
+            if not mode in self.EXECUTION_MODES:
+                self.log(0, "{RED}ERROR:{RESET} unknown execution mode '{YELLOW}{mode}{RESET}' for timer '{BLUE}{name}{RESET}', using 'inline'", {"mode": mode, "name": name})
+                mode = "inline"
+
+            if 0 < jitter < self.__resolution:
+                self.log(0, "{YELLOW}Warning{RESET}: jitter {jitter}s of timer '{BLUE}{name}{RESET}' is below timer resolution, using {resolution}s", {"jitter": jitter, "name": name, "resolution": self.__resolution})
+                jitter = self.__resolution
+
+            if not overlap:
+                max_concurrency = 1
+
+            # Callback might be a plain function (required for "process"
+            # mode).
+            if hasattr(callback, "__self__"):
+                owner = callback.__self__.__class__.__name__
+            else:
+                owner = callback.__module__
+
+            self.log(1, "Adding timer: {name} | {description} | {class}.{callback} | {timeout} | {missed} | {jitter} | {mode}", {"name": name, "description": description, "class": owner, "callback": callback.__name__, "timeout": timeout, "missed": missed, "jitter": jitter, "mode": mode})
             # ToDo: add check for timeout, it should not be more than 24 hours.
-            task = self.timer_loop.call_later(timeout, self.timer_exec, {"callback": callback, "name": name})
+            now = self.timer_loop.time()
+            scheduled = now + timeout
+            if persistent:
+                self.__schedule_stale.discard(name)
+            if persistent and name in self.__schedule_data:
+                delay = self.__schedule_data[name] - time.time()
+                if delay < 0:
+                    self.log(1, "Timer '{BLUE}{name}{RESET}' is overdue for {delay:.1f}s", {"name": name, "delay": -delay})
+                    scheduled = now + random.uniform(0, min(timeout, self.__startup_spread))
+                else:
+                    self.log(1, "Resuming timer '{BLUE}{name}{RESET}' schedule, next run in {delay:.1f}s", {"name": name, "delay": delay})
+                    scheduled = now + min(delay, timeout)
+
             self.__tasks[name] = {
                 "name"              : name,
                 "description"       : description,
                 "callback"          : callback,
                 "timeout"           : timeout,
                 "repeatable"        : repeatable,
-                "handle"            : task
+                "missed"            : missed,
+                "jitter"            : jitter,
+                "mode"              : mode,
+                "max_concurrency"   : max_concurrency,
+                "persistent"        : persistent,
+                "inherit"           : inherit,
+                # Loop time this run is anchored on.
+                "scheduled"         : scheduled,
+                # Loop time this run should be fired on (with jitter).
+                "fire_at"           : None,
+                "stats"             : {
+                    "runs"          : 0,
+                    "running"       : 0,
+                    "skipped"       : 0,
+                    "failed"        : 0,
+                    # Durations and lateness are in seconds.
+                    "duration_last" : 0,
+                    "duration_max"  : 0,
+                    "duration_total": 0,
+                    "lateness_last" : 0,
+                    "lateness_max"  : 0,
+                    "lateness_total": 0
+                }
             }
+            self.__schedule(self.__tasks[name])
+
+            if persistent and not "timer/save_schedule" in self.__tasks:
+                self.add_timer("timer/save_schedule", "Save persistent timers schedule", self.__save_schedule, self.__schedule_save_interval, True)
         else:
             self.log(1, "Task '{BLUE}{name}{RESET}' already exists, will not add it until it will be removed.", {"name": name})
 
-    def timer_exec(self, args):
+    def get_statistics(self, name = None):
+        """
+        Returns statistics for timer 'name', or dictionary with
+        statistics for every timer if name wasn't passed.
+
+        Statistics contains number of runs (finished, running, skipped
+        and failed ones), and last, maximum and total run duration and
+        lateness. Duration of pooled runs includes time spent in pool's
+        queue.
+        """
+        if name:
+            if name in self.__tasks:
+                return dict(self.__tasks[name]["stats"])
+            return None
+
+        return {task_name: dict(self.__tasks[task_name]["stats"]) for task_name in self.__tasks}
+
+    def init_library(self):
+        """
+        Library initialization.
+        """
+        eventloop = self.loader.request_library("common_libs", "eventloop")
+        eventloop.add_loop_callback(self.__on_loop_recreated)
+        self.timer_loop = eventloop.get_loop()
+        self.__start_time = self.timer_loop.time()
+
+        positive = lambda value: value > 0
+        self.config.register_schema("timer", {
+            "resolution"                : {"type": float, "default": 0.1, "validator": positive},
+            "thread_workers"            : {"type": int, "validator": positive},
+            "process_workers"           : {"type": int, "validator": positive},
+            "schedule_save_interval"    : {"type": float, "default": 60, "validator": positive},
+            "startup_spread"            : {"type": float, "default": 10, "validator": lambda value: value >= 0},
+            "schedule_file"             : {"type": str}
+        })
+
+        self.__resolution = self.config.get_value("all", "timer", "resolution")
+        for pool_type in self.__pools_workers:
+            self.__pools_workers[pool_type] = self.config.get_value("all", "timer", "{0}_workers".format(pool_type))
+        self.__schedule_save_interval = self.config.get_value("all", "timer", "schedule_save_interval")
+        self.__startup_spread = self.config.get_value("all", "timer", "startup_spread")
+
+        self.__schedule_file = self.config.get_value("all", "timer", "schedule_file")
+        if not self.__schedule_file:
+            app_name = self.config.get_temp_value("main/application_name") or "Regius"
+            self.__schedule_file = os.path.expanduser(os.path.join("~/", ".config/", "regius", app_name, "timers.json"))
+
+        self.__load_schedule()
+
+        self.log(0, "Initializing timer with {resolution}s resolution...", {"resolution": self.__resolution})
+
+    def timer_exec(self, name):
         """
         This function is kinda a "decorator" around callback passed for
         self.add_timer().
@@ -65,33 +296,310 @@ class Timer(Library):
         All timered calls will be wrapped with this function. As we have
         callback defined in self.__tasks[task_name], it will be executed.
         After execution we will look into self.__tasks[task_name]["repeatable"]
-        variable, and if it is set to True - we will re-add timer action
-        for re-execution. Otherwise we will just remove this task.
-        """
-        self.log(1, "Timer action! Callback: {0}".format(args["callback"]))
-        args["callback"]()
-        if args["name"] in self.__tasks:
-            if self.__tasks[args["name"]]["repeatable"]:
-                data = self.__tasks[args["name"]]
-                self.remove_timer(data["name"])
-                self.add_timer(data["name"], data["description"], data["callback"], data["timeout"], data["repeatable"])
-            else:
-                self.remove_timer(data["name"])
+        variable, and if it is set to True - we will re-schedule same
+        task in wheel, anchored on this run's scheduled time. Otherwise
+        we will just remove this task.
+
+        Callback is executed according to task's execution mode, so it
+        might be still running when this method returns.
+
+        This method is called for every fired timer, so it should not
+        log anything.
+        """
+        # Task might be removed by other task's callback on same tick.
+        task = self.__tasks.get(name)
+        if not task:
+            return
+
+        now = self.timer_loop.time()
+        # How many whole periods were missed after this run's fire time.
+        missed = 0
+        if task["repeatable"] and task["timeout"] > 0:
+            missed = int((now - task["fire_at"]) / task["timeout"])
+
+        stats = task["stats"]
+        if missed and task["missed"] == "skip":
+            stats["skipped"] += 1
+        elif task["max_concurrency"] and stats["running"] >= task["max_concurrency"]:
+            stats["skipped"] += 1
+        else:
+            lateness = now - task["fire_at"]
+            stats["lateness_last"] = lateness
+            stats["lateness_total"] += lateness
+            if lateness > stats["lateness_max"]:
+                stats["lateness_max"] = lateness
+
+            self.__run(task)
+
+        # Callback might remove or re-add timer by itself.
+        if self.__tasks.get(name) is not task:
+            return
+
+        if not task["repeatable"]:
+            del self.__tasks[name]
+            if task["persistent"]:
+                self.__schedule_data.pop(name, None)
+                self.__schedule_changed = True
+            return
+
+        if task["missed"] == "catch_up" or task["timeout"] <= 0:
+            task["scheduled"] += task["timeout"]
+        else:
+            # Jump to first anchor in future.
+            periods = int((now - task["scheduled"]) / task["timeout"]) + 1
+            task["scheduled"] += max(periods, 1) * task["timeout"]
+
+        self.__schedule(task)
 
     def on_shutdown(self):
         """
         Executes some timer-specific actions on shutdown.
         """
-        self.log(1, "Closing timer event loop...")
-        self.timer_loop.close()
+        if self.__tick_handle:
+            self.__tick_handle.cancel()
+            self.__tick_handle = None
+
+        for pool_type in self.__pools:
+            if self.__pools[pool_type]:
+                self.log(1, "Shutting down timer {pool_type} pool...", {"pool_type": pool_type})
+                self.__pools[pool_type].shutdown(wait = False)
+                self.__pools[pool_type] = None
 
-    def remove_timer(self, name):
+        self.__save_schedule()
+
+    def remove_timer(self, name, forget = False):
         """
         Removes timer from timers list.
+
+        @param forget Also drop persisted schedule of timer, even if it
+        isn't added in this run (e.g. timer which is not used anymore).
         """
+        if forget and name in self.__schedule_data:
+            self.log(1, "Forgetting schedule of timer '{BLUE}{name}{RESET}'", {"name": name})
+            del self.__schedule_data[name]
+            self.__schedule_stale.discard(name)
+            self.__schedule_changed = True
+
         if name in self.__tasks:
             self.log(1, "Removing timer '{BLUE}{name}{RESET}'", {"name": name})
-            self.__tasks[name]["handle"].cancel()
+            self.__wheel.remove(name)
+            if self.__tasks[name]["persistent"]:
+                self.__schedule_data.pop(name, None)
+                self.__schedule_changed = True
             del self.__tasks[name]
-        else:
+        elif not forget:
             self.log(1, "Task '{BLUE}{name}{RESET}' not found", {"name": name})
+
+    def __load_schedule(self):
+        """
+        Loads persistent timers schedule from file.
+        """
+        if not os.path.exists(self.__schedule_file):
+            return
+
+        self.log(1, "Loading timers schedule from '{CYAN}{path}{RESET}'...", {"path": self.__schedule_file})
+        try:
+            with open(self.__schedule_file, "r") as schedule_file:
+                self.__schedule_data = json.loads(schedule_file.read())
+        except (OSError, ValueError) as e:
+            self.log(0, "{YELLOW}Warning{RESET}: timers schedule file is unusable: {error}", {"error": repr(e)})
+            self.__schedule_data = {}
+
+        self.__schedule_stale = set(self.__schedule_data)
+
+    def __on_loop_recreated(self, loop):
+        """
+        Moves inherited timers to new event loop in forked process,
+        other timers are dropped. Tasks scheduled times are shifted by
+        difference between loops clocks. Pools and schedule file are
+        dropped, as they belong to parent process.
+        """
+        offset = loop.time() - self.timer_loop.time()
+        self.timer_loop = loop
+        self.__start_time += offset
+        for name in list(self.__tasks):
+            task = self.__tasks[name]
+            if not task["inherit"]:
+                self.__wheel.remove(name)
+                del self.__tasks[name]
+                continue
+
+            task["scheduled"] += offset
+            task["fire_at"] += offset
+
+        self.log(1, "Timers left in forked process: {count}", {"count": len(self.__tasks)})
+
+        for pool_type in self.__pools:
+            self.__pools[pool_type] = None
+
+        self.__schedule_file = None
+
+        if self.__tick_handle:
+            self.__tick_handle.cancel()
+            self.__tick_handle = None
+            if len(self.__wheel):
+                self.__schedule_tick()
+
+    def __run(self, task):
+        """
+        Executes task's callback according to its execution mode.
+        """
+        task["stats"]["running"] += 1
+        started = self.timer_loop.time()
+
+        if task["mode"] == "inline":
+            try:
+                task["callback"]()
+            except Exception as e:
+                task["stats"]["running"] -= 1
+                task["stats"]["failed"] += 1
+                self.log(0, "{RED}ERROR:{RESET} timer '{BLUE}{name}{RESET}' callback failed: {error}", {"name": task["name"], "error": repr(e)})
+                return
+
+            self.__finish_run(task, started)
+            return
+
+        try:
+            if task["mode"] == "coroutine":
+                future = asyncio.ensure_future(task["callback"](), loop = self.timer_loop)
+            else:
+                future = self.timer_loop.run_in_executor(self.__get_pool(task["mode"]), task["callback"])
+        except Exception as e:
+            task["stats"]["running"] -= 1
+            task["stats"]["failed"] += 1
+            self.log(0, "{RED}ERROR:{RESET} failed to start timer '{BLUE}{name}{RESET}' callback: {error}", {"name": task["name"], "error": repr(e)})
+            return
+
+        future.add_done_callback(lambda future: self.__finish_run(task, started, future))
+
+    def __save_schedule(self):
+        """
+        Writes persistent timers schedule to file, if it was changed.
+        Data is written to temporary file which then replaces schedule
+        file, so it will never be left half-written.
+
+        Schedules of timers which weren't added again since they were
+        loaded are dropped on first save.
+        """
+        if self.__schedule_stale:
+            self.log(1, "Dropping schedules of timers which weren't added: {names}", {"names": ", ".join(sorted(self.__schedule_stale))})
+            for name in self.__schedule_stale:
+                self.__schedule_data.pop(name, None)
+            self.__schedule_stale = set()
+            self.__schedule_changed = True
+
+        if not self.__schedule_changed or not self.__schedule_file:
+            return
+
+        self.log(2, "Saving timers schedule...")
+        schedule_dir = os.path.dirname(self.__schedule_file)
+        temp_path = self.__schedule_file + ".tmp"
+        try:
+            if schedule_dir and not os.path.exists(schedule_dir):
+                os.makedirs(schedule_dir)
+
+            with open(temp_path, "w") as schedule_file:
+                schedule_file.write(json.dumps(self.__schedule_data))
+                schedule_file.flush()
+                os.fsync(schedule_file.fileno())
+            os.replace(temp_path, self.__schedule_file)
+        except OSError as e:
+            self.log(0, "{RED}ERROR:{RESET} failed to save timers schedule: {error}", {"error": repr(e)})
+            return
+
+        self.__schedule_changed = False
+
+    def __schedule(self, task):
+        """
+        Places task into wheel so it will be fired on its scheduled time
+        (plus jitter), and moves next wheel tick if task expires before
+        it.
+        """
+        if not self.__tick_handle:
+            # Wheel was stopped, so bring it to current time first.
+            self.__wheel.advance(self.__get_tick(self.timer_loop.time()))
+
+        task["fire_at"] = task["scheduled"]
+        if task["jitter"]:
+            task["fire_at"] += random.uniform(0, task["jitter"])
+
+        tick = math.ceil((task["fire_at"] - self.__start_time) / self.__resolution)
+        self.__wheel.add(task["name"], tick)
+
+        if task["persistent"]:
+            self.__schedule_data[task["name"]] = time.time() + task["scheduled"] - self.timer_loop.time()
+            self.__schedule_changed = True
+
+        if not self.__tick_handle:
+            self.__schedule_tick()
+        elif self.__start_time + tick * self.__resolution < self.__tick_handle.when():
+            self.__tick_handle.cancel()
+            self.__schedule_tick()
+
+    def __finish_run(self, task, started, future = None):
+        """
+        Updates task statistics after run is finished.
+        """
+        stats = task["stats"]
+        stats["running"] -= 1
+
+        if future:
+            if future.cancelled():
+                stats["failed"] += 1
+                return
+
+            error = future.exception()
+            if error:
+                stats["failed"] += 1
+                self.log(0, "{RED}ERROR:{RESET} timer '{BLUE}{name}{RESET}' callback failed: {error}", {"name": task["name"], "error": repr(error)})
+                return
+
+        duration = self.timer_loop.time() - started
+        stats["runs"] += 1
+        stats["duration_last"] = duration
+        stats["duration_total"] += duration
+        if duration > stats["duration_max"]:
+            stats["duration_max"] = duration
+
+    def __get_pool(self, pool_type):
+        """
+        Returns executor for "thread" or "process" mode, creating it
+        if it wasn't created yet.
+        """
+        if not self.__pools[pool_type]:
+            self.log(1, "Creating timer {pool_type} pool...", {"pool_type": pool_type})
+            if pool_type == "thread":
+                self.__pools[pool_type] = concurrent.futures.ThreadPoolExecutor(self.__pools_workers[pool_type])
+            else:
+                self.__pools[pool_type] = concurrent.futures.ProcessPoolExecutor(self.__pools_workers[pool_type])
+
+        return self.__pools[pool_type]
+
+    def __get_tick(self, loop_time):
+        """
+        Returns number of last passed tick for given loop time.
+        """
+        return int((loop_time - self.__start_time) / self.__resolution)
+
+    def __schedule_tick(self):
+        """
+        Schedules wheel tick on which something will happen in wheel.
+        Ticks are anchored on start time, so they are not drifting.
+        """
+        next_tick = self.__wheel.get_next_tick()
+        self.__tick_handle = self.timer_loop.call_at(self.__start_time + next_tick * self.__resolution, self.__tick, next_tick)
+
+    def __tick(self, tick):
+        """
+        Advances wheel to current time and executes expired tasks.
+
+        @param tick Tick this call was scheduled for. Loop might call it
+        a bit earlier than tick's time, but tick is considered passed.
+        """
+        for name in self.__wheel.advance(max(tick, self.__get_tick(self.timer_loop.time()))):
+            self.timer_exec(name)
+
+        if len(self.__wheel):
+            self.__schedule_tick()
+        else:
+            self.__tick_handle = None
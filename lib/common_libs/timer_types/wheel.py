@@ -0,0 +1,189 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+class Wheel:
+    """
+    Hierarchical timing wheel.
+
+    Time here is measured in ticks, and ticks are counted from zero.
+    Wheel consists of several levels, every level have 2^bits slots.
+    One slot on level N covers 2^(bits * N) ticks, so with default
+    parameters (6 bits, 4 levels) wheel covers 2^24 ticks without
+    re-placing entries.
+
+    Entry is placed on the lowest level which can hold it. When
+    higher level's slot becomes current - all its entries are
+    cascaded to lower levels. This gives O(1) insertion and
+    cancellation, and advancing for one tick touches only one slot
+    per level. Ticks on which nothing expires or cascades are skipped
+    (see get_next_tick()), so wheel might be advanced only when
+    something happens.
+
+    Wheel knows nothing about callbacks - it operates on names only,
+    and advance() returns a list of names which are expired.
+    """
+
+    def __init__(self, bits = 6, levels = 4):
+        self.__bits = bits
+        self.__levels = levels
+        self.__size = 1 << bits
+        self.__mask = self.__size - 1
+
+        # Last processed tick.
+        self.__current = 0
+        # Slots. Every slot is a dictionary of name => expiration tick.
+        self.__slots = [[{} for slot in range(self.__size)] for level in range(self.__levels)]
+        # Mapping of name => slot where entry currently lives. Used
+        # for O(1) cancellation.
+        self.__entries = {}
+
+    def __contains__(self, name):
+        return name in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def add(self, name, expires):
+        """
+        Adds (or re-schedules, if already present) entry which will
+        be expired on tick 'expires'.
+
+        Entries which should be expired in past or on current tick
+        will be expired on next tick.
+
+        @param name Entry name.
+        @param expires Absolute tick number.
+        """
+        if name in self.__entries:
+            del self.__entries[name][name]
+
+        if expires <= self.__current:
+            expires = self.__current + 1
+
+        self.__place(name, expires)
+
+    def advance(self, tick):
+        """
+        Advances wheel up to (and including) passed tick.
+
+        @param tick Absolute tick number.
+        @retval expired List of expired entries names.
+        """
+        expired = []
+
+        while self.__current < tick:
+            # Jump over ticks on which nothing happens.
+            next_tick = self.get_next_tick()
+            if next_tick is None or next_tick > tick:
+                self.__current = tick
+                break
+
+            self.__current = next_tick
+            current = next_tick
+
+            # Cascade higher levels first, so entries will trickle
+            # down thru all levels in one tick if required.
+            for level in range(self.__levels - 1, 0, -1):
+                shift = self.__bits * level
+                if current & ((1 << shift) - 1):
+                    continue
+
+                index = (current >> shift) & self.__mask
+                slot = self.__slots[level][index]
+                if slot:
+                    self.__slots[level][index] = {}
+                    for name, expires in slot.items():
+                        self.__place(name, expires)
+
+            index = current & self.__mask
+            slot = self.__slots[0][index]
+            if slot:
+                self.__slots[0][index] = {}
+                for name in slot:
+                    del self.__entries[name]
+                expired.extend(slot)
+
+        return expired
+
+    def get_current_tick(self):
+        """
+        Returns last processed tick.
+        """
+        return self.__current
+
+    def get_next_tick(self):
+        """
+        Returns nearest tick on which entry will expire or will be
+        cascaded from higher level, or None if wheel is empty. Wheel
+        should be advanced to this tick, nothing happens before it.
+        """
+        if not self.__entries:
+            return None
+
+        nearest = None
+        for level in range(self.__levels):
+            shift = self.__bits * level
+            position = self.__current >> shift
+            # Slots of higher levels are starting later than slots of
+            # lower ones.
+            if nearest is not None and (position + 1) << shift >= nearest:
+                break
+
+            slots = self.__slots[level]
+            for distance in range(1, self.__size):
+                if slots[(position + distance) & self.__mask]:
+                    tick = (position + distance) << shift
+                    if nearest is None or tick < nearest:
+                        nearest = tick
+                    break
+
+        return nearest
+
+    def remove(self, name):
+        """
+        Removes entry from wheel. Does nothing if entry does not
+        exist.
+
+        @param name Entry name.
+        """
+        slot = self.__entries.pop(name, None)
+        if slot is not None:
+            del slot[name]
+
+    def __place(self, name, expires):
+        """
+        Places entry into appropriate slot.
+
+        Level is chosen so that slot's distance from current one on
+        this level is less than wheel size. For levels above zero this
+        distance is never zero, so entry never lands in already
+        cascaded slot.
+        """
+        current = self.__current
+        for level in range(self.__levels):
+            shift = self.__bits * level
+            if (expires >> shift) - (current >> shift) < self.__size:
+                index = (expires >> shift) & self.__mask
+                break
+        else:
+            # Entry is too far in future. Park it in the farthest slot
+            # of top level - it will be re-placed on cascade.
+            index = ((current >> shift) + self.__mask) & self.__mask
+
+        slot = self.__slots[level][index]
+        slot[name] = expires
+        self.__entries[name] = slot
@@ -63,6 +63,9 @@ class Regius:
         else:
             self.__logger.initialize_preliminary_parameters(self.config)
 
+        # Re-read configuration files when they are changed, if enabled.
+        self.config.watch_configuration()
+
         # We are still not initialized.
         self.config.set_temp_value("core/initialized", False)
 
@@ -0,0 +1,108 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Helpers for testing libraries without full application startup: Config
+library with configuration from dictionary and Loader stand-in.
+"""
+
+import importlib
+import json
+import os
+import sys
+import tempfile
+import types
+
+from lib.common_libs import common
+
+common.TEMP_SETTINGS.setdefault("SCRIPT_PATH", tempfile.mkdtemp(prefix = "regius-tests-"))
+common.TEMP_SETTINGS.setdefault("UI", "cli")
+
+from lib.common_libs.config import Config
+
+def get_config(values = None, directory = None, logger = None, **preseed):
+    """
+    Returns initialized Config library with configuration from "values"
+    dictionary ({group: {key: value}}), which is written to config.json
+    in directory (new temporary directory by default). Configuration
+    cache is disabled unless "config_cache" preseed parameter is passed.
+    """
+    directory = directory or tempfile.mkdtemp(prefix = "regius-tests-")
+    if values:
+        with open(os.path.join(directory, "config.json"), "w") as cfg:
+            cfg.write(json.dumps(values))
+
+    preseed.setdefault("ui", "cli")
+    preseed.setdefault("app_name", "regius-tests")
+    preseed.setdefault("config_cache", False)
+
+    config = Config()
+    config.log = logger or log
+    config.loader = None
+    config.init_library()
+    config.load_configuration_from_files({"preseed": preseed, "paths": {"config": directory}})
+    return config
+
+def log(level, data, replace_data = {}):
+    """
+    Logger which drops everything.
+    """
+
+class Loader:
+    """
+    Loader stand-in which instantiates libraries with passed config and
+    logger.
+    """
+
+    def __init__(self, config, logger = None):
+        self.config = config
+        self.log = logger or log
+        self.libraries = {"config": config}
+        config.loader = self
+
+    def request_library(self, type, name):
+        if name not in self.libraries:
+            module = importlib.import_module("lib.{0}.{1}".format(type, name))
+            library = getattr(module, name.capitalize())()
+            library.loader = self
+            library.log = self.log
+            library.config = self.config
+            self.libraries[name] = library
+            library.init_library()
+        return self.libraries[name]
+
+class Recorder:
+    """
+    Logger which keeps formatted messages.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def __call__(self, level, data, replace_data = {}):
+        colors = {color: "" for color in ("RED", "GREEN", "YELLOW", "BLUE", "MAGENTA", "CYAN", "RESET")}
+        self.messages.append(data.format(**colors, **replace_data))
+
+def register_protocol(name, protocol_class):
+    """
+    Makes protocol class importable as lib.protocols.{name}.
+    """
+    if "lib.protocols" not in sys.modules:
+        sys.modules["lib.protocols"] = types.ModuleType("lib.protocols")
+    module = types.ModuleType("lib.protocols." + name)
+    setattr(module, name.capitalize(), protocol_class)
+    sys.modules["lib.protocols." + name] = module
@@ -0,0 +1,179 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import json
+import os
+import time
+import types
+
+import pytest
+
+import helpers
+from lib.common_libs import common
+from lib.common_libs.config_types.json import JSON
+
+def test_json_watches_only_configuration_directories(tmp_path):
+    backend = JSON(helpers.log, None)
+    backend.load_configuration("test", str(tmp_path))
+
+    directories = backend.get_directories()
+    assert directories[0] == str(tmp_path)
+    assert common.TEMP_SETTINGS["SCRIPT_PATH"] not in directories
+
+def write_json(path, values):
+    with open(path, "w") as cfg:
+        cfg.write(json.dumps(values))
+
+def test_saved_values_do_not_override_changed_file(tmp_path):
+    config = helpers.get_config({"app": {"name": "initial"}}, str(tmp_path))
+    config.set_value("json", "app", "name", "set")
+    config.save_configuration()
+
+    write_json(tmp_path / "config.json", {"app": {"name": "edited"}})
+    config.reload_configuration()
+
+    assert config.get_value("all", "app", "name") == "edited"
+
+def test_value_rejected_on_reload_is_kept_after_set_value(tmp_path):
+    config = helpers.get_config({"app": {"port": "80"}}, str(tmp_path))
+    config.register_schema("app", {"port": {"type": int}})
+
+    write_json(tmp_path / "config.json", {"app": {"port": "eighty"}})
+    assert config.reload_configuration() == {}
+    # Snapshot is rebuilt after set_value().
+    config.set_value("json", "app", "name", "test")
+    assert config.get_value("all", "app", "port") == 80
+
+    write_json(tmp_path / "config.json", {"app": {"port": "8080"}})
+    assert config.reload_configuration() == {("app", "port"): (80, 8080)}
+
+def test_snapshot_is_invalidated_on_set_value(tmp_path):
+    recorder = helpers.Recorder()
+    config = helpers.get_config({"app": {"name": "initial"}, "config": {"save_delay": 0}}, str(tmp_path), recorder)
+    recorder.messages.clear()
+
+    assert config.get_value("all", "app", "name") == "initial"
+    # Snapshot lookups are not logged.
+    assert recorder.messages == []
+
+    config.set_value("json", "app", "name", "changed")
+    assert config.get_value("all", "app", "name") == "changed"
+    assert config.get_value("all", "app", "unknown") is None
+
+def test_schema_values_are_parsed_once_on_load(tmp_path):
+    config = helpers.get_config({"app": {"port": "8080", "debug": "Yes", "verbose": "off", "ratio": 0, "name": ""}}, str(tmp_path))
+    config.register_schema("app", {
+        "port"          : {"type": int, "validator": lambda value: 0 < value < 65536},
+        "debug"         : {"type": bool},
+        "verbose"       : {"type": bool, "default": True},
+        "ratio"         : {"type": float, "default": 1},
+        "name"          : {"type": str, "default": "regius"},
+        "missing"       : {"type": int, "default": 5}
+    })
+
+    values = {key: config.get_value("all", "app", key) for key in ("port", "debug", "verbose", "ratio", "name", "missing")}
+    # Configured 0 and False are kept, empty string means default.
+    assert values == {"port": 8080, "debug": True, "verbose": False, "ratio": 0.0, "name": "regius", "missing": 5}
+    assert isinstance(values["ratio"], float)
+
+def test_invalid_schema_value_fails_on_load(monkeypatch):
+    recorder = helpers.Recorder()
+    # Exceptions are logging thru application's loader.
+    loader = helpers.Loader(helpers.get_config(), recorder)
+    loader.libraries["logger"] = types.SimpleNamespace(log = recorder)
+    monkeypatch.setattr(common, "LOADER", loader)
+    schema = {
+        "port"          : {"type": int, "validator": lambda value: 0 < value < 65536},
+        "debug"         : {"type": bool}
+    }
+
+    for key, value, error in (("port", "70000", "'70000' is not valid"), ("debug", "maybe", "'maybe' is not a boolean value")):
+        config = helpers.get_config({"app": {key: value}})
+        # Critical configuration exception exits application.
+        with pytest.raises(SystemExit):
+            config.register_schema("app", schema)
+        assert "Invalid configuration value for 'app/{0}': {1}".format(key, error) in recorder.messages
+
+def test_invalid_value_is_not_set(tmp_path):
+    config = helpers.get_config({"app": {"port": "80"}, "config": {"save_delay": 0}}, str(tmp_path))
+    config.register_schema("app", {"port": {"type": int}})
+
+    config.set_value("json", "app", "port", "eighty")
+
+    assert config.get_value("all", "app", "port") == 80
+
+def test_only_changed_fragments_are_parsed_again(tmp_path, monkeypatch):
+    # Cache is kept in user's configuration directory.
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    directory = tmp_path / "config"
+    directory.mkdir()
+    (directory / "first.ini").write_text("[first]\nkey = 1\n")
+    (directory / "second.ini").write_text("[second]\nkey = 1\n")
+    helpers.get_config(directory = str(directory), config_cache = True)
+
+    (directory / "second.ini").write_text("[second]\nkey = 22\n")
+    recorder = helpers.Recorder()
+    config = helpers.get_config(directory = str(directory), logger = recorder, config_cache = True)
+
+    parsed = [message for message in recorder.messages if message.startswith("Loading configuration file")]
+    assert parsed == ["Loading configuration file '{0}'".format(directory / "second.ini")]
+    assert config.get_value("ini", "first", "key") == 1
+    assert config.get_value("ini", "second", "key") == 22
+
+def test_burst_of_changes_is_saved_once(tmp_path, monkeypatch):
+    config = helpers.get_config({"app": {"name": "initial"}, "config": {"save_delay": 0.2}}, str(tmp_path))
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda source, destination: replaced.append(destination) or replace(source, destination))
+
+    for index in range(10):
+        config.set_value("json", "app", "name", "name{0}".format(index))
+    assert replaced == []
+    time.sleep(0.5)
+
+    assert replaced == [str(tmp_path / "config.json")]
+    assert json.loads((tmp_path / "config.json").read_text())["app"]["name"] == "name9"
+    assert sorted(os.listdir(tmp_path)) == ["config.json"]
+
+def test_pending_changes_are_saved_on_shutdown(tmp_path):
+    config = helpers.get_config({"app": {"name": "initial"}, "config": {"save_delay": 60}}, str(tmp_path))
+    config.set_value("json", "app", "name", "changed")
+
+    config.on_shutdown()
+
+    assert json.loads((tmp_path / "config.json").read_text())["app"]["name"] == "changed"
+
+def test_environment_overlays_configuration(tmp_path, monkeypatch):
+    monkeypatch.setenv("REGIUS_APP__PORT", "8080")
+    monkeypatch.setenv("REGIUS_APP__DEBUG", "off")
+    monkeypatch.setenv("REGIUS_APP__NAME", "")
+    monkeypatch.setenv("REGIUS_OTHER__TIMEOUT", "30")
+    monkeypatch.setenv("OTHER_APP__HOST", "example.com")
+    monkeypatch.setenv("DEBUG", "1")
+    config = helpers.get_config({"app": {"port": "80", "debug": "yes", "name": "configured"}}, str(tmp_path))
+    config.register_schema("app", {"port": {"type": int}, "debug": {"type": bool}})
+
+    config.parse_env()
+
+    assert config.get_value("all", "app", "port") == 8080
+    assert config.get_value("all", "app", "debug") is False
+    # Empty variables are not overriding configuration.
+    assert config.get_value("all", "app", "name") == "configured"
+    # Numeric values of keys without schema are converted to integers.
+    assert config.get_value("all", "other", "timeout") == 30
+    assert config.get_value("all", "app", "host") is None
+    assert config.get_temp_value("env") == {"DEBUG": "1"}
@@ -0,0 +1,238 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+import threading
+
+import pytest
+import sqlalchemy
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy.pool.base import _ConnectionFairy
+
+import helpers
+from lib.common_libs.database_types.instrumentation import QueryInstrumentation
+
+metadata = MetaData()
+users = Table("users", metadata, Column("id", Integer, primary_key = True), Column("name", String))
+
+class CopyCursor:
+    """
+    Cursor which loads COPY text format data with INSERTs, so copy_rows()
+    might be tested on SQLite.
+    """
+
+    # Data of every COPY, in text format.
+    copied = []
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def copy_expert(self, query, data):
+        table = query.split()[1].strip('"')
+        data = data.read()
+        self.copied.append(data)
+        for line in data.splitlines():
+            values = [None if value == "\\N" else value for value in line.split("\t")]
+            self.cursor.execute("INSERT INTO {0} VALUES ({1})".format(table, ", ".join("?" for value in values)), values)
+
+def get_database(values = None, replicas = 0):
+    database = helpers.Loader(helpers.get_config(values)).request_library("common_libs", "database")
+    database.create_standin_connection("main", replicas = replicas)
+    metadata.create_all(database.get_database_connection())
+    return database
+
+def use_copy_cursor(monkeypatch, database):
+    """
+    Makes stand-in connection look like PostgreSQL with psycopg2, with
+    COPY executed by CopyCursor.
+    """
+    engine = database.get_database_connection()
+    monkeypatch.setattr(engine.dialect, "name", "postgresql")
+    monkeypatch.setattr(engine.dialect, "driver", "psycopg2")
+    monkeypatch.setattr(_ConnectionFairy, "cursor", lambda self: CopyCursor(self.dbapi_connection.cursor()))
+    CopyCursor.copied = []
+
+def test_copy_value_escaping(monkeypatch):
+    database = get_database()
+    use_copy_cursor(monkeypatch, database)
+
+    database.copy_rows(users, [{"id": 1, "name": None}, {"id": 2, "name": "a\tb\nc\\d"}, {"id": 3, "name": b"\x00\xff"}, {"id": 4, "name": {"a": [1, "b\tc"]}}])
+
+    assert CopyCursor.copied[0].splitlines() == ["1\t\\N", "2\ta\\tb\\nc\\\\d", "3\t\\\\x00ff", '4\t{"a": [1, "b\\\\tc"]}']
+
+def test_write_query_matches_copy_from_only():
+    database = get_database()
+
+    assert database.WRITE_QUERY.match('COPY "users" ("id", "name") FROM STDIN').group(1) == "users"
+    assert database.WRITE_QUERY.match('COPY "users" ("id", "name") TO STDOUT') is None
+
+def test_copy_rows_invalidates_cache_and_is_accounted(monkeypatch):
+    database = get_database()
+    use_copy_cursor(monkeypatch, database)
+
+    assert database.cached_query("SELECT count(*) FROM users") == ((0, ), )
+    assert database.copy_rows(users, [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]) == 2
+    assert database.cached_query("SELECT count(*) FROM users") == ((2, ), )
+
+    statistics = {stats["statement"]: stats for stats in database.get_query_statistics()}
+    assert statistics["COPY users (id, name) FROM STDIN"]["rows"] == 2
+
+def test_async_connection_pool_statistics(tmp_path):
+    database = helpers.Loader(helpers.get_config({"database": {"async_type": "sqlite", "async_dbname": str(tmp_path / "async.sqlite")}})).request_library("common_libs", "database")
+
+    async def run():
+        await database.create_async_connection("async")
+        async with database.async_session_scope() as session:
+            await session.execute(sqlalchemy.text("SELECT 1"))
+        statistics = database.get_pool_statistics("async")
+        await database.close_async_connections()
+        return statistics
+
+    statistics = asyncio.run(run())
+    assert statistics is not None
+    assert statistics["checkouts"] >= 1
+
+def test_scoped_sessions_are_closed_with_thread_and_task():
+    database = get_database()
+    registry = database.get_scoped_session()
+
+    def use_session():
+        registry().execute(sqlalchemy.text("SELECT 1"))
+
+    thread = threading.Thread(target = use_session)
+    thread.start()
+    thread.join()
+    assert not registry.registry.registry
+
+    async def use_session_in_task():
+        use_session()
+
+    async def run():
+        await asyncio.create_task(use_session_in_task())
+        # Done callbacks are called in next loop iteration.
+        await asyncio.sleep(0)
+        return registry.registry.registry
+
+    assert not asyncio.run(run())
+    assert database.get_database_connection().pool.checkedout() == 0
+
+def test_connection_schemas_are_registered_on_init():
+    config = helpers.get_config({"database": {"main_type": "sqlite", "main_dbname": ":memory:", "main_pool_size": "3", "reports_async_type": "sqlite+aiosqlite"}})
+    helpers.Loader(config).request_library("common_libs", "database")
+
+    # Values are parsed and defaults are applied without creating
+    # connections.
+    assert config.get_value("all", "database", "main_pool_size") == 3
+    assert config.get_value("all", "database", "main_replicas") == ""
+    assert config.get_value("all", "database", "reports_pool_size") == 5
+    # "reports_async_type" is not option of "reports_async" connection.
+    assert config.get_value("all", "database", "reports_async_pool_size") is None
+
+def test_standin_connection_pool_statistics():
+    database = get_database()
+
+    with database.session_scope() as session:
+        session.execute(sqlalchemy.select(users))
+
+    assert database.get_pool_statistics("main")["checkouts"] >= 1
+
+def test_routing_session_sends_reads_to_replica_and_writes_to_primary():
+    database = get_database(replicas = 1)
+    primary = database.get_database_connection("main")
+    replica = database.get_database_connection("main_replica0")
+
+    with database.session_scope() as session:
+        assert session.get_bind(clause = sqlalchemy.select(users)) is replica
+        assert session.get_bind(clause = sqlalchemy.text("SELECT * FROM users")) is replica
+        # FOR UPDATE locks rows on primary, and session sticks to it.
+        assert session.get_bind(clause = sqlalchemy.select(users).with_for_update()) is primary
+        assert session.get_bind(clause = sqlalchemy.select(users)) is primary
+
+    with database.session_scope() as session:
+        # Replica is read-only, so write would fail there.
+        session.execute(users.insert().values(id = 1, name = "a"))
+        # Session reads its own write from primary.
+        assert session.get_bind(clause = sqlalchemy.select(users)) is primary
+        assert session.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(users)).scalar() == 1
+
+    with database.session_scope() as session:
+        assert session.get_bind(clause = sqlalchemy.select(users)) is replica
+        assert session.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(users)).scalar() == 1
+
+def test_cached_query_tells_apart_literal_values():
+    database = get_database()
+    database.bulk_insert(users, [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+
+    query = sqlalchemy.select(users.c.name).where(users.c.id == 1)
+    assert database.cached_query(query) == (("a", ), )
+    assert database.cached_query(sqlalchemy.select(users.c.name).where(users.c.id == 2)) == (("b", ), )
+    assert database.cached_query("SELECT name FROM users WHERE id = :id", {"id": 2}) == (("b", ), )
+    assert database.cached_query(query) == (("a", ), )
+    assert database.get_cache_statistics()["hits"] == 1
+
+def test_query_normalization():
+    instrumentation = QueryInstrumentation(helpers.log, 0)
+    instrumentation.record("SELECT * FROM users WHERE id = $1 AND name = $2 AND age > 18", 0.1, 1)
+    instrumentation.record("SELECT * FROM users WHERE id = %(id)s AND name IN ('a', 'b''c')", 0.1, 1)
+    instrumentation.record("INSERT INTO users (id, name) VALUES (:id, :name), (:id_1, :name_1)", 0.1, 1)
+
+    assert [stats["statement"] for stats in instrumentation.get_top()] == [
+        "SELECT * FROM users WHERE id = ? AND name = ? AND age > ?",
+        "SELECT * FROM users WHERE id = ? AND name IN (...)",
+        "INSERT INTO users (id, name) VALUES (...), ..."
+    ]
+
+def test_upsert_is_refused_for_unsupported_database(monkeypatch):
+    database = get_database()
+    monkeypatch.setattr(database.get_database_connection().dialect, "name", "mssql")
+
+    with pytest.raises(ValueError):
+        database.upsert(users, [{"id": 1, "name": "a"}])
+
+def test_stream_query_fetches_rows_in_portions(monkeypatch):
+    database = get_database()
+    database.bulk_insert(users, [{"id": index, "name": str(index)} for index in range(25)])
+    fetches = []
+
+    class FetchCursor(CopyCursor):
+        def fetchmany(self, size):
+            rows = self.cursor.fetchmany(size)
+            fetches.append((size, len(rows)))
+            return rows
+
+    monkeypatch.setattr(_ConnectionFairy, "cursor", lambda self: FetchCursor(self.dbapi_connection.cursor()))
+    engine = database.get_database_connection()
+
+    rows = database.stream_query("SELECT id, name FROM users ORDER BY id", fetch_size = 10, tuples = True)
+    assert next(rows) == (0, "0")
+    # Only first portion is fetched, connection is in use.
+    assert fetches == [(10, 10)]
+    assert engine.pool.checkedout() == 1
+
+    assert list(rows) == [(index, str(index)) for index in range(1, 25)]
+    assert [size for size, count in fetches] == [10] * len(fetches)
+    assert sum(count for size, count in fetches) == 25
+    assert engine.pool.checkedout() == 0
+
+    # Closed generator releases connection too.
+    rows = database.stream_query(sqlalchemy.select(users), fetch_size = 10)
+    assert next(rows).name == "0"
+    rows.close()
+    assert engine.pool.checkedout() == 0
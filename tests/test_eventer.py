@@ -0,0 +1,47 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+
+import helpers
+
+class Listener:
+    """
+    Events are added by libraries, eventer looks at caller's class.
+    """
+    def __init__(self, eventer):
+        self.fired = []
+        eventer.add_event("test")
+        eventer.add_event_handler("test", self.fired.append, 1)
+
+def test_events_are_fired_on_recreated_loop():
+    config = helpers.get_config()
+    config.set_temp_value("eventer", {"suppress_fire_messages": True})
+    loader = helpers.Loader(config)
+    eventer = loader.request_library("common_libs", "eventer")
+    eventloop = loader.request_library("common_libs", "eventloop")
+    fired = Listener(eventer).fired
+
+    eventer.fire_event_soon("test", "old loop")
+    eventloop.get_loop().run_until_complete(asyncio.sleep(0))
+    # As in forked worker.
+    loop = eventloop.recreate_loop()
+    eventer.fire_event_soon("test", "new loop")
+    loop.run_until_complete(asyncio.sleep(0))
+    eventloop.on_shutdown()
+
+    assert fired == ["old loop", "new loop"]
@@ -0,0 +1,33 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+import time
+
+import helpers
+
+def test_startup_is_not_measured_as_lag():
+    eventloop = helpers.Loader(helpers.get_config({"eventloop": {"lag_interval": 0.05, "lag_warning": 0.1}})).request_library("common_libs", "eventloop")
+    # Startup work done before loop starts running.
+    time.sleep(0.3)
+
+    eventloop.get_loop().run_until_complete(asyncio.sleep(0.2))
+    eventloop.on_shutdown()
+
+    statistics = eventloop.get_lag_statistics()
+    assert statistics["count"] >= 2
+    assert statistics["max"] < 0.1
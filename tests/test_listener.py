@@ -0,0 +1,363 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+import types
+
+import pytest
+
+import helpers
+from lib.common_libs.listener import Listener
+from lib.common_libs.protocol import LineProtocol
+
+class Square(LineProtocol):
+    """
+    Responds with squared number and PID of process which computed it.
+    """
+
+    @staticmethod
+    def process_request(request):
+        return "{0}:{1}".format(int(bytes(request)) ** 2, os.getpid()).encode()
+
+class Blocking(LineProtocol):
+    """
+    Responds with request when "release" event is set.
+    """
+
+    release = threading.Event()
+
+    @staticmethod
+    def process_request(request):
+        Blocking.release.wait(10)
+        return bytes(request)
+
+helpers.register_protocol("square", Square)
+helpers.register_protocol("blocking", Blocking)
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def get_listener(values):
+    values.setdefault("eventloop", {"lag_interval": 0})
+    return helpers.Loader(helpers.get_config(values)).request_library("common_libs", "listener")
+
+def run_listener(values):
+    get_listener(values).start_listening()
+
+def run_on_listener(listener, function):
+    """
+    Starts listening in this process, runs coroutine function on
+    listener's loop and stops listening when it is finished.
+
+    @retval result Coroutine's result.
+    """
+    loop = listener.loader.request_library("common_libs", "eventloop").get_loop()
+    outcome = {}
+
+    async def run():
+        # Loop also runs while server is started, and SIGTERM handler is
+        # installed when listener is listening.
+        while signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            await asyncio.sleep(0.01)
+
+        try:
+            outcome["result"] = await function()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            loop.stop()
+
+    loop.create_task(run())
+    listener.start_listening()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
+
+def serve(listener, client):
+    """
+    Starts listening in this process and executes client function in
+    thread. Listener is drained when client is finished.
+
+    @retval result Client's result.
+    """
+    loop = listener.loader.request_library("common_libs", "eventloop").get_loop()
+    outcome = {}
+
+    def run():
+        # SIGTERM handler is installed when listener is listening.
+        while signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            time.sleep(0.01)
+
+        try:
+            outcome["result"] = client()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            # Listener might be drained by client already.
+            loop.call_soon_threadsafe(listener.drain)
+
+    thread = threading.Thread(target = run)
+    thread.start()
+    listener.start_listening()
+    thread.join()
+    listener.on_shutdown()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
+
+def is_closed(sock, timeout):
+    """
+    Waits until connection is closed by server.
+    """
+    sock.settimeout(timeout)
+    try:
+        return sock.recv(1) == b""
+    except ConnectionResetError:
+        return True
+
+def read_lines(sock, count, timeout):
+    data = b""
+    deadline = time.monotonic() + timeout
+    while data.count(b"\n") < count and time.monotonic() < deadline:
+        sock.settimeout(max(deadline - time.monotonic(), 0.01))
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data.splitlines()
+
+def test_prefork_with_process_dispatch():
+    port = get_free_port()
+    values = {"listener": {"protocol": "square", "address": "127.0.0.1", "port": port, "mode": "prefork", "workers": 2, "dispatch": "process", "dispatch_workers": 2, "drain_timeout": 1}}
+    # Supervisor must not be daemonic too, as it starts workers.
+    supervisor = multiprocessing.get_context("fork").Process(target = run_listener, args = (values, ))
+    supervisor.start()
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout = 1)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        with sock:
+            sock.sendall(b"2\n3\n4\n")
+            responses = [line.split(b":") for line in read_lines(sock, 3, 10)]
+
+        assert [response[0] for response in responses] == [b"4", b"9", b"16"]
+        # Requests were processed by dispatch pool processes.
+        assert supervisor.pid not in [int(response[1]) for response in responses]
+    finally:
+        os.kill(supervisor.pid, signal.SIGTERM)
+        supervisor.join(30)
+
+    assert supervisor.exitcode == 0
+
+def test_failed_dispatch_does_not_occupy_queue(monkeypatch):
+    listener = get_listener({"listener": {"protocol": "square", "address": "127.0.0.1", "port": 0, "dispatch": "thread"}})
+
+    def submit(self, *args, **kwargs):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(concurrent.futures.ThreadPoolExecutor, "submit", submit)
+
+    async def dispatch():
+        with pytest.raises(RuntimeError):
+            listener.dispatch(Square.process_request, b"2")
+
+    run_on_listener(listener, dispatch)
+    listener.on_shutdown()
+
+    stats = listener.get_statistics()
+    assert stats["dispatch_queue"] == 0
+    assert stats["requests_dispatched"] == 0
+    assert stats["requests_failed"] == 1
+
+def test_cancelled_dispatch_occupies_queue_until_finished():
+    listener = get_listener({"listener": {"protocol": "square", "address": "127.0.0.1", "port": 0, "dispatch": "thread"}})
+    release = threading.Event()
+
+    async def dispatch():
+        future = listener.dispatch(release.wait)
+        await asyncio.sleep(0.05)
+        # As on lost connection.
+        future.cancel()
+        await asyncio.sleep(0.05)
+        queued = listener.get_statistics()["dispatch_queue"]
+        release.set()
+        await asyncio.sleep(0.05)
+        return queued, listener.get_statistics()["dispatch_queue"]
+
+    assert run_on_listener(listener, dispatch) == (1, 0)
+    listener.on_shutdown()
+
+def test_read_buffer_grows_when_reads_fill_it():
+    class Transport(asyncio.Transport):
+        def is_closing(self):
+            return False
+
+    class Lines(LineProtocol):
+        def frame_received(self, frame):
+            frames.append(bytes(frame))
+
+    frames = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        protocol = Lines()
+        protocol.connection_made(Transport())
+        sizes = []
+        for index in range(5):
+            buffer = protocol.get_buffer(-1)
+            sizes.append(len(buffer))
+            # Every read ends on frame boundary, so everything is
+            # consumed.
+            buffer[:] = b"x" * (len(buffer) - 1) + b"\n"
+            protocol.buffer_updated(len(buffer))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    assert sizes == [4096, 8192, 16384, 32768, 65536]
+    assert len(frames) == 5
+
+def test_connection_and_read_buffer_limits():
+    port = get_free_port()
+    listener = get_listener({"listener": {"protocol": "square", "address": "127.0.0.1", "port": port, "max_connections": 2, "read_buffer_limit": 4096, "idle_timeout": 1, "drain_timeout": 1}})
+
+    def client():
+        results = {}
+        with socket.create_connection(("127.0.0.1", port)) as idle, socket.create_connection(("127.0.0.1", port)) as active:
+            for sock in (idle, active):
+                sock.sendall(b"3\n")
+                assert read_lines(sock, 1, 5)[0].startswith(b"9:")
+
+            with socket.create_connection(("127.0.0.1", port)) as rejected:
+                results["rejected"] = is_closed(rejected, 5)
+
+            active.close()
+            # Unconsumed data above read buffer limit.
+            with socket.create_connection(("127.0.0.1", port)) as flooding:
+                flooding.sendall(b"1" * 10000)
+                results["flooding"] = is_closed(flooding, 5)
+
+            results["idle"] = is_closed(idle, 5)
+        return results
+
+    assert serve(listener, client) == {"rejected": True, "flooding": True, "idle": True}
+    stats = listener.get_statistics()
+    assert stats["connections_rejected"] == 1
+    assert stats["connections_idle"] == 1
+
+def test_pipeline_depth_limits_dispatched_requests():
+    port = get_free_port()
+    listener = get_listener({"listener": {"protocol": "blocking", "address": "127.0.0.1", "port": port, "dispatch": "thread", "pipeline_depth": 2, "drain_timeout": 1}})
+    Blocking.release.clear()
+
+    def client():
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(b"1\n2\n3\n4\n5\n")
+            time.sleep(0.3)
+            stats = listener.get_statistics()
+            Blocking.release.set()
+            return stats, read_lines(sock, 5, 5)
+
+    stats, responses = serve(listener, client)
+    # Other requests are left in read buffer until responses are written.
+    assert stats["requests_dispatched"] == 2
+    assert stats["dispatch_queue"] == 2
+    assert responses == [b"1", b"2", b"3", b"4", b"5"]
+
+def test_sigterm_drains_connections_with_requests_in_flight():
+    port = get_free_port()
+    listener = get_listener({"listener": {"protocol": "blocking", "address": "127.0.0.1", "port": port, "dispatch": "thread", "drain_timeout": 5}})
+    Blocking.release.clear()
+
+    def client():
+        results = {}
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(b"1\n")
+            time.sleep(0.1)
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.1)
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                results["refused"] = False
+            except ConnectionRefusedError:
+                results["refused"] = True
+
+            Blocking.release.set()
+            results["response"] = read_lines(sock, 1, 5)
+            results["closed"] = is_closed(sock, 5)
+        return results
+
+    started = time.monotonic()
+    assert serve(listener, client) == {"refused": True, "response": [b"1"], "closed": True}
+    # Drain finished without waiting for drain_timeout.
+    assert time.monotonic() - started < 5
+
+def test_sighup_starts_new_process_with_listening_sockets(monkeypatch):
+    port = get_free_port()
+    listener = get_listener({"listener": {"protocol": "square", "address": "127.0.0.1", "port": port, "drain_timeout": 1}})
+    started = []
+
+    def popen(args, env, pass_fds):
+        with socket.socket(fileno = os.dup(pass_fds[0])) as inherited:
+            started.append({"fds": env[Listener.LISTENER_FDS_ENV], "parent": env[Listener.LISTENER_PARENT_ENV], "pass_fds": pass_fds, "port": inherited.getsockname()[1]})
+        return types.SimpleNamespace(pid = 0)
+
+    monkeypatch.setattr(subprocess, "Popen", popen)
+
+    def client():
+        os.kill(os.getpid(), signal.SIGHUP)
+        time.sleep(0.1)
+
+    serve(listener, client)
+
+    assert len(started) == 1
+    assert started[0]["fds"] == ",".join(str(fd) for fd in started[0]["pass_fds"])
+    assert started[0]["parent"] == str(os.getpid())
+    assert started[0]["port"] == port
+
+def test_new_process_listens_on_inherited_socket(monkeypatch):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen()
+    port = sock.getsockname()[1]
+    # Configured port is busy, so inherited socket must be used.
+    listener = get_listener({"listener": {"protocol": "square", "address": "127.0.0.1", "port": port, "drain_timeout": 1}})
+    monkeypatch.setenv(Listener.LISTENER_FDS_ENV, str(sock.detach()))
+
+    def client():
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(b"5\n")
+            return read_lines(sock, 1, 5)[0].split(b":")[0]
+
+    assert serve(listener, client) == b"25"
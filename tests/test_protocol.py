@@ -0,0 +1,109 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+import struct
+
+import pytest
+
+from lib.common_libs.protocol import FixedSizeProtocol, LengthPrefixedProtocol, LineProtocol
+
+class Transport(asyncio.Transport):
+    """
+    Transport which is never closed.
+    """
+
+    def is_closing(self):
+        return False
+
+class Lines(LineProtocol):
+    @staticmethod
+    def encode(frame):
+        return frame + b"\n"
+
+class LengthPrefixed(LengthPrefixedProtocol):
+    @staticmethod
+    def encode(frame):
+        return struct.pack("!I", len(frame)) + frame
+
+class FixedSize(FixedSizeProtocol):
+    frame_size = 10000
+
+    @staticmethod
+    def encode(frame):
+        return frame
+
+class SmallFixedSize(FixedSize):
+    frame_size = 100
+
+def feed(protocol_class, reads):
+    """
+    Passes every read to protocol thru its read buffer, as selector
+    transport does.
+
+    @retval frames List of received frames.
+    """
+    frames = []
+
+    class Recording(protocol_class):
+        def frame_received(self, frame):
+            frames.append(bytes(frame))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        protocol = Recording()
+        protocol.connection_made(Transport())
+        for data in reads:
+            while data:
+                buffer = protocol.get_buffer(-1)
+                count = min(len(buffer), len(data))
+                buffer[:count] = data[:count]
+                protocol.buffer_updated(count)
+                data = data[count:]
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    return frames
+
+def get_frames(count, size = FixedSize.frame_size):
+    """
+    Returns count frames of size bytes, with data which does not
+    contain newline.
+    """
+    return [bytes([ord("a") + index % 26]) * size for index in range(count)]
+
+@pytest.mark.parametrize("protocol_class", (Lines, LengthPrefixed, FixedSize))
+def test_frame_split_across_reads(protocol_class):
+    data = b"".join(protocol_class.encode(frame) for frame in get_frames(2))
+
+    # Reads split frame data, header and delimiter.
+    reads = [data[:1], data[1:3], data[3:5000], data[5000:10000], data[10000:10003], data[10003:]]
+    assert feed(protocol_class, reads) == get_frames(2)
+
+@pytest.mark.parametrize("protocol_class", (Lines, LengthPrefixed, FixedSize))
+def test_frame_larger_than_initial_buffer(protocol_class):
+    assert FixedSize.frame_size > protocol_class.INITIAL_BUFFER_SIZE
+
+    assert feed(protocol_class, [protocol_class.encode(get_frames(1)[0])]) == get_frames(1)
+
+@pytest.mark.parametrize("protocol_class", (Lines, LengthPrefixed, SmallFixedSize))
+def test_pipelined_frames_in_one_read(protocol_class):
+    frames = get_frames(30, 100)
+
+    assert feed(protocol_class, [b"".join(protocol_class.encode(frame) for frame in frames)]) == frames
@@ -0,0 +1,126 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asyncio
+import json
+import time
+
+import helpers
+
+def get_timer(tmp_path, values = None, logger = None):
+    values = values or {}
+    values.setdefault("eventloop", {"lag_interval": 0})
+    values.setdefault("timer", {}).setdefault("schedule_file", str(tmp_path / "timers.json"))
+    return helpers.Loader(helpers.get_config(values), logger).request_library("common_libs", "timer")
+
+def run_loop(timer, seconds):
+    timer.timer_loop.run_until_complete(asyncio.sleep(seconds))
+
+def test_jitter_spreads_fire_times(tmp_path):
+    timer = get_timer(tmp_path, {"timer": {"resolution": 0.01}})
+    fired = []
+    for index in range(20):
+        timer.add_timer("timer{0}".format(index), "Jittered timer", lambda: fired.append(timer.timer_loop.time()), 0.05, False, jitter = 0.5)
+
+    run_loop(timer, 0.7)
+
+    assert len(fired) == 20
+    assert max(fired) - min(fired) > 0.1
+    # Timers with same timeout are landing on different ticks.
+    assert len({round(fire_time, 2) for fire_time in fired}) > 5
+
+def test_jitter_below_resolution_is_raised(tmp_path):
+    recorder = helpers.Recorder()
+    timer = get_timer(tmp_path, {"timer": {"resolution": 0.1}}, recorder)
+    timer.add_timer("timer", "Jittered timer", lambda: None, 1, False, jitter = 0.01)
+
+    assert "Warning: jitter 0.01s of timer 'timer' is below timer resolution, using 0.1s" in recorder.messages
+
+def test_schedules_of_timers_not_added_again_are_dropped(tmp_path):
+    schedule_file = tmp_path / "timers.json"
+    schedule_file.write_text(json.dumps({"kept": time.time() + 100, "retired": time.time() + 100, "forgotten": time.time() + 100}))
+    timer = get_timer(tmp_path)
+    timer.add_timer("kept", "Persistent timer", lambda: None, 300, True, persistent = True)
+    timer.remove_timer("forgotten", forget = True)
+
+    timer.on_shutdown()
+
+    assert list(json.loads(schedule_file.read_text())) == ["kept"]
+
+def test_idle_loop_is_not_woken_every_tick(tmp_path, monkeypatch):
+    timer = get_timer(tmp_path, {"timer": {"resolution": 0.01}})
+    wakeups = []
+    call_at = timer.timer_loop.call_at
+    monkeypatch.setattr(timer.timer_loop, "call_at", lambda when, *args, **kwargs: wakeups.append(when) or call_at(when, *args, **kwargs))
+    fired = []
+    timer.add_timer("far", "Far timer", lambda: None, 3600, False)
+    timer.add_timer("near", "Near timer", lambda: fired.append(True), 0.1, False)
+
+    run_loop(timer, 0.5)
+
+    assert fired == [True]
+    # Woken for near timer and slot cascades only, not on every of 50 ticks.
+    assert len(wakeups) < 10
+
+def test_only_inherited_timers_are_moved_to_recreated_loop(tmp_path):
+    timer = get_timer(tmp_path, {"timer": {"resolution": 0.01}})
+    fired = []
+    timer.add_timer("parent", "Parent timer", lambda: fired.append("parent"), 0.05, False, persistent = True)
+    timer.add_timer("inherited", "Inherited timer", lambda: fired.append("inherited"), 0.05, False, inherit = True)
+
+    # As in forked worker.
+    loop = timer.loader.request_library("common_libs", "eventloop").recreate_loop()
+    assert timer.timer_loop is loop
+    run_loop(timer, 0.3)
+    timer.on_shutdown()
+
+    assert fired == ["inherited"]
+    assert not (tmp_path / "timers.json").exists()
+
+def test_overlapping_runs_are_skipped(tmp_path):
+    timer = get_timer(tmp_path, {"timer": {"resolution": 0.01}})
+    running = []
+
+    async def callback():
+        running.append(timer.get_statistics("slow")["running"])
+        await asyncio.sleep(0.25)
+
+    timer.add_timer("slow", "Slow timer", callback, 0.1, True, mode = "coroutine", overlap = False)
+    run_loop(timer, 0.6)
+    statistics = timer.get_statistics("slow")
+    # Let last run finish.
+    timer.remove_timer("slow")
+    run_loop(timer, 0.3)
+    timer.on_shutdown()
+
+    assert running and max(running) == 1
+    assert statistics["skipped"] >= 2
+    assert statistics["runs"] + statistics["running"] == len(running)
+
+def test_unpicklable_process_callback_fails_run(tmp_path):
+    timer = get_timer(tmp_path, {"timer": {"resolution": 0.01}})
+    # Lambda can't be passed to process pool.
+    timer.add_timer("lambda", "Unpicklable timer", lambda: None, 0.05, True, mode = "process")
+
+    deadline = time.monotonic() + 10
+    while timer.get_statistics("lambda")["failed"] < 1 and time.monotonic() < deadline:
+        run_loop(timer, 0.1)
+    statistics = timer.get_statistics("lambda")
+    timer.on_shutdown()
+
+    assert statistics["failed"] >= 1
+    assert statistics["runs"] == 0
@@ -0,0 +1,117 @@
+# Regius application framework.
+# Copyright (c) 2015 - 2016, Stanislav N. aka pztrn <pztrn at pztrn dot name>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import random
+
+from lib.common_libs.timer_types.wheel import Wheel
+
+def expire_ticks(wheel, until):
+    """
+    Advances wheel tick by tick, returns name => tick it expired on.
+    """
+    expired = {}
+    for tick in range(wheel.get_current_tick() + 1, until + 1):
+        for name in wheel.advance(tick):
+            expired[name] = tick
+    return expired
+
+def test_entries_cascade_across_levels():
+    # 4 slots per level, level 1 slot covers 4 ticks, level 2 - 16.
+    wheel = Wheel(bits = 2, levels = 3)
+    for name, expires in (("level0", 3), ("level1", 9), ("level2", 45)):
+        wheel.add(name, expires)
+
+    assert wheel.get_next_tick() == 3
+    assert expire_ticks(wheel, 63) == {"level0": 3, "level1": 9, "level2": 45}
+    assert len(wheel) == 0
+
+def test_far_entries_are_parked_and_placed_again():
+    # Wheel covers 16 ticks only.
+    wheel = Wheel(bits = 2, levels = 2)
+    wheel.add("far", 100)
+
+    assert wheel.advance(99) == []
+    assert "far" in wheel
+    assert wheel.advance(100) == ["far"]
+
+    wheel.add("far", 200)
+    assert expire_ticks(wheel, 250) == {"far": 200}
+
+def test_removed_entry_does_not_expire():
+    wheel = Wheel(bits = 2, levels = 2)
+    wheel.add("kept", 10)
+    wheel.add("removed", 10)
+    wheel.add("parked", 100)
+    wheel.remove("removed")
+    wheel.remove("parked")
+    wheel.remove("unknown")
+
+    assert expire_ticks(wheel, 150) == {"kept": 10}
+    assert wheel.get_next_tick() is None
+
+def test_entry_added_again_on_expiration():
+    wheel = Wheel()
+    wheel.add("repeat", 5)
+
+    assert wheel.advance(5) == ["repeat"]
+    # Callback re-adds entry on time which already passed, or on future
+    # time.
+    wheel.add("repeat", 5)
+    assert wheel.get_next_tick() == 6
+    assert wheel.advance(6) == ["repeat"]
+    wheel.add("repeat", 1000)
+    assert wheel.advance(999) == []
+    assert wheel.advance(1000) == ["repeat"]
+
+def test_idle_ticks_are_skipped():
+    wheel = Wheel()
+    wheel.add("soon", 10)
+    wheel.add("later", 5000)
+    wheel.add("much_later", 10 ** 6)
+
+    assert wheel.get_next_tick() == 10
+    assert wheel.advance(10) == ["soon"]
+    # Next thing happening is a cascade of higher level slot, which
+    # is not later than expiration.
+    assert 10 < wheel.get_next_tick() <= 5000
+    assert wheel.advance(10 ** 6) == ["later", "much_later"]
+
+def test_entries_expire_on_their_ticks():
+    rng = random.Random(1)
+    wheel = Wheel(bits = 3, levels = 3)
+    expected = {}
+    current = 0
+    for step in range(2000):
+        name = "entry{0}".format(rng.randrange(200))
+        action = rng.random()
+        if action < 0.5:
+            expires = current + rng.choice((rng.randrange(-5, 10), rng.randrange(1000)))
+            wheel.add(name, expires)
+            expected[name] = max(expires, current + 1)
+        elif action < 0.6:
+            wheel.remove(name)
+            expected.pop(name, None)
+        else:
+            current += rng.randrange(1, 50)
+            for name in wheel.advance(current):
+                assert current - 50 < expected.pop(name) <= current
+
+    # Every remaining entry is expired in time.
+    current += 1000
+    for name in wheel.advance(current):
+        expected.pop(name)
+    assert not expected